@@ -1 +1,2 @@
-from .upy import Pico
\ No newline at end of file
+from .upy import Pico, ReplMode
+from .aio import AsyncPico
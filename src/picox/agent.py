@@ -0,0 +1,158 @@
+import hashlib
+
+from .exceptions import RemotePicoException
+
+# Module name the agent is installed and imported as on the device
+AGENT_MODULE = "_px"
+AGENT_FILE = f"/{AGENT_MODULE}.py"
+
+# Device side source. Each operation prints a compact result, errors are printed with the
+# failed marker so they are detected the same way as compiled commands
+AGENT_TEMPLATE = """import os
+from binascii import a2b_base64, b2a_base64, crc32
+
+VERSION = '@VERSION@'
+F = '@FAILED@'
+
+
+def _op(f):
+    def run(*a):
+        try:
+            f(*a)
+        except Exception as e:
+            print(str(e) + F)
+    return run
+
+
+def _exists(p):
+    try:
+        os.stat(p)
+        return True
+    except OSError:
+        return False
+
+
+@_op
+def ls(p=None):
+    print(os.listdir() if p is None else os.listdir(p))
+
+
+def _deflate(d):
+    from io import BytesIO
+    from deflate import DeflateIO, ZLIB
+    o = BytesIO()
+    w = DeflateIO(o, ZLIB, 10)
+    w.write(d)
+    w.close()
+    return o.getvalue()
+
+
+def _inflate(d):
+    from io import BytesIO
+    from deflate import DeflateIO, ZLIB
+    return DeflateIO(BytesIO(d), ZLIB).read()
+
+
+@_op
+def get(n, o=0, c=-1, b=3072, z=0):
+    if z:
+        try:
+            import deflate
+        except ImportError:
+            z = 0
+    print(os.stat(n)[6])
+    with open(n, 'rb') as f:
+        o = f.seek(o)
+        while c:
+            d = f.read(b if c < 0 else min(b, c))
+            if not d:
+                break
+            e = d
+            if z:
+                try:
+                    e = _deflate(d)
+                except Exception:
+                    z = 0
+            k = crc32(d, crc32(str(o).encode()))
+            if len(e) < len(d):
+                print(o, len(d), k, 'z', b2a_base64(e).decode().strip())
+            else:
+                print(o, len(d), k, b2a_base64(d).decode().strip())
+            o += len(d)
+            c -= len(d)
+
+
+@_op
+def put(n, d, m='a', z=0, o=0, k=None):
+    d = a2b_base64(d)
+    if z:
+        d = _inflate(d)
+    c = crc32(d, crc32(' '.join((n, m, str(o))).encode()))
+    if k is not None and c != k:
+        print('N', o, c)
+        return
+    if m == 'n':
+        if _exists(n):
+            raise OSError('EEXIST')
+        m = 'w'
+    with open(n, m + 'b') as f:
+        f.seek(o)
+        f.write(d)
+    print('A', o, c)
+
+
+@_op
+def mkdir(p, o=0):
+    if not _exists(p):
+        os.mkdir(p)
+    elif not o:
+        raise OSError('EEXIST')
+"""
+
+
+def build_agent_source(failed_marker: str) -> str:
+    """
+    Build the agent source for the device. The version is a hash of the source, so any change
+    to the agent is picked up and reinstalled
+    args:
+        failed_marker (str): Marker printed after an error message
+    returns:
+        str : Python source to save as the agent module on the device
+    """
+    source = AGENT_TEMPLATE.replace("@FAILED@", failed_marker)
+    version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+    return source.replace("@VERSION@", version)
+
+
+def agent_version(source: str) -> str:
+    """Get the version embedded in agent source"""
+    marker = "VERSION = '"
+    start = source.index(marker) + len(marker)
+    return source[start:source.index("'", start)]
+
+
+def agent_call(function: str, *args) -> str:
+    """
+    Build a short command that calls an agent function on the device
+    args:
+        function (str): Agent function name
+        args: Arguments, formatted with repr()
+    """
+    return f"import {AGENT_MODULE};{AGENT_MODULE}.{function}({','.join(map(repr, args))})"
+
+
+def agent_file_error(err: RemotePicoException, path: str) -> Exception:
+    """
+    Translate an agent error for a missing or existing path into the matching builtin exception
+    args:
+        err (RemotePicoException): Error raised by an agent call
+        path (str): Path the call operated on
+    returns:
+        Exception : FileNotFoundError, FileExistsError or the original error
+    """
+    message = err.remote_exception
+    if "ENOENT" in message or "[Errno 2]" in message:
+        return FileNotFoundError(f"'{path}' does not exist on Pico")
+    if "EEXIST" in message or "[Errno 17]" in message:
+        return FileExistsError(f"'{path}' already exists on the Pico. Set overwrite=True to overwrite.")
+    return err
@@ -0,0 +1,527 @@
+import os
+import ast
+import time
+import codecs
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import IO, AsyncIterator, Callable, List, Optional
+
+import serial
+
+from .exceptions import RemotePicoException, ResponseTimeout
+from .deadline import ResponseDeadline
+from .scanner import ResponseLineParser
+from .readiness import (BOOT_PROMPT_TIMEOUT, INTERRUPT_ATTEMPTS, PROMPT_TIMEOUT, REBOOT_BANNER_TIMEOUT,
+                        ConnectMetrics, DeviceEvent, ReadinessScanner)
+from .transfer import (ChunkSizer, DownloadLoop, ProgressCallback, UploadLoop, DOWNLOAD_BLOCK_SIZE, check_chunk_ack,
+                       download_resume_offset, frame_crc, parse_prefix_hash, should_compress, stream_size,
+                       upload_resume_offset)
+from .fs import FileEntry, parse_stat_line
+from .upy import EOM_MARKER, EOR_MARKER, FAILED_MARKER, RAW_REPL_EXIT, TERMINATOR, TRACEBACK_MARKER, UPY_PROMPT
+from .logconfig import LOGGER
+from .commands.compiled import HASH_PREFIX, READ_COMPRESSED_BLOCKS, READ_FILE_BLOCKS, STAT_PATH, WRITE_FRAMED_CHUNK
+
+
+class AsyncPico:
+    """
+    asyncio interface to a MicroPython RP2040 device. The device's file descriptor is watched by the event
+    loop and read without blocking, so one thread can drive many devices. Commands go through the friendly
+    REPL and responses are parsed by the same code as Pico. POSIX only.
+
+        pico = await AsyncPico.connect("/dev/ttyACM0")
+        print(await pico.run_python_command("print(1 + 1)"))
+        pico.close()
+    """
+    def __init__(self, fd: int, port: str, read_timeout: float = 15, on_close: Optional[Callable[[], None]] = None,
+                 write_timeout: Optional[float] = None):
+        """
+        Use connect() or open_fd(), which also get the device ready. Must be created in a running event loop
+        args:
+            fd (int): Open file descriptor of the device
+            port (str): Name of the device, for messages
+            read_timeout (float): Seconds to wait for the device to respond
+            on_close (Callable): Called by close(), e.g. to close the serial port that owns fd
+            write_timeout (float): Seconds to wait for the device to accept more data, 0.5 s if None
+        """
+        self._fd = fd
+        self._port = port
+        self._read_timeout = read_timeout
+        self._write_timeout = 0.5 if write_timeout is None else write_timeout
+        # Time limits of the call in progress, per task as calls from several tasks wait on each other for the device
+        self._deadline: ContextVar[Optional[ResponseDeadline]] = ContextVar(f"picox-deadline-{port}", default=None)
+        self._on_close = on_close
+        self._loop = asyncio.get_running_loop()
+        self._received = bytearray()
+        self._data_ready = asyncio.Event()
+        self._end_of_stream = False
+        self._command_lock = asyncio.Lock() # One command at a time on the device
+        self._connect_metrics: Optional[ConnectMetrics] = None
+        self._deflate_available: Optional[bool] = None # Unknown until a compressed chunk is sent
+        os.set_blocking(fd, False)
+        self._loop.add_reader(fd, self._on_readable)
+
+    @classmethod
+    async def connect(cls,
+                      serial_port: str,
+                      read_timeout: float = 15,
+                      skip_stop_exec: bool = False,
+                      skip_coms_test: bool = False,
+                      reboot_on_connect: bool = True,
+                      serial_factory: Callable[..., serial.Serial] = serial.Serial,
+                      serial_write_timeout: Optional[float] = None
+                      ) -> "AsyncPico":
+        """
+        Open a serial device and get it ready, see Pico for the arguments
+        raises:
+            IOError - If the device does not respond as MicroPython
+        """
+        started = time.perf_counter()
+        serial_device = serial_factory(port=serial_port, baudrate=115200, timeout=0)
+        pico = cls(serial_device.fileno(), serial_port, read_timeout, on_close=serial_device.close,
+                   write_timeout=serial_write_timeout)
+        await pico._prepare(started, skip_stop_exec, skip_coms_test, reboot_on_connect)
+        return pico
+
+    @classmethod
+    async def open_fd(cls,
+                      fd: int,
+                      port: str = "fd",
+                      read_timeout: float = 15,
+                      skip_stop_exec: bool = False,
+                      skip_coms_test: bool = False,
+                      reboot_on_connect: bool = True,
+                      on_close: Optional[Callable[[], None]] = None,
+                      write_timeout: Optional[float] = None
+                      ) -> "AsyncPico":
+        """
+        Use an already open file descriptor, such as picox.fake.SocketDevice, and get the device ready
+        raises:
+            IOError - If the device does not respond as MicroPython
+        """
+        pico = cls(fd, port, read_timeout, on_close, write_timeout)
+        await pico._prepare(time.perf_counter(), skip_stop_exec, skip_coms_test, reboot_on_connect)
+        return pico
+
+    async def _prepare(self, started: float, skip_stop_exec: bool, skip_coms_test: bool, reboot_on_connect: bool):
+        """ Stop the device and run the coms test, as Pico does on connect """
+        opened = time.perf_counter()
+        try:
+            interrupts = 0 if skip_stop_exec else await self.stop_exec(reboot=reboot_on_connect)
+            ready = time.perf_counter()
+            if not skip_coms_test and not await self.coms_test():
+                raise IOError("Did not get expected response from device during coms test")
+        except BaseException:
+            self.close()
+            raise
+        tested = time.perf_counter()
+        self._connect_metrics = ConnectMetrics(
+            open_seconds=opened - started,
+            ready_seconds=ready - opened,
+            coms_test_seconds=tested - ready,
+            total_seconds=tested - started,
+            rebooted=reboot_on_connect and not skip_stop_exec,
+            interrupts=interrupts,
+        )
+        LOGGER.debug(f"Connected to {self._port} in {(tested - started) * 1000:.1f} ms :: {self._connect_metrics}")
+
+    @property
+    def connect_metrics(self) -> Optional[ConnectMetrics]:
+        """Time taken by each step of connecting"""
+        return self._connect_metrics
+
+    def close(self):
+        """ Stop watching the device and close it """
+        if self._fd is None:
+            return
+        self._loop.remove_reader(self._fd)
+        self._fd = None
+        if self._on_close:
+            self._on_close()
+
+    async def __aenter__(self) -> "AsyncPico":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # ---- Non-blocking IO ----
+
+    def _on_readable(self):
+        """ Event loop callback, the device has sent something """
+        try:
+            data = os.read(self._fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b'' # e.g. EIO, the device was unplugged
+        if not data:
+            self._end_of_stream = True
+            self._loop.remove_reader(self._fd)
+        self._received += data
+        self._data_ready.set()
+
+    async def _read(self, timeout: Optional[float]) -> bytes:
+        """
+        Wait for data from the device and return everything received so far
+        args:
+            timeout (float): Seconds to wait, None waits forever
+        returns:
+            bytes : Received data, empty if the timeout passed
+        raises:
+            IOError - If the device has been closed or disconnected
+        """
+        if not self._received:
+            if self._end_of_stream:
+                raise IOError(f"{self._port} closed")
+            self._data_ready.clear()
+            try:
+                await asyncio.wait_for(self._data_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return b''
+            if not self._received:
+                raise IOError(f"{self._port} closed")
+        data = bytes(self._received)
+        self._received.clear()
+        return data
+
+    async def _write(self, data: bytes):
+        """
+        Write all of data, waiting for the device to accept more when its buffer is full
+        raises:
+            SerialTimeoutException - If the device accepts nothing for the write timeout, as serial.Serial does
+        """
+        LOGGER.debug(f"SEND {self._port} :: {data}")
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self._fd, view):]
+            except BlockingIOError:
+                writable = self._loop.create_future()
+                self._loop.add_writer(self._fd, writable.set_result, None)
+                try:
+                    await asyncio.wait_for(writable, self._write_timeout)
+                except asyncio.TimeoutError:
+                    raise serial.SerialTimeoutException(f"Write timeout on {self._port}") from None
+                finally:
+                    self._loop.remove_writer(self._fd)
+
+    async def _recv(self) -> bytes:
+        """
+        Wait for more of a response. Within a call with time limits each read waits for the idle timeout at most,
+        and nothing is read once the deadline has passed, see Pico._serial_recv
+        returns:
+            bytes : Empty if the read timed out
+        """
+        if (deadline := self._deadline.get()) is None:
+            return await self._read(self._read_timeout)
+        if deadline.expired:
+            return b''
+        return await self._read(deadline.read_timeout())
+
+    @asynccontextmanager
+    async def _time_limits(self, timeout: Optional[float], idle_timeout: Optional[float]):
+        """
+        Apply a call's time limits to every read made inside it, see ResponseDeadline and Pico._time_limits.
+        If they are hit the device is interrupted, so the session can still be used
+        """
+        if self._deadline.get() is not None or (timeout is None and idle_timeout is None):
+            yield
+            return
+        token = self._deadline.set(ResponseDeadline(timeout, idle_timeout, self._read_timeout))
+        try:
+            yield
+        except ResponseTimeout:
+            self._deadline.reset(token)
+            token = None
+            try:
+                await self.stop_exec(reboot=False)
+            except IOError as err:
+                LOGGER.warning(f"Could not interrupt {self._port} after a timeout :: {err}")
+            raise
+        finally:
+            if token is not None:
+                self._deadline.reset(token)
+
+    def _out_of_time(self) -> bool:
+        """ The deadline of the call in progress has passed """
+        return (deadline := self._deadline.get()) is not None and deadline.expired
+
+    def _reset_input(self):
+        """ Drop anything received and not yet read, like serial.Serial.reset_input_buffer """
+        self._received.clear()
+        while not self._end_of_stream:
+            try:
+                if not os.read(self._fd, 4096):
+                    break
+            except OSError:
+                break # Nothing waiting (BlockingIOError) or unreadable
+
+    # ---- Device state ----
+
+    async def stop_exec(self, reboot: bool = True) -> int:
+        """
+        Stop execution and wait until the device is at the REPL prompt, see Pico.stop_exec
+        returns:
+            int : Number of Ctrl+C sent
+        raises:
+            IOError - If the device never returns to the prompt
+        """
+        scanner = ReadinessScanner()
+        interrupts = await self._interrupt_to_prompt(scanner)
+        if reboot:
+            scanner.clear()
+            await self.send_soft_reboot()
+            if not await self._wait_for_event(scanner, DeviceEvent.SOFT_REBOOT, REBOOT_BANNER_TIMEOUT):
+                raise IOError(f"No soft reboot banner from {self._port}")
+            if not await self._wait_for_event(scanner, DeviceEvent.PROMPT, BOOT_PROMPT_TIMEOUT):
+                LOGGER.debug("Device busy after soft reboot (main.py), interrupting")
+                interrupts += await self._interrupt_to_prompt(scanner)
+        self._reset_input()
+        return interrupts
+
+    async def _interrupt_to_prompt(self, scanner: ReadinessScanner) -> int:
+        """ Send Ctrl+C until the device shows the friendly REPL prompt, leaving the raw REPL if needed """
+        for attempt in range(1, INTERRUPT_ATTEMPTS + 1):
+            scanner.clear()
+            await self._write(b'\x03')
+            if await self._wait_for_event(scanner, DeviceEvent.PROMPT, PROMPT_TIMEOUT):
+                return attempt
+            if attempt == 1 or DeviceEvent.RAW_PROMPT in scanner.events:
+                scanner.clear()
+                await self._write(RAW_REPL_EXIT)
+                if await self._wait_for_event(scanner, DeviceEvent.PROMPT, PROMPT_TIMEOUT):
+                    return attempt
+        raise IOError(f"{self._port} did not return to the REPL prompt after {INTERRUPT_ATTEMPTS} interrupts")
+
+    async def _wait_for_event(self, scanner: ReadinessScanner, event: DeviceEvent, timeout: float) -> bool:
+        """ Read device output until the scanner reports an event, False if the timeout passes first """
+        deadline = time.monotonic() + timeout
+        while event not in scanner.events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            scanner.feed(await self._read(remaining))
+        return True
+
+    async def send_soft_reboot(self):
+        """ Send soft reboot command (Ctrl+D) """
+        LOGGER.debug(f"Sending soft reboot to {self._port} (Ctrl+D)")
+        await self._write(b'\x04')
+
+    # ---- Commands ----
+
+    async def _communicate_lines(self, command: str) -> AsyncIterator[str]:
+        """
+        Send a single line command and yield its output lines as they arrive
+        raises:
+            RemotePicoException - If the command raised or printed the failed marker
+            ResponseTimeout - If the device stops responding
+        """
+        self._reset_input()
+        await self._write((command + EOM_MARKER + TERMINATOR).encode("utf8"))
+        parser = ResponseLineParser(EOM_MARKER, EOR_MARKER, FAILED_MARKER, TRACEBACK_MARKER, UPY_PROMPT.strip())
+        while not parser.done:
+            if not (recv_bytes := await self._recv()):
+                raise ResponseTimeout(f"Timed out waiting for response from {self._port}", parser.pending)
+            for line in parser.feed(recv_bytes):
+                yield line
+        if parser.failed_line is not None:
+            raise RemotePicoException("Detected exception from device", parser.failed_line)
+
+    async def _communicate(self, command: str) -> List[str]:
+        """
+        Run a command and return all of its output lines
+        raises:
+            ResponseTimeout - If the device stops responding, with every line received so far as its partial output
+        """
+        lines = []
+        async with self._command_lock:
+            try:
+                async for line in self._communicate_lines(command):
+                    lines.append(line)
+            except ResponseTimeout as err:
+                err.partial_output = "\r\n".join(lines + [err.partial_output] if err.partial_output else lines)
+                raise
+        return lines
+
+    async def coms_test(self) -> bool:
+        return await self._communicate("x = 1 + 1; print(x)") == ["2"]
+
+    async def run_python_command(self, command: str, timeout: Optional[float] = None,
+                                 idle_timeout: Optional[float] = None) -> str:
+        """
+        Run a generic python command. Multi-line commands are run with exec()
+        args:
+            timeout (float): Seconds for the command to finish, None for no limit
+            idle_timeout (float): Seconds the command may go without output. Defaults to the read timeout
+        raises:
+            RemotePicoException - If the command raised
+            ResponseTimeout - If a time limit passed first, with the output so far. The command is interrupted
+        """
+        if "\n" in command:
+            command = f"exec({command!r})"
+        async with self._time_limits(timeout, idle_timeout):
+            return "\r\n".join(await self._communicate(command))
+
+    async def get_file_list(self) -> List[str]:
+        """ Get a list of files stored on the device """
+        string_list = "".join(await self._communicate("import os; print(os.listdir())"))
+        if not (string_list.startswith("[") and string_list.endswith("]")):
+            raise RuntimeError(f"Did not get back a list from file listing command :: {string_list}")
+        return ast.literal_eval(string_list)
+
+    async def stat(self, pico_path) -> Optional[FileEntry]:
+        """ Type and size of a path on the device, None if it does not exist """
+        return parse_stat_line("".join(await self._communicate(STAT_PATH(pico_path))).strip(), str(pico_path))
+
+    async def get_mem_free(self) -> int:
+        """ Get free heap on the device in bytes, after a garbage collect """
+        return int("".join(await self._communicate("import gc; gc.collect(); print(gc.mem_free())")))
+
+    async def upload_file(self,
+                          local_fp: IO[bytes],
+                          pico_file_path,
+                          overwrite: bool = False,
+                          chunk_size: Optional[int] = None,
+                          progress_callback: Optional[ProgressCallback] = None,
+                          compress: Optional[bool] = None,
+                          resume: bool = False,
+                          timeout: Optional[float] = None,
+                          idle_timeout: Optional[float] = None
+                          ) -> int:
+        """
+        Upload a file from the host to the Pico in base64 chunks, each checked against its CRC32 on the device,
+        see Pico.upload_file. Chunks that are rejected, garbled or lost are sent again like Pico does
+        args:
+            timeout (float): Seconds for the whole upload, None for no limit
+            idle_timeout (float): Seconds to wait for each chunk to be acknowledged. Defaults to the read timeout
+        returns:
+            int : Number of bytes uploaded, not counting a resumed prefix that was already on the device
+        raises:
+            ResponseTimeout - If the timeout passed first
+        """
+        async with self._time_limits(timeout, idle_timeout):
+            offset = await self._resume_upload_offset(local_fp, pico_file_path) if resume else 0
+            if offset:
+                file_mode = "r+" # Write after the part that is already there
+            elif not (overwrite or resume) and await self.stat(pico_file_path) is not None:
+                raise FileExistsError(f"File '{pico_file_path}' already exists on the Pico. Set overwrite=True to overwrite.")
+            else:
+                file_mode = "w" # First chunk truncates, the rest are written at their offset
+
+            if chunk_size is None:
+                chunk_sizer = ChunkSizer(mem_free=await self.get_mem_free())
+            else:
+                chunk_sizer = ChunkSizer(fixed_size=chunk_size)
+            upload = UploadLoop(local_fp, pico_file_path, chunk_sizer, offset, file_mode, progress_callback=progress_callback)
+            if compress is None:
+                compress = should_compress(pico_file_path, upload.total_size)
+            upload.compress = compress and self._deflate_available is not False
+
+            try:
+                while (chunk := upload.next_chunk()) is not None:
+                    start = time.perf_counter()
+                    file_mode = upload.file_mode + "b"
+                    crc = frame_crc(chunk.data, pico_file_path, file_mode, chunk.position)
+                    try:
+                        ack = "".join(await self._communicate(WRITE_FRAMED_CHUNK(pico_file_path, file_mode, chunk.position,
+                                                                                 crc, int(chunk.packed), chunk.encoded)))
+                        check_chunk_ack(ack, chunk.position)
+                    except (RemotePicoException, IOError) as err:
+                        if upload.adapt(chunk, err):
+                            continue
+                        if upload.retry(err, self._out_of_time()):
+                            await self._recover_transfer()
+                            continue
+                        raise
+                    upload.acked(chunk, time.perf_counter() - start)
+            finally:
+                if upload.deflate_available is not None:
+                    self._deflate_available = upload.deflate_available
+            return upload.bytes_sent
+
+    async def _resume_upload_offset(self, local_fp: IO[bytes], pico_file_path) -> int:
+        """ Bytes of the remote file that match the start of local_fp, see Pico._resume_upload_offset """
+        if (local_size := stream_size(local_fp)) is None:
+            raise ValueError("Resuming an upload needs a seekable file")
+        remote = parse_prefix_hash("".join(await self._communicate(HASH_PREFIX(pico_file_path, local_size))).strip())
+        return upload_resume_offset(local_fp, local_size, remote, pico_file_path)
+
+    async def download_file(self,
+                            pico_filename,
+                            save_fp: IO,
+                            binary: bool = False,
+                            block_size: int = DOWNLOAD_BLOCK_SIZE,
+                            progress_callback: Optional[ProgressCallback] = None,
+                            compress: Optional[bool] = None,
+                            resume: bool = False,
+                            timeout: Optional[float] = None,
+                            idle_timeout: Optional[float] = None
+                            ) -> int:
+        """
+        Download a file from the Pico, writing each block to save_fp as it arrives, see Pico.download_file.
+        Blocks that arrive garbled, or not at all, are requested again like Pico does
+        args:
+            timeout (float): Seconds for the whole download, None for no limit
+            idle_timeout (float): Seconds the device may go quiet for. Defaults to the read timeout
+        returns:
+            int : Number of bytes downloaded, not counting a resumed prefix that was already saved
+        raises:
+            ResponseTimeout - If the timeout passed first
+        """
+        async with self._time_limits(timeout, idle_timeout):
+            if resume and not binary:
+                raise ValueError("Only binary downloads can be resumed")
+            if (entry := await self.stat(pico_filename)) is None or entry.is_dir:
+                raise FileNotFoundError(f"File '{pico_filename}' does not exist on Pico")
+            compress = should_compress(pico_filename, entry.size) if compress is None else compress
+            offset = await self._resume_download_offset(pico_filename, save_fp) if resume else 0
+
+            download = DownloadLoop(save_fp, pico_filename, binary, offset, progress_callback)
+            read_blocks = READ_COMPRESSED_BLOCKS if compress else READ_FILE_BLOCKS
+            async with self._command_lock:
+                while not download.done:
+                    position, count = download.request()
+                    try:
+                        header = None # Device sends the file size first
+                        async for line in self._communicate_lines(read_blocks(pico_filename, position, count, block_size)):
+                            if header is None:
+                                download.start(header := line)
+                            else:
+                                download.feed(line)
+                        if header is None:
+                            download.start(None)
+                    except (RemotePicoException, IOError) as err:
+                        if not download.retry(err, self._out_of_time()):
+                            raise
+                        await self._recover_transfer()
+                    except BaseException:
+                        await self._recover_transfer() # The device may still be sending the rest of the file
+                        raise
+                    download.check_progress()
+            return download.finish()
+
+    async def _resume_download_offset(self, pico_filename, save_fp: IO[bytes]) -> int:
+        """ Bytes already in save_fp that match the start of the remote file, see Pico._resume_download_offset """
+        saved = save_fp.seek(0, 2)
+        remote = parse_prefix_hash("".join(await self._communicate(HASH_PREFIX(pico_filename, saved))).strip())
+        return download_resume_offset(save_fp, saved, remote, pico_filename)
+
+    async def _recover_transfer(self):
+        """ Drop the rest of a chunk or block response that went wrong, and get the device back to the prompt """
+        await self.stop_exec(reboot=False)
+
+    async def console(self) -> AsyncIterator[str]:
+        """
+        Stream console output from the device as text until it is closed or disconnected. Nothing is
+        sent to the device, attach to code that is already running
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            try:
+                recv_bytes = await self._read(None)
+            except IOError:
+                return
+            if text := decoder.decode(recv_bytes):
+                yield text
@@ -0,0 +1,192 @@
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Iterable, List, Optional
+
+from .exceptions import RemotePicoException
+
+if TYPE_CHECKING:
+    from .upy import Pico
+
+# Markers are printed on a line of their own: each starts with a newline, in case the output before it did not end
+# in one, and the extra line break is taken off the output again when the batch is read
+
+# Printed on the device before each command runs, followed by the command index
+BATCH_START_MARKER = "---b4e0c1d2-5a61-4f3e-9c57-0e2f6d8a7b13---START"
+# Printed on the device when a command raises, followed by the command index and the exception
+BATCH_ERROR_MARKER = "---b4e0c1d2-5a61-4f3e-9c57-0e2f6d8a7b13---ERROR"
+
+# Batches sent before the oldest response is read when pipelining. The device buffers the
+# waiting batches in its serial input buffer, which is small
+PIPELINE_DEPTH = 2
+# Bytes of batches left waiting to be read, in the device's input buffer and the host serial driver's
+# output buffer. A batch that would go over it waits for the responses before it instead, so its write
+# is never blocked long enough to hit the serial write timeout
+PIPELINE_BUFFER_SIZE = 2048
+
+BATCH_TEMPLATE = """for _i, _c in enumerate({commands!r}):
+    print({start!r} + str(_i))
+    try:
+        exec(_c)
+    except Exception as _e:
+        print({error!r} + str(_i) + ' ' + type(_e).__name__ + ': ' + str(_e))
+        if {stop_on_error!r}:
+            break
+print()
+for _n in ('_i', '_c', '_e'):
+    globals().pop(_n, None)
+del _n
+"""
+
+
+class BatchResult:
+    """Output of one command in a batch. Filled in once the batch response has been read"""
+    def __init__(self, command: str):
+        self.command = command
+        self.output: List[str] = []
+        self.error: Optional[str] = None
+        self.ran = False
+        self.complete = False
+
+    def result(self) -> str:
+        """
+        Output of the command, lines joined with newlines
+        raises:
+            RemotePicoException - If the command raised on the device
+            RuntimeError - If the batch has not been read yet, or stopped before this command ran
+        """
+        if not self.complete:
+            raise RuntimeError(f"Batch containing '{self.command}' has not completed, call wait() first")
+        if self.error is not None:
+            raise RemotePicoException(f"Batched command '{self.command}' raised on device", self.error)
+        if not self.ran:
+            raise RuntimeError(f"Batched command '{self.command}' did not run, an earlier command failed")
+        return "\n".join(self.output)
+
+    def __repr__(self) -> str:
+        return f"BatchResult(command={self.command!r}, ran={self.ran}, error={self.error!r})"
+
+
+def build_batch_command(commands: Iterable[str], stop_on_error: bool = False) -> str:
+    """
+    Build one REPL line that runs several commands on the device, framing the output of each
+    args:
+        commands (Iterable[str]): Python source for each command
+        stop_on_error (bool): Skip the remaining commands after one raises
+    returns:
+        str : Single line command
+    """
+    script = BATCH_TEMPLATE.format(commands=list(commands), start="\n" + BATCH_START_MARKER,
+                                   error="\n" + BATCH_ERROR_MARKER, stop_on_error=stop_on_error)
+    return f"exec({script!r})"
+
+
+def collect_batch_output(lines: Iterable[str], results: List[BatchResult]):
+    """
+    Split the output of a batch command between the results of its commands
+    args:
+        lines (Iterable[str]): Output lines of the batch command
+        results (List[BatchResult]): One result per command, in the order they were queued
+    raises:
+        ValueError - If a frame refers to a command that is not in the batch
+    """
+    current = None
+    for line in lines:
+        if line.startswith(BATCH_START_MARKER):
+            _end_output(current)
+            current = results[int(line[len(BATCH_START_MARKER):])]
+            current.ran = True
+        elif line.startswith(BATCH_ERROR_MARKER):
+            _end_output(current)
+            index, _, error = line[len(BATCH_ERROR_MARKER):].partition(" ")
+            results[int(index)].error = error
+        elif current is None:
+            if line:
+                raise ValueError(f"Output before the first batched command :: {line}")
+        else:
+            current.output.append(line)
+    _end_output(current)
+    for result in results:
+        result.complete = True
+
+
+def _end_output(result: Optional[BatchResult]):
+    """ Take off the line break printed before a marker, or after the last command """
+    if result is not None and result.output and not result.output[-1]:
+        result.output.pop()
+
+
+class CommandBatch:
+    """
+    Queue commands and run them on the device as a single exec, saving a round trip per command.
+    Use as a context manager, the queue is flushed and every response read on exit
+
+        with pico.batch() as batch:
+            first = batch.run("print(1 + 1)")
+            second = batch.run("import os; print(os.listdir())")
+        first.result()
+    """
+    def __init__(self, pico: "Pico", stop_on_error: bool = False, pipeline: bool = False):
+        """
+        args:
+            pico (Pico): Device to run the commands on
+            stop_on_error (bool): Skip the rest of a batch after a command raises
+            pipeline (bool): Send each flushed batch without waiting for the response to the previous one.
+                Only available with the friendly REPL, the raw REPL needs a handshake per command
+        """
+        self._pico = pico
+        self._stop_on_error = stop_on_error
+        self._pipeline = pipeline
+        self._queued: List[BatchResult] = []
+        self._in_flight: Deque[List[BatchResult]] = deque()
+        self._in_flight_sizes: Deque[int] = deque()
+
+    def run(self, command: str) -> BatchResult:
+        """
+        Queue a command for the next flush
+        returns:
+            BatchResult : Filled in once the batch containing the command has been read
+        """
+        result = BatchResult(command)
+        self._queued.append(result)
+        return result
+
+    def flush(self):
+        """ Send the queued commands as one batch. Waits for the response unless pipelining """
+        if not self._queued:
+            return
+        results, self._queued = self._queued, []
+        command = build_batch_command((result.command for result in results), self._stop_on_error)
+        self._pico._invalidate_metadata() # Batched commands may touch the filesystem
+
+        if not self._pipeline:
+            collect_batch_output(self._pico._communicate_lines(command), results)
+            return
+
+        # The oldest batch in flight is being read by the device, the rest wait in its input buffer
+        while self._in_flight and (len(self._in_flight) >= PIPELINE_DEPTH or
+                                   sum(self._in_flight_sizes) - self._in_flight_sizes[0] + len(command) > PIPELINE_BUFFER_SIZE):
+            self._read_oldest()
+        self._pico._send_line_command(command, pipelined=bool(self._in_flight))
+        self._in_flight.append(results)
+        self._in_flight_sizes.append(len(command))
+
+    def _read_oldest(self):
+        """ Read the response to the oldest batch still in flight """
+        results = self._in_flight.popleft()
+        self._in_flight_sizes.popleft()
+        collect_batch_output(self._pico._read_response_lines(), results)
+
+    def wait(self):
+        """ Flush the queue and read every outstanding response """
+        self.flush()
+        while self._in_flight:
+            self._read_oldest()
+
+    def __enter__(self) -> "CommandBatch":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.wait()
+        elif self._in_flight:
+            # Leave the device ready for the next command, responses are discarded
+            self._pico.stop_exec()
@@ -1,16 +1,38 @@
+import re
+import atexit
 import argparse
+import functools
 import logging
+import signal
 import sys
 from pathlib import Path
+from typing import List, Optional
 
 from .upy import Pico
+from .daemon import DAEMON_AVAILABLE, DaemonClient, PicoDaemon, connect_daemon, socket_path
 from .detect import get_all_pico_serial, get_first_pico_serial
+from .fleet import DEFAULT_FLEET_WORKERS, PicoFleet, format_results
+from .profiling import Profiler
+from .sync import SyncPlan
+from .console import DEFAULT_LOG_BACKUPS, DEFAULT_LOG_MAX_BYTES, ConsoleCapture, ConsoleMultiplexer, ConsoleRate, RotatingFileSink
 from .logconfig import LOGGER
 
 
+def add_fleet_arguments(parser: argparse.ArgumentParser):
+    """ Target one device, or many at once """
+    parser.add_argument("device", nargs="?", default=None, help="Serial device")
+    parser.add_argument("--all", action="store_true", help="Run on every detected Pico at the same time")
+    parser.add_argument("--devices", type=lambda value: value.split(","), default=None, help="Comma separated serial devices to run on at the same time")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_FLEET_WORKERS, help="Most devices worked on at the same time")
+
+
 def get_args():
     parser = argparse.ArgumentParser(description="picox")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--agent", action="store_true", help="Install (if needed) and use the picox agent on the device for file operations")
+    parser.add_argument("--no-reboot", action="store_true", help="Only interrupt the device when connecting, do not soft reboot it")
+    parser.add_argument("--no-daemon", action="store_true", help="Open the device directly even if a picox serve daemon is running for it")
+    parser.add_argument("--profile", type=Path, default=None, metavar="PATH", help="Write a JSON timeline of every device operation, with its serial traffic")
 
     # parse global flags first
     args, remaining_argv = parser.parse_known_args()
@@ -26,51 +48,270 @@ def get_args():
     stop_parser     = subparsers.add_parser("stop", help="Send a stop to Pico")
     attach_parser   = subparsers.add_parser('attach', help="Attach to console output from Pico")
     reboot_parser   = subparsers.add_parser('reboot', help="Soft reboot Pico")
+    sync_parser     = subparsers.add_parser("sync", help="Upload only new or changed files in a directory")
+    serve_parser    = subparsers.add_parser("serve", help="Keep a session open for other picox commands to use")
 
     detect_parser.add_argument("--all", action="store_true", help="Detect all pico devices and return a list")
+    # Same flag as the global --no-reboot, which must not be reset when it comes before the command
+    detect_parser.add_argument("--no-reboot", action="store_true", default=argparse.SUPPRESS, help="Only interrupt devices while probing, do not soft reboot them")
+    detect_parser.add_argument("--probe", action="store_true", help="Probe every port, ignoring USB descriptors and cached results")
 
     repl_parser.add_argument("device", help="Serial device")
 
     ls_parser.add_argument("device", help="Serial device")
+    ls_parser.add_argument("path", nargs="?", default=None, help="Directory to list")
+    ls_parser.add_argument("-R", "--recursive", action="store_true", help="List subdirectories recursively")
+    ls_parser.add_argument("-l", "--long", action="store_true", help="Show type and size")
 
-    upload_parser.add_argument("device", help="Serial device")
+    add_fleet_arguments(upload_parser)
     upload_parser.add_argument("read_file", help="File to upload")
     upload_parser.add_argument("file", help="Save name for file to upload")
     upload_parser.add_argument("--overwrite", action="store_true", help="Overwrite the file if it exists")
+    upload_parser.add_argument("--chunk-size", type=int, default=None, help="Bytes per upload chunk. Adapts to the device if not set")
+    upload_parser.add_argument("--compress", action=argparse.BooleanOptionalAction, default=None, help="Compress the transfer. By default text files of 1 KB or more are")
+    upload_parser.add_argument("--resume", action="store_true", help="Continue an interrupted upload if the remote file matches the start of the local one, otherwise replace it")
 
     download_parser.add_argument("device", help="Serial device")
     download_parser.add_argument("file", help="File to download")
     download_parser.add_argument("save_file", help="Location to save to")
+    download_parser.add_argument("--binary", action="store_true", help="Save the file byte for byte instead of as text")
+    download_parser.add_argument("--compress", action=argparse.BooleanOptionalAction, default=None, help="Compress the transfer. By default text files of 1 KB or more are")
+    download_parser.add_argument("--resume", action="store_true", help="Continue an interrupted --binary download if the saved file matches the start of the remote one")
 
-    exec_parser.add_argument("device", help="Serial device")
+    add_fleet_arguments(exec_parser)
     exec_parser.add_argument("file", help="File to execute")
+    exec_parser.add_argument("--local", action="store_true", help="The file is a script on this machine, compile and run it without uploading it")
+    exec_parser.add_argument("--follow", action="store_true", help="Print output until the file finishes. Exits 1 if it raises")
+    exec_parser.add_argument("--timeout", type=float, default=None, help="With --follow, seconds without output before stopping the file")
 
     stop_parser.add_argument("device", help="Serial device")
 
-    attach_parser.add_argument('device', help="Serial device")
+    attach_parser.add_argument('device', nargs="?", default=None, help="Serial device")
+    attach_parser.add_argument("--all", action="store_true", help="Attach to every detected Pico, each line tagged with its device")
+    attach_parser.add_argument("--devices", type=lambda value: value.split(","), default=None, help="Comma separated serial devices to attach to")
+    attach_parser.add_argument("--log-dir", type=Path, default=None, help="With --all or --devices, write a log file per device in this directory")
+    attach_parser.add_argument("--stats", type=float, default=None, metavar="SECONDS", help="With --all or --devices, report bytes and lines per second of each device")
+    attach_parser.add_argument("--timestamps", action="store_true", help="Prefix each line with the host time it arrived")
+    attach_parser.add_argument("--log", type=Path, default=None, help="Also write the output to this file, rotated as it grows")
+    attach_parser.add_argument("--log-max-bytes", type=int, default=DEFAULT_LOG_MAX_BYTES, help="Size at which the log file is rotated")
+    attach_parser.add_argument("--log-backups", type=int, default=DEFAULT_LOG_BACKUPS, help="Rotated log files kept")
+    attach_parser.add_argument("--quiet", action="store_true", help="Only write to the log file, not the terminal")
 
     reboot_parser.add_argument("device", help="Serial device")
 
+    add_fleet_arguments(sync_parser)
+    sync_parser.add_argument("local_dir", type=Path, help="Local directory to copy from")
+    sync_parser.add_argument("remote_dir", help="Directory on the Pico to copy to")
+    sync_parser.add_argument("--delete", action="store_true", help="Delete files on the Pico that do not exist locally")
+    sync_parser.add_argument("--dry-run", action="store_true", help="Show what would change without changing anything")
+
+    serve_parser.add_argument("device", help="Serial device")
+
     # Re-parse with the remaining arguments
     args = parser.parse_args(remaining_argv, namespace=args)
+
+    if args.command in MULTI_DEVICE_COMMANDS and (args.device is not None) + args.all + (args.devices is not None) != 1:
+        parser.error(f"{args.command} needs exactly one of a device, --all or --devices")
     
     return args
 
 
+# Commands that can run on many devices at once
+FLEET_COMMANDS = ("upload", "exec", "sync")
+MULTI_DEVICE_COMMANDS = FLEET_COMMANDS + ("attach",)
+
+# Commands that can run through a picox serve daemon
+DAEMON_COMMANDS = ("ls", "upload", "download", "exec", "stop", "reboot", "sync")
+
+
+def print_progress(done: int, total: Optional[int]):
+    """ Show transfer progress on a single stderr line """
+    if total:
+        sys.stderr.write(f"\r{done}/{total} bytes ({done * 100 // total}%)")
+    else:
+        sys.stderr.write(f"\r{done} bytes")
+    sys.stderr.flush()
+
+
+def connect(device: str, args) -> Pico:
+    """ Use a picox serve daemon for the device if one is running, otherwise open it """
+    if not args.no_daemon and (daemon := connect_daemon(device)):
+        return daemon
+    return Pico(serial_port=device, use_agent=args.agent, reboot_on_connect=not args.no_reboot, profiler=args.profiler)
+
+
+def start_profiling(args) -> Optional[Profiler]:
+    """ Profiler for --profile, its timeline is written when picox exits """
+    if args.profile is None:
+        return None
+    profiler = Profiler()
+
+    def write_profile():
+        profiler.write_json(args.profile, command=args.command, argv=sys.argv[1:])
+        LOGGER.info(f"Profile of {len(profiler.records)} operations written to {args.profile}")
+
+    atexit.register(write_profile)
+    return profiler
+
+
+def print_sync_plan(plan: SyncPlan, remote_dir: str, dry_run: bool):
+    """ Changes made by a sync, or that a dry run would make """
+    would = "would " if dry_run else ""
+    for directory in plan.create_directories:
+        print(f"{would}mkdir  {directory or remote_dir}")
+    for file in plan.upload:
+        print(f"{would}upload {file}")
+    for file in plan.delete:
+        print(f"{would}delete {file}")
+    if dry_run:
+        print(f"{len(plan.upload)} to upload, {len(plan.delete)} to delete, {len(plan.unchanged)} unchanged (dry run)")
+    else:
+        print(f"{len(plan.upload)} uploaded, {len(plan.delete)} deleted, {len(plan.unchanged)} unchanged")
+
+
+def start_execution(pico: Pico, file_name: str, local: bool, follow: bool = False, idle_timeout: Optional[float] = None):
+    """ Run a file on the Pico, or a local script with local. Exits 1 if the script is not valid Python """
+    try:
+        if local:
+            return pico.run_script(file_name, follow=follow, idle_timeout=idle_timeout)
+        return pico.execute_file(file_name, follow=follow, idle_timeout=idle_timeout)
+    except (SyntaxError, FileNotFoundError) as err:
+        LOGGER.error(f"Cannot run {file_name} :: {err}")
+        sys.exit(1)
+
+
+def follow_execution(pico: Pico, file_name: str, idle_timeout: Optional[float], local: bool = False):
+    """ Print a file's output as it runs. Exits 1 if it raised or went quiet for too long """
+    execution = start_execution(pico, file_name, local, follow=True, idle_timeout=idle_timeout)
+    try:
+        for line in execution:
+            print(line, flush=True) # Print to stdout
+    except IOError as err:
+        LOGGER.error(f"No output from {file_name} for {idle_timeout} s, stopped it :: {err}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        LOGGER.info("Received KeyboardInterrupt. Stopping...")
+        if not isinstance(pico, DaemonClient):
+            pico.stop_exec(reboot=False)
+        # A daemon stops the file before its next request
+        sys.exit(130)
+
+    result = execution.result
+    if not result.ok:
+        sys.stderr.write(result.traceback + "\n")
+        LOGGER.error(f"{file_name} raised after {result.duration:.2f} s")
+        sys.exit(1)
+    LOGGER.info(f"{file_name} finished in {result.duration:.2f} s")
+
+
+def run_fleet(args):
+    """ Run upload, exec or sync on many devices at once and show a result per device """
+    devices = args.devices if args.devices is not None else get_all_pico_serial(reboot=not args.no_reboot)
+    if not devices:
+        LOGGER.error("No Pico devices found")
+        sys.exit(1)
+    fleet = PicoFleet(devices, max_workers=args.jobs, pico_factory=functools.partial(connect, args=args))
+    LOGGER.info(f"Running {args.command} on {len(devices)} devices")
+
+    match args.command:
+        case "upload":
+            results = fleet.upload_file(Path(args.read_file), args.file, overwrite=args.overwrite, chunk_size=args.chunk_size,
+                                        compress=args.compress, resume=args.resume)
+        case "exec":
+            if args.local:
+                results = fleet.run_script(Path(args.file), follow=args.follow, idle_timeout=args.timeout)
+            else:
+                results = fleet.execute_file(args.file, follow=args.follow, idle_timeout=args.timeout)
+        case "sync":
+            results = fleet.sync(args.local_dir, args.remote_dir, delete=args.delete, dry_run=args.dry_run)
+
+    print(format_results(results))
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+
+def print_rates(rates: List[ConsoleRate]):
+    """ One line per device, to stderr so it stays out of captured output """
+    for rate in rates:
+        sys.stderr.write(f"{rate.device}: {rate.bytes_per_second / 1024:.1f} KB/s, {rate.lines_per_second:.0f} lines/s, "
+                         f"{rate.bytes} bytes, {rate.lines} lines\n")
+    sys.stderr.flush()
+
+
+def attach_many(args):
+    """ Show the console output of many devices from one process """
+    if args.log:
+        LOGGER.error("Use --log-dir for a log file per device")
+        sys.exit(2)
+    if args.quiet and not args.log_dir:
+        LOGGER.error("--quiet needs --log-dir, otherwise the output goes nowhere")
+        sys.exit(2)
+    devices = args.devices if args.devices is not None else get_all_pico_serial(reboot=False)
+    if not devices:
+        LOGGER.error("No Pico devices found")
+        sys.exit(1)
+    if args.log_dir:
+        args.log_dir.mkdir(parents=True, exist_ok=True)
+
+    multiplexer = ConsoleMultiplexer(None if args.quiet else sys.stdout)
+    picos = []
+    log_sinks = []
+    try:
+        for device in devices:
+            pico = Pico(serial_port=device, skip_coms_test=True, skip_stop_exec=True) # Leave running code alone
+            picos.append(pico)
+            if args.log_dir:
+                name = re.sub(r"[^A-Za-z0-9_.-]", "_", Path(device).name)
+                log_sinks.append(RotatingFileSink(args.log_dir / f"{name}.log", max_bytes=args.log_max_bytes, backups=args.log_backups))
+            multiplexer.add(device, pico.fileno(), ConsoleCapture(log_sinks[-1:] if args.log_dir else [], timestamps=args.timestamps))
+        LOGGER.info(f"Attached to {len(devices)} devices")
+        multiplexer.run(report_interval=args.stats, on_report=print_rates)
+    except KeyboardInterrupt:
+        LOGGER.info("Received KeyboardInterrupt. Exiting...")
+    finally:
+        for pico in picos:
+            pico.close()
+        for log_sink in log_sinks:
+            log_sink.close()
+
+
 def main():
     LOGGER.setLevel(logging.INFO)
     args = get_args()
 
     if args.verbose:
         LOGGER.setLevel(logging.DEBUG)
+    args.profiler = start_profiling(args)
+
+    if args.command in FLEET_COMMANDS and args.device is None:
+        run_fleet(args)
+        return
+    if args.command == "attach" and args.device is None:
+        attach_many(args)
+        return
 
     attach_only = args.command in ["attach"]
+    device = getattr(args, 'device', False)
 
-    if device := getattr(args, 'device', False):
+    daemon = None
+    if device and not args.no_daemon:
+        daemon = connect_daemon(device)
+    if daemon and args.command in DAEMON_COMMANDS:
+        LOGGER.debug(f"Using picox daemon for {device}")
+        if args.profiler:
+            LOGGER.warning(f"{device} is served by a picox daemon, profile it there: picox --profile PATH serve {device}")
+        pico = daemon
+    elif daemon:
+        LOGGER.error(f"{device} is held open by 'picox serve'. Stop it first, '{args.command}' needs the serial port")
+        sys.exit(1)
+    elif device:
         pico = Pico(
             serial_port=device,
             skip_coms_test=attach_only, # Skip testing coms if code should be already running
             skip_stop_exec=attach_only,
+            use_agent=args.agent and not attach_only,
+            reboot_on_connect=not args.no_reboot,
+            profiler=args.profiler,
         )
     else:
         pico = False
@@ -79,40 +320,104 @@ def main():
         case "repl":
             pico.start_repl()
         case "ls":
-            for file in pico.get_file_list():
-                print(file) # Print to stdout
+            if args.path is None and not args.recursive and not args.long:
+                for file in pico.get_file_list():
+                    print(file) # Print to stdout
+            else:
+                remote_dir = args.path or "/"
+                prefix = remote_dir.rstrip("/") + "/"
+                for entry in pico.walk(remote_dir, recursive=args.recursive):
+                    name = entry.path[len(prefix):] + ("/" if entry.is_dir else "")
+                    if args.long:
+                        print(f"{'d' if entry.is_dir else '-'} {entry.size:>10} {name}")
+                    else:
+                        print(name)
         case "stop":
-            pass # Technically just opening it successfully will stop it
+            if isinstance(pico, DaemonClient):
+                pico.stop_exec() # The daemon's session is already open
+            # Otherwise opening the device has already stopped it
         case "upload":
             with open(args.read_file, "rb") as read_file:
                 try:
-                    pico.upload_file(read_file, args.file, overwrite=args.overwrite)
+                    pico.upload_file(
+                        read_file,
+                        args.file,
+                        overwrite=args.overwrite,
+                        chunk_size=args.chunk_size,
+                        progress_callback=print_progress,
+                        compress=args.compress,
+                        resume=args.resume,
+                    )
+                    sys.stderr.write("\n")
                 except FileExistsError as err:
                     LOGGER.error(err)
                     sys.exit(2)
         case "download":
+            if args.resume and not args.binary:
+                LOGGER.error("Only --binary downloads can be resumed")
+                sys.exit(2)
             try:
-                with open(args.save_file, "w") as save_file:
-                    pico.download_file(args.file, save_file)
+                with open(args.save_file, "a+b" if args.resume else "wb" if args.binary else "w") as save_file:
+                    pico.download_file(args.file, save_file, binary=args.binary, progress_callback=print_progress,
+                                       compress=args.compress, resume=args.resume)
+                    sys.stderr.write("\n")
             except FileNotFoundError as err:
                 LOGGER.error(err)
                 sys.exit(1)
         case "exec":
             LOGGER.debug(f"Executing {args.file}")
-            pico.execute_file(args.file)
+            if args.follow:
+                follow_execution(pico, args.file, args.timeout, local=args.local)
+            else:
+                start_execution(pico, args.file, args.local)
         case "detect":
             if args.all:
-                detected = get_all_pico_serial()
+                detected = get_all_pico_serial(reboot=not args.no_reboot, use_descriptors=not args.probe)
             else:
-                detected = get_first_pico_serial()
+                detected = get_first_pico_serial(reboot=not args.no_reboot, use_descriptors=not args.probe)
             print(detected) # show device to stdout
         case "attach":
+            if args.quiet and not args.log:
+                LOGGER.error("--quiet needs --log, otherwise the output goes nowhere")
+                sys.exit(2)
+            sinks = [] if args.quiet else [sys.stdout]
+            log_sink = None
+            if args.log:
+                log_sink = RotatingFileSink(args.log, max_bytes=args.log_max_bytes, backups=args.log_backups)
+                sinks.append(log_sink)
             try:
-                pico.start_console_attach()
+                pico.start_console_attach(ConsoleCapture(sinks, timestamps=args.timestamps))
             except KeyboardInterrupt:
                 LOGGER.info("Received KeyboardInterrupt. Exiting...")
+            except OSError as err: # SerialException included
+                LOGGER.error(f"Console closed :: {err}")
+                sys.exit(1)
+            finally:
+                if log_sink:
+                    log_sink.close()
         case "reboot":
             pico.send_soft_reboot()
+        case "sync":
+            try:
+                plan = pico.sync(args.local_dir, args.remote_dir, delete=args.delete, dry_run=args.dry_run)
+            except NotADirectoryError as err:
+                LOGGER.error(err)
+                sys.exit(1)
+            print_sync_plan(plan, args.remote_dir, args.dry_run)
+        case "serve":
+            if not DAEMON_AVAILABLE:
+                LOGGER.error("picox serve needs Unix domain sockets, which are not available on this platform")
+                sys.exit(1)
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # Clean up the socket when stopped by kill
+            try:
+                PicoDaemon(pico, socket_path(device)).serve_forever()
+            except PermissionError as err:
+                LOGGER.error(f"Cannot serve {device} :: {err}")
+                sys.exit(1)
+            except KeyboardInterrupt:
+                LOGGER.info("Received KeyboardInterrupt. Exiting...")
+            finally:
+                pico.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
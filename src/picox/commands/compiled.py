@@ -1,7 +1,25 @@
-# Auto-generated with compile.py at 2024-05-19 15:21:37.486884+00:00
+# Auto-generated with compile.py at 2026-10-17 02:11:16.733309+00:00
 
-# src/raw_commands/DOWNLOAD_FILE.py
-DOWNLOAD_FILE = lambda pico_filename : f"exec('try:\\n    with open(\\\'{pico_filename}\\\', \\\'r\\\') as f:\\n        print(f.read(), end=\\\'\\\')\\n\\nexcept Exception as e:\\n    print(f\\\"{{str(e)}}FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR\\\")')"
+# src/raw_commands/HASH_PREFIX.py [21ee88d2748e12f6a8a3a4be78fa2066d06c3bc55517bbc5081cdb0b439b7570]
+HASH_PREFIX = lambda pico_path, length : f"exec(\"try:\\n from os import stat;from hashlib import sha256;from binascii import hexlify\\n try:size=stat('{pico_path}')[6]\\n except OSError:print('-')\\n else:\\n  h=sha256();remaining=min(size,{length})\\n  with open('{pico_path}','rb')as f:\\n   while remaining:\\n    block=f.read(min(1024,remaining))\\n    if not block:break\\n    h.update(block);remaining-=len(block)\\n  print(size,hexlify(h.digest()).decode())\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
 
-# src/raw_commands/UPLOAD_FILE.py
-UPLOAD_FILE = lambda hex_data, pico_file_path : f"exec('try:\\n    decoded_data = bytes.fromhex(\\\'{hex_data}\\\')\\n    with open(\\\"{pico_file_path}\\\", \\\"wb\\\") as f: \\n        f.write(decoded_data)\\n\\nexcept Exception as e:\\n    print(f\\\"{{str(e)}}FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR\\\")')"
\ No newline at end of file
+# src/raw_commands/HASH_TREE.py [535b582fb56d3ddbdacbe3d6fd3f177eb43278442ef3b281a4ca325d1e911832]
+HASH_TREE = lambda remote_dir : f"exec(\"try:\\n import os;from hashlib import sha256;from binascii import hexlify\\n def hash_tree(d):\\n  for b in os.ilistdir(d):\\n   a=d.rstrip('/')+'/'+b[0]\\n   if b[1]==16384:print('D',a);hash_tree(a)\\n   else:\\n    h=sha256()\\n    with open(a,'rb')as f:\\n     while True:\\n      c=f.read(1024)\\n      if not c:break\\n      h.update(c)\\n    print('F',hexlify(h.digest()).decode(),a)\\n try:os.stat('{remote_dir}')\\n except OSError:pass\\n else:print('D','{remote_dir}'.rstrip('/')+'/');hash_tree('{remote_dir}')\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
+
+# src/raw_commands/READ_COMPRESSED_BLOCKS.py [d884a7085065400d6542ed4dad726182430bdc941c2462762aabdb3e1b95c9fa]
+READ_COMPRESSED_BLOCKS = lambda pico_filename, offset, count, block_size : f"exec(\"try:\\n from binascii import b2a_base64,crc32;from io import BytesIO;from os import stat\\n try:from deflate import DeflateIO,ZLIB\\n except ImportError:DeflateIO=None\\n print(stat('{pico_filename}')[6])\\n with open('{pico_filename}','rb')as f:\\n  offset=f.seek({offset});remaining={count}\\n  while remaining:\\n   block=f.read({block_size} if remaining<0 else min({block_size},remaining))\\n   if not block:break\\n   packed=None\\n   if DeflateIO:\\n    try:out=BytesIO();compressor=DeflateIO(out,ZLIB,10);compressor.write(block);compressor.close();packed=out.getvalue()\\n    except Exception:DeflateIO=None\\n   if packed and len(packed)<len(block):print(offset,len(block),crc32(block,crc32(str(offset).encode())),'z',b2a_base64(packed).decode().strip())\\n   else:print(offset,len(block),crc32(block,crc32(str(offset).encode())),b2a_base64(block).decode().strip())\\n   offset+=len(block);remaining-=len(block)\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
+
+# src/raw_commands/READ_FILE_BLOCKS.py [a9cdfe395a0093c4aa0bc618a36f42f98d4380d3ef10a66917737cfa2e0e7e45]
+READ_FILE_BLOCKS = lambda pico_filename, offset, count, block_size : f"exec(\"try:\\n from binascii import b2a_base64,crc32;from os import stat;print(stat('{pico_filename}')[6])\\n with open('{pico_filename}','rb')as f:\\n  offset=f.seek({offset});remaining={count}\\n  while remaining:\\n   block=f.read({block_size} if remaining<0 else min({block_size},remaining))\\n   if not block:break\\n   print(offset,len(block),crc32(block,crc32(str(offset).encode())),b2a_base64(block).decode().strip());offset+=len(block);remaining-=len(block)\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
+
+# src/raw_commands/REMOVE_FILE.py [5458c58e3d3caebf906d4213574fc19de181ee709652cc668f7194e01418a7dd]
+REMOVE_FILE = lambda pico_file_path : f"exec(\"try:import os;os.remove('{pico_file_path}')\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
+
+# src/raw_commands/STAT_PATH.py [7a6b87d8ad66fb9f5f9ce220da918df530fdb283ea12856ac7fd85e132f80b54]
+STAT_PATH = lambda pico_path : f"exec(\"try:\\n import os\\n try:s=os.stat('{pico_path}')\\n except OSError:print('-')\\n else:print('D'if s[0]&16384 else 'F',s[6])\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
+
+# src/raw_commands/WALK_TREE.py [2e534e6fc6dc0c3649fc599f8720778713c6e7a7c84568c4d6338c10f59437b1]
+WALK_TREE = lambda remote_dir, recursive : f"exec(\"try:\\n import os\\n def walk_tree(d,recursive):\\n  for a in os.ilistdir(d):\\n   b=d.rstrip('/')+'/'+a[0]\\n   if a[1]==16384:\\n    print('D 0',b)\\n    if recursive:walk_tree(b,recursive)\\n   else:print('F',a[3]if len(a)>3 else os.stat(b)[6],b)\\n walk_tree('{remote_dir}',{recursive})\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
+
+# src/raw_commands/WRITE_FRAMED_CHUNK.py [aea3dca10f535b0f91a5d54e7b4c2f30a0c7596b69b0908422a1ce8ec01b745b]
+WRITE_FRAMED_CHUNK = lambda pico_file_path, file_mode, offset, crc, compressed, b64_data : f"exec(\"try:\\n from binascii import a2b_base64,crc32;path,mode,offset,expected_crc,compressed=('{pico_file_path}','{file_mode}',{offset},{crc},{compressed});data=a2b_base64('{b64_data}')\\n if compressed:from io import BytesIO;from deflate import DeflateIO,ZLIB;data=DeflateIO(BytesIO(data),ZLIB).read()\\n crc=crc32(data,crc32(' '.join((path,mode,str(offset))).encode()))\\n if crc!=expected_crc:print('N',offset,crc)\\n else:\\n  with open(path,mode)as f:f.seek(offset);f.write(data)\\n  print('A',offset,crc)\\nexcept Exception as e:print(str(e)+'FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR')\")"
\ No newline at end of file
@@ -1,133 +1,534 @@
-import token
-import tokenize
+import os
 import re
+import ast
+import json
+import hashlib
+import keyword
+import tokenize
+import threading
 from io import StringIO
-from typing import IO, Union
+from pathlib import Path
+from collections import Counter
+from itertools import chain, product
+from string import ascii_letters, digits
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+from .logconfig import LOGGER
+
+# Changed whenever the output for the same source changes, so older cached results are not used
+COMPILER_VERSION = 3
+
+# Raw commands mark their parameters with {name}, inside a string or as a bare set display. While the
+# command is escaped for its f-string they are held as these, so their braces stay single
+PLACEHOLDER_OPEN = "\x00"
+PLACEHOLDER_CLOSE = "\x01"
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z_]\w*)\}")
+
+# Escapes for code in a string literal delimited by each quote, applied in one pass with str.translate
+LITERAL_ESCAPES = {quote: str.maketrans({"\\": "\\\\", quote: "\\" + quote, "\n": "\\n"}) for quote in "'\""}
+
+# Escapes for an exec() payload in the f-string of a compiled command, placeholders become its fields
+FSTRING_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "{": "{{", "}": "}}",
+                                 PLACEHOLDER_OPEN: "{", PLACEHOLDER_CLOSE: "}"})
+
+# Calls that can see a function's local names by name. Functions using them keep their names
+INTROSPECTION_CALLS = {"locals", "vars", "eval", "exec", "dir"}
+
+# Python 3.12 splits f-strings into several tokens
+FSTRING_START = getattr(tokenize, "FSTRING_START", None)
+FSTRING_END = getattr(tokenize, "FSTRING_END", None)
+
+
+class CompiledSource(NamedTuple):
+    """Python source compiled to the smallest code that runs the same"""
+    code: str           # Minified source
+    payload: str        # One line exec() of the code, as sent to the device
+    original_size: int  # Bytes of the source
+    params: List[str]   # Raw command placeholders, in order of first use
 
-from .upy import FAILED_MARKER
+    @property
+    def compiled_size(self) -> int:
+        """ Bytes of the payload """
+        return len(self.payload.encode("utf-8"))
 
 
-def replace_braces(match) -> str:
+class CompiledCommand(NamedTuple):
+    """A raw command compiled for commands/compiled.py"""
+    command_str: str    # Body of the command's f-string
+    params: List[str]   # Arguments of the command's lambda
+    original_size: int  # Bytes of the source
+    compiled_size: int  # Bytes of the exec() payload, before the parameters are filled in
+    wrapper_size: int   # Bytes of compiled_size taken by exec() and the try statement around the code
+
+
+class CompileCache:
     """
-    Fixup curly braces within an f-string by doubling them. This stops them from being interpreted
-    as an argument to the raw command
-    Args:
-        match (str) : Matched f-string
+    Compiled sources kept in memory and on disk, keyed by a hash of the source, the compile options and
+    COMPILER_VERSION. Compiling a script that has not changed, for the next board in a rack or on the
+    next run, reads the earlier result instead
+    """
+    def __init__(self, directory: Optional[Path] = None):
+        """
+        args:
+            directory (Path): Where results are stored. Defaults to picox/compile in the user's cache directory
+        """
+        if directory is None:
+            directory = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "picox" / "compile"
+        self.directory = Path(directory)
+        self._memory: Dict[str, CompiledSource] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source: str, **options) -> str:
+        """ Hash of everything the compiled result depends on """
+        digest = hashlib.sha256(json.dumps([COMPILER_VERSION, options], sort_keys=True).encode("utf-8"))
+        digest.update(b"\0" + source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[CompiledSource]:
+        with self._lock:
+            compiled = self._memory.get(key)
+        if compiled is None:
+            try:
+                compiled = CompiledSource(**json.loads((self.directory / f"{key}.json").read_text(encoding="utf-8")))
+            except (OSError, ValueError, TypeError):
+                pass # Not cached, or unreadable
+        with self._lock:
+            if compiled is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._memory[key] = compiled
+        return compiled
+
+    def put(self, key: str, compiled: CompiledSource):
+        with self._lock:
+            self._memory[key] = compiled
+        path = self.directory / f"{key}.json"
+        # Written to a file of its own first, so readers in other threads or processes never see part of it
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            temp_path.write_text(json.dumps(compiled._asdict()), encoding="utf-8")
+            os.replace(temp_path, path)
+        except OSError as err:
+            LOGGER.debug(f"Could not cache compiled source in {self.directory} :: {err}")
+
+
+_default_cache: Optional[CompileCache] = None
+
+def default_cache() -> CompileCache:
+    """ CompileCache in the default directory, shared by everything in this process """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CompileCache()
+    return _default_cache
+
+
+def _strip_block(node: ast.AST, docstrings: bool, asserts: bool):
+    """
+    Remove statements that do nothing at run time from the blocks of node and the blocks nested in them:
+    docstrings and other bare strings, asserts and pass where the block has other statements.
+    Expressions cannot hold statements, so only statements are visited
+    """
+    for child in chain(getattr(node, "handlers", ()), getattr(node, "cases", ())):
+        _strip_block(child, docstrings, asserts)
+    for field in ("body", "orelse", "finalbody"):
+        stmts = getattr(node, field, None)
+        if not isinstance(stmts, list) or not stmts:
+            continue
+        kept = []
+        for stmt in stmts:
+            if isinstance(stmt, ast.Pass) or asserts and isinstance(stmt, ast.Assert) or docstrings \
+                    and isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) and isinstance(stmt.value.value, str):
+                continue
+            _strip_block(stmt, docstrings, asserts)
+            kept.append(stmt)
+        # A block needs a statement. else and finally clauses can go, unless finally is all a try has
+        if not kept and (field == "body" and not isinstance(node, ast.Module) or
+                         field == "finalbody" and not node.handlers):
+            kept = [ast.Pass()]
+        setattr(node, field, kept)
+
+
+class _Scope:
+    """Names used in one function, see rename_locals"""
+    def __init__(self, func: Union[ast.FunctionDef, ast.AsyncFunctionDef]):
+        self.arguments = {arg.arg for arg in chain(func.args.posonlyargs, func.args.args, func.args.kwonlyargs,
+                                                   filter(None, (func.args.vararg, func.args.kwarg)))}
+        self.names: List[ast.Name] = []
+        self.handlers: List[ast.ExceptHandler] = []
+        self.imported: Set[str] = set()
+        self.renamable = True
+
+
+class _ScopeCollector(ast.NodeVisitor):
+    """
+    Collect every function's names in one walk of the tree, with every name used anywhere. A function
+    is not renamable if another scope or a name lookup could see into it
+    """
+    def __init__(self):
+        self.scopes: List[_Scope] = []
+        self.taken: Set[str] = set()
+        self._stack: List[_Scope] = []
+
+    def _not_renamable(self, node):
+        if self._stack:
+            self._stack[-1].renamable = False
+        self.generic_visit(node)
+
+    visit_Lambda = visit_Match = visit_Global = visit_Nonlocal = _not_renamable
+
+    def visit_FunctionDef(self, node):
+        self.taken.add(node.name)
+        if self._stack:
+            self._stack[-1].renamable = False
+        # Decorators, defaults and annotations run in the enclosing scope
+        for child in chain(node.decorator_list, (node.args,), filter(None, (node.returns,))):
+            self.visit(child)
+        self._stack.append(_Scope(node))
+        self.scopes.append(self._stack[-1])
+        for stmt in node.body:
+            self.visit(stmt)
+        self._stack.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self.taken.add(node.name)
+        self._not_renamable(node)
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id in INTROSPECTION_CALLS and self._stack:
+            self._stack[-1].renamable = False
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        self.taken.add(node.id)
+        if self._stack:
+            self._stack[-1].names.append(node)
+
+    def visit_arg(self, node):
+        self.taken.add(node.arg)
+        self.generic_visit(node)
+
+    def visit_alias(self, node):
+        name = node.asname or node.name.split(".")[0]
+        self.taken.add(name)
+        if self._stack:
+            self._stack[-1].imported.add(name)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.taken.add(node.name)
+            if self._stack:
+                self._stack[-1].handlers.append(node)
+        self.generic_visit(node)
+
+
+def _short_names(taken: Set[str]) -> Iterator[str]:
+    """ Names from shortest up that are not keywords or already used """
+    first = ascii_letters
+    rest = ascii_letters + digits + "_"
+    for name in chain(first, ("".join(pair) for pair in product(first, rest)),
+                      ("".join(triple) for triple in product(first, rest, rest))):
+        if name not in taken and not keyword.iskeyword(name):
+            yield name
+
+
+def rename_locals(tree: ast.Module, reserved: Set[str] = frozenset()) -> ast.Module:
+    """
+    Give the local variables of each function the shortest free names, the most used first. Arguments,
+    globals and functions that nested scopes or introspection could see into are left alone
+    args:
+        tree (ast.Module): Modified in place
+        reserved (Set[str]): Names never renamed or used, e.g. raw command placeholders
+    """
+    collector = _ScopeCollector()
+    collector.visit(tree)
+    taken = collector.taken | set(reserved)
+    for scope in collector.scopes:
+        if not scope.renamable:
+            continue
+        stored = {node.id for node in scope.names if isinstance(node.ctx, ast.Store)}
+        stored |= {handler.name for handler in scope.handlers}
+        # Imports bind names too, but keep them so the import statement still matches
+        stored -= scope.imported | scope.arguments | set(reserved)
+
+        uses = Counter(node.id for node in scope.names if node.id in stored)
+        names = _short_names(taken)
+        new = next(names)
+        mapping = {}
+        for old, _ in uses.most_common():
+            if len(new) < len(old):
+                mapping[old] = new
+                new = next(names)
+        for node in scope.names:
+            node.id = mapping.get(node.id, node.id)
+        for handler in scope.handlers:
+            handler.name = mapping.get(handler.name, handler.name)
+    return tree
+
+
+def optimize(tree: ast.Module,
+             strip_docstrings: bool = True,
+             strip_asserts: bool = True,
+             shorten_names: bool = False,
+             reserved: Set[str] = frozenset()
+             ) -> ast.Module:
+    """
+    Remove what a device does not need to run the code
+    args:
+        tree (ast.Module): Modified in place
+        strip_docstrings (bool): Remove docstrings and other bare strings
+        strip_asserts (bool): Remove assert statements
+        shorten_names (bool): Shorten local variable names, see rename_locals
+        reserved (Set[str]): Names never renamed or used
+    """
+    _strip_block(tree, strip_docstrings, strip_asserts)
+    if shorten_names:
+        rename_locals(tree, reserved)
+    return ast.fix_missing_locations(tree)
+
+
+def wrap_in_try(tree: ast.Module, handlers: str) -> ast.Module:
+    """
+    Run the whole module inside a try statement
+    args:
+        handlers (str): Source of the except clauses, e.g. "except Exception as e:\n    print(e)"
+    """
+    wrapper = ast.parse(f"try:\n    pass\n{handlers}")
+    wrapper.body[0].body = tree.body or [ast.Pass()]
+    return ast.fix_missing_locations(wrapper)
+
+
+def _tokens(code: str) -> Iterator[Tuple[int, str, Tuple[int, int], Tuple[int, int]]]:
+    """ Type, text, start and end of each token. An f-string is a single STRING token on every Python version """
+    lines = code.splitlines(keepends=True)
+    depth = 0
+    start = None
+    for token in tokenize.generate_tokens(StringIO(code).readline):
+        if FSTRING_START is not None and token.type == FSTRING_START:
+            depth += 1
+            start = start or token.start
+        elif depth:
+            if token.type == FSTRING_END:
+                depth -= 1
+                if not depth:
+                    (start_row, start_col), (end_row, end_col) = start, token.end
+                    text = "".join(lines[start_row - 1:end_row])
+                    yield tokenize.STRING, text[start_col:len(text) - len(lines[end_row - 1]) + end_col], start, token.end
+                    start = None
+        else:
+            yield token.type, token.string, token.start, token.end
+
+
+def _needs_space(previous: Tuple[int, str], token_type: int, text: str) -> bool:
+    """ Whether two tokens would run together without a space between them """
+    previous_type, previous_text = previous
+    end, start = previous_text[-1], text[0]
+    if (end.isalnum() or end == "_") and (start.isalnum() or start == "_" or token_type == tokenize.STRING):
+        return True
+    # A {name} placeholder becomes a number or a name when the command is formatted
+    if (end == "}" and (start.isalnum() or start == "_")) or ((end.isalnum() or end == "_") and start == "{"):
+        return True
+    return previous_type == tokenize.NUMBER and start == "."
+
+
+def _logical_lines(code: str) -> List[Tuple[int, str, bool]]:
+    """ Depth, minimal text and whether it is a decorator or the header of a block, for each statement """
+    lines = []
+    depth = 0
+    parts: List[str] = []
+    previous = None
+    for token_type, text, _, _ in _tokens(code):
+        if token_type == tokenize.INDENT:
+            depth += 1
+        elif token_type == tokenize.DEDENT:
+            depth -= 1
+        elif token_type == tokenize.NEWLINE:
+            lines.append((depth, "".join(parts), parts[0] == "@" or parts[-1] == ":"))
+            parts, previous = [], None
+        elif token_type not in (tokenize.NL, tokenize.COMMENT, tokenize.ENCODING, tokenize.ENDMARKER):
+            if previous is not None and _needs_space(previous, token_type, text):
+                parts.append(" ")
+            parts.append(text)
+            previous = (token_type, text)
+    return lines
+
+
+def minify(tree: ast.Module) -> str:
+    """
+    Source for a tree with as few bytes as possible: one space per indent, spaces only between tokens
+    that would otherwise run together, simple statements joined with ';' and blocks of only simple
+    statements on the line of their header
+    raises:
+        ValueError: The minified code does not parse back to the same tree
+    """
+    code = ast.unparse(tree)
+    lines = _logical_lines(code)
+
+    # Blocks holding only simple statements. A statement only needs checking against its own block,
+    # a compound statement deeper down has already marked the block it is in
+    simple_block = [False] * len(lines)
+    open_blocks: List[int] = []
+    for index, (depth, text, compound) in enumerate(lines):
+        while open_blocks and lines[open_blocks[-1]][0] >= depth:
+            open_blocks.pop()
+        if compound and open_blocks and lines[open_blocks[-1]][0] == depth - 1:
+            simple_block[open_blocks[-1]] = False
+        if compound:
+            simple_block[index] = text[0] != "@" # A decorator has no block
+            open_blocks.append(index)
+
+    output = StringIO()
+    kind, line_depth = None, 0
+    for index, (depth, text, compound) in enumerate(lines):
+        if not compound and kind == "simple" and line_depth == depth:
+            output.write(";")
+        elif not compound and kind == "header" and line_depth == depth - 1:
+            kind = "inline" # First statement of the block, on its header line
+        elif not compound and kind == "inline" and line_depth == depth - 1:
+            output.write(";")
+        else:
+            if index:
+                output.write("\n")
+            output.write(" " * depth)
+            kind = ("header" if simple_block[index] else "block") if compound else "simple"
+            line_depth = depth
+        output.write(text)
+    minified = output.getvalue()
+
+    if ast.dump(ast.parse(minified)) != ast.dump(ast.parse(code)):
+        raise ValueError("Minified code does not match the source")
+    return minified
+
+
+def find_placeholders(tree: ast.Module) -> List[str]:
+    """
+    Parameters of a raw command: {name} inside a plain string, or a bare {name} set display. Braces inside
+    f-strings belong to the device
     returns:
-        str
-    """
-    # Before and after are the quotes that will remain unchanged
-    before, f_content, after = match.groups()
-    # Replace the curly braces in the f-string content
-    modified_content = re.sub(r'(?<!\{)\{(?!\{)', '{{', f_content)
-    modified_content = re.sub(r'(?<!\})\}(?!\})', '}}', modified_content)
-    return f'{before}{modified_content}{after}'
-
-def fix_fstring_braces(source: str):
-    """
-    Pass in a string
-    """
-    # Regex to match an f-string
-    f_string_pattern = r'(f[rfb]?[\'"])(.*?)([\'"])'
-
-    # Use re.sub with the replace function to modify the code
-    modified_code = re.sub(f_string_pattern, replace_braces, source, flags=re.DOTALL)
-    return modified_code
-
-def remove_comments(source: Union[IO[bytes], str]):
-    """
-    Removes comments from Python source code while attempting to preserve line structure.
-
-    Parameters:
-    source (str or file): A string containing Python code or a file-like object to read from.
-
-    Returns:
-    str: The Python code with comments removed.
-    """
-    # Handling the input source: can be a string or a file-like object
-    if isinstance(source, str):
-        source = StringIO(source)
-    
-    cleaned_code = ""
-    previous_token_type = token.INDENT  # Previous token type, initially set to INDENT
-    last_line_number = -1  # Last line number processed
-    last_column = 0  # Last column number processed
-
-    # Token generator from the source
-    tokgen = tokenize.generate_tokens(source.readline)
-    for token_type, token_text, (start_line, start_col), (end_line, end_col), line_text in tokgen:
-        if start_line > last_line_number:
-            last_column = 0  # Reset column for a new line
-        if start_col > last_column:
-            cleaned_code += " " * (start_col - last_column)  # Add necessary spaces for alignment
-
-        # Handle different types of tokens
-        if token_type == token.STRING and (previous_token_type == token.INDENT or previous_token_type == token.NEWLINE):
-            cleaned_code += token_text  # Include strings (possible docstrings are treated as code)
-        elif token_type != tokenize.COMMENT:
-            cleaned_code += token_text  # Add the text of non-comment tokens
-        
-        # Update previous token type, column and line number
-        previous_token_type = token_type
-        last_column = end_col
-        last_line_number = end_line
-
-    return cleaned_code
-
-def fix_lines(source: Union[IO[bytes], str]):
-    """
-    Read a file line by line, stripping existing line endings and appending '\n' to each line.
-    Also performs a one level indent to all lines
-    Removes empty lines
-    
-    Args:
-        source (str): source file to modify
-    
-    Returns:
-        str: The content of the file with uniformly normalized line endings.
+        List[str] : Names in the order they are first used
     """
+    fstring_parts = {id(value) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr) for value in node.values}
+    found = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Set) and len(node.elts) == 1 and isinstance(node.elts[0], ast.Name):
+            found.append((node.lineno, node.col_offset, 0, node.elts[0].id))
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in fstring_parts:
+            for match in PLACEHOLDER_PATTERN.finditer(node.value):
+                found.append((node.lineno, node.col_offset, match.start(), match.group(1)))
+    return list(dict.fromkeys(name for *_, name in sorted(found)))
+
+
+def _mark_placeholders(code: str, params: List[str]) -> str:
+    """ Swap the braces of placeholders for PLACEHOLDER_OPEN/CLOSE, see find_placeholders """
+    def mark(match):
+        name = match.group(1)
+        return f"{PLACEHOLDER_OPEN}{name}{PLACEHOLDER_CLOSE}" if name in params else match.group(0)
 
-    if isinstance(source, str):
-        source = StringIO(source)
+    line_offsets = [0]
+    for line in code.splitlines(keepends=True):
+        line_offsets.append(line_offsets[-1] + len(line))
+    def offset(position: Tuple[int, int]) -> int:
+        return line_offsets[position[0] - 1] + position[1]
 
-    normalized_lines = []
+    tokens = [token for token in _tokens(code) if token[0] not in (tokenize.INDENT, tokenize.DEDENT)]
+    output, position = [], 0
+    for index, (token_type, text, start, end) in enumerate(tokens):
+        if token_type == tokenize.STRING and "f" not in text[:text.index(text[-1])].lower():
+            marked, end_offset = PLACEHOLDER_PATTERN.sub(mark, text), offset(end)
+        elif text == "{" and index + 2 < len(tokens) and tokens[index + 1][1] in params and tokens[index + 2][1] == "}":
+            marked, end_offset = f"{PLACEHOLDER_OPEN}{tokens[index + 1][1]}{PLACEHOLDER_CLOSE}", offset(tokens[index + 2][3])
+        else:
+            continue
+        output += [code[position:offset(start)], marked]
+        position = end_offset
+    output.append(code[position:])
+    return "".join(output)
 
-    # Read each line, strip off the line ending and append '\n'
-    for line in source:
-        if (line := line.rstrip('\r\n') + '\\\\n') != "\\\\n":
-            normalized_lines.append(f"    {line}")
-    
-    # Join all the lines to form the full content
-    normalized_content = ''.join(normalized_lines)
-    
-    return normalized_content
 
-def compile_file_to_command(file_data: Union[IO[bytes], str]) -> str:
+def exec_payload(code: str) -> str:
+    """ One line exec() of code, quoted with whichever quote needs fewer escapes """
+    quote = "'" if code.count("'") <= code.count('"') else '"'
+    return f"exec({quote}{code.translate(LITERAL_ESCAPES[quote])}{quote})"
+
+
+def compile_source(source: str,
+                   shorten_names: bool = False,
+                   strip_asserts: bool = True,
+                   handlers: Optional[str] = None,
+                   placeholders: bool = False,
+                   filename: str = "<source>",
+                   cache: Optional[CompileCache] = None
+                   ) -> CompiledSource:
     """
-    Compiles an open file in "r" mode into a str which is a one line lambda function of the entire file
-    The resulting function from the file wraps the script in a try/except with known failure marker and
-    an `exec()`. This function correctly escapes quotes, f-string curly brackets, strips newlines and fixes
-    line endings
-    Args:
-        file_data (IO[bytes]) : file pointer to script to compile into a wrapped lambda
+    Compile Python source to the smallest exec() payload that runs the same on MicroPython
+    args:
+        source (str): Python source
+        shorten_names (bool): Shorten local variable names, see rename_locals
+        strip_asserts (bool): Remove assert statements
+        handlers (str): Except clauses to run the code under, see wrap_in_try
+        placeholders (bool): The source is a raw command with {name} parameters, see find_placeholders
+        filename (str): Shown in syntax errors
+        cache (CompileCache): Reuse the result of compiling the same source with the same options
+    raises:
+        SyntaxError: The source is not valid Python
     """
-    if isinstance(file_data, str):
-        file_data = StringIO(file_data)
-    raw_command = file_data.read()
+    if cache is not None:
+        key = cache.key(source, shorten_names=shorten_names, strip_asserts=strip_asserts, handlers=handlers,
+                        placeholders=placeholders)
+        if (compiled := cache.get(key)) is not None:
+            return compiled
+
+    tree = ast.parse(source, filename)
+    params = find_placeholders(tree) if placeholders else []
+    tree = optimize(tree, strip_asserts=strip_asserts, shorten_names=shorten_names, reserved=set(params))
+    if handlers:
+        tree = wrap_in_try(tree, handlers)
+    code = minify(tree)
+    payload = exec_payload(_mark_placeholders(code, params) if params else code)
+    compiled = CompiledSource(code, payload, len(source.encode("utf-8")), params)
+    if cache is not None:
+        cache.put(key, compiled)
+    return compiled
+
 
-    raw_command = remove_comments(raw_command)
-    raw_command = fix_fstring_braces(raw_command)
-    raw_command = fix_lines(raw_command)
+def command_key(source: str, shorten_names: bool = True) -> str:
+    """ Hash of a raw command that changes whenever compile_command would give a different result """
+    from .upy import FAILED_MARKER # upy imports this module
+    return CompileCache.key(source, command=True, shorten_names=shorten_names, failed_marker=FAILED_MARKER)
 
-    # Escape any quotes
-    raw_command = raw_command.replace("\"", "\\\\\\\"")
-    raw_command = raw_command.replace("\'", "\\\\\\\'")
 
-    # wrap a try catch with known failure marker
-    raw_command = f"try:\\\\n{raw_command}\\\\nexcept Exception as e:\\\\n    print(f\\\\\\\"{{{{str(e)}}}}{FAILED_MARKER}\\\\\\\")"
+def compile_command(file_data: Union[IO[str], str], shorten_names: bool = True) -> CompiledCommand:
+    """
+    Compile a raw command to the body of its f-string in commands/compiled.py. The command runs inside
+    a try statement that prints FAILED_MARKER with the error, and its {name} placeholders become the
+    f-string's fields
+    args:
+        file_data (IO[str]): Raw command source, or an open file of it
+        shorten_names (bool): Shorten local variable names
+    """
+    from .upy import FAILED_MARKER # upy imports this module
 
-    # wrap in exec
-    raw_command = f"exec(\'{raw_command}\')"
+    source = file_data if isinstance(file_data, str) else file_data.read()
+    handlers = f"except Exception as e:\n    print(str(e) + {FAILED_MARKER!r})"
+    compiled = compile_source(source, shorten_names=shorten_names, placeholders=True, handlers=handlers)
+    command_str = compiled.payload.translate(FSTRING_ESCAPES)
+    # The wrapper is what an empty command compiles to, less its "pass"
+    wrapper_size = compile_source("", handlers=handlers).compiled_size - len("pass")
+    # Sentinels and braces are one byte each, the payload is the same size with the placeholders back
+    return CompiledCommand(command_str, compiled.params, compiled.original_size, compiled.compiled_size, wrapper_size)
 
-    return raw_command
 
+def compile_file_to_command(file_data: Union[IO[str], str]) -> str:
+    """
+    Compiles an open file in "r" mode into a str which is the body of a one line f-string lambda, see
+    compile_command
+    Args:
+        file_data (IO[str]) : file pointer to script to compile into a wrapped lambda
+    """
+    return compile_command(file_data).command_str
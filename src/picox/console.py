@@ -0,0 +1,253 @@
+import os
+import time
+import codecs
+import selectors
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional
+
+from .logconfig import LOGGER
+
+# Console lines kept in memory by default
+DEFAULT_RING_LINES = 1_000
+
+# Most bytes taken from a serial port per read while attached to its console
+CONSOLE_READ_SIZE = 65_536
+
+# Log file size before it is rotated, and rotated files kept
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 5
+
+
+class RotatingFileSink:
+    """
+    Append console text to a file. Once the file reaches max_bytes it is renamed to <path>.1, older files
+    move up to <path>.<backups> and the oldest is dropped, so a soak test can run for days in bounded space
+    """
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_LOG_MAX_BYTES, backups: int = DEFAULT_LOG_BACKUPS):
+        """
+        args:
+            path (Path): Log file, appended to if it exists
+            max_bytes (int): Size at which the file is rotated
+            backups (int): Rotated files kept, 0 truncates the file instead
+        """
+        if max_bytes <= 0:
+            raise ValueError(f"Log size must be positive, got {max_bytes}")
+        self.path = Path(path)
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._fp = self.path.open("ab")
+        self._size = self._fp.tell()
+
+    def _rotate(self):
+        self._fp.close()
+        for index in range(self._backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{index}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self._backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        self._fp = self.path.open("wb")
+        self._size = 0
+
+    def write(self, text: str) -> int:
+        data = text.encode("utf-8")
+        self._fp.write(data)
+        self._size += len(data)
+        if self._size >= self._max_bytes:
+            self._rotate()
+        return len(text)
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class ConsoleCapture:
+    """
+    Turn console bytes into text as they arrive. UTF-8 is decoded incrementally, so a character split
+    across reads stays whole, and each line can be prefixed with the host time it arrived. The text is
+    written to the sinks and the last lines are kept in a bounded ring buffer
+    """
+    def __init__(self,
+                 sinks: Iterable[IO[str]] = (),
+                 timestamps: bool = False,
+                 ring_lines: int = DEFAULT_RING_LINES
+                 ):
+        """
+        args:
+            sinks (Iterable[IO[str]]): Text streams to write to, e.g. sys.stdout or a RotatingFileSink
+            timestamps (bool): Prefix each line with the host time, to the millisecond
+            ring_lines (int): Lines kept for recent()
+        """
+        self._sinks = list(sinks)
+        self._timestamps = timestamps
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._ring: Deque[str] = deque(maxlen=ring_lines)
+        self._partial = ""       # Start of a line that has not ended yet, for the ring buffer
+        self._line_start = True  # Next text starts a new line
+        self.bytes_received = 0
+        self.lines_received = 0
+
+    def feed(self, data: bytes) -> str:
+        """
+        Add bytes read from the device
+        returns:
+            str : Text written to the sinks
+        """
+        self.bytes_received += len(data)
+        text = self._decoder.decode(data)
+        if not text:
+            return text
+
+        lines = text.split("\n")
+        self.lines_received += len(lines) - 1
+        if len(lines) > 1:
+            self._ring.append((self._partial + lines[0]).rstrip("\r"))
+            self._ring.extend(line.rstrip("\r") for line in lines[1:-1])
+            self._partial = lines[-1]
+        else:
+            self._partial += lines[0]
+
+        if self._timestamps:
+            stamp = datetime.now().isoformat(sep=" ", timespec="milliseconds") + " "
+            # A line ending with this text starts the next line, which is stamped when its first text arrives
+            text = (stamp if self._line_start else "") + text[:-1].replace("\n", "\n" + stamp) + text[-1]
+            self._line_start = text.endswith("\n")
+
+        for sink in self._sinks:
+            sink.write(text)
+            sink.flush()
+        return text
+
+    def recent(self) -> List[str]:
+        """ Last lines received, oldest first. A line still arriving is included """
+        return list(self._ring) + ([self._partial.rstrip("\r")] if self._partial else [])
+
+    def close(self):
+        """ Flush text held by the decoder """
+        if remaining := self._decoder.decode(b"", final=True):
+            for sink in self._sinks:
+                sink.write(remaining)
+                sink.flush()
+
+
+class ConsoleRate(NamedTuple):
+    """Console traffic from one device"""
+    device: str
+    bytes_per_second: float  # Since the last report
+    lines_per_second: float
+    bytes: int               # Since attaching
+    lines: int
+
+
+class _Console:
+    """A device attached to a ConsoleMultiplexer"""
+    def __init__(self, device: str, fileno: int, capture: ConsoleCapture, tag: str):
+        self.device = device
+        self.fileno = fileno
+        self.capture = capture
+        self.tag = tag
+        self.partial = ""   # Tagged output waits for the end of the line
+        self.reported_bytes = 0
+        self.reported_lines = 0
+
+
+class ConsoleMultiplexer:
+    """
+    Attach to the consoles of many devices from one selector loop. Each device's output goes through its
+    own ConsoleCapture (e.g. to a file per device) and, line by line and tagged with the device, to a
+    shared output such as the terminal. Only lines are interleaved, never parts of them
+    """
+    def __init__(self, output: Optional[IO[str]] = None):
+        """
+        args:
+            output (IO[str]): Shared text stream for tagged lines, None to only use the captures
+        """
+        self._output = output
+        self._selector = selectors.DefaultSelector()
+        self._consoles: Dict[int, _Console] = {}
+
+    def add(self, device: str, fileno: int, capture: ConsoleCapture, tag: Optional[str] = None):
+        """
+        args:
+            device (str): Device name used in rates and errors
+            fileno (int): Open file descriptor of the device's serial port, see Pico.fileno()
+            capture (ConsoleCapture): Receives everything the device sends
+            tag (str): Prefix for the device's lines in the shared output. Defaults to "[<device>] "
+        """
+        console = _Console(device, fileno, capture, f"[{device}] " if tag is None else tag)
+        self._consoles[fileno] = console
+        self._selector.register(fileno, selectors.EVENT_READ, console)
+
+    def _remove(self, console: _Console):
+        self._selector.unregister(console.fileno)
+        del self._consoles[console.fileno]
+        console.capture.close()
+        if console.partial and self._output:
+            self._output.write(console.tag + console.partial + "\n")
+
+    def _read(self, console: _Console):
+        try:
+            recv_bytes = os.read(console.fileno, CONSOLE_READ_SIZE)
+        except OSError as err:
+            recv_bytes = b""
+            LOGGER.debug(f"Read from {console.device} failed :: {err}")
+        if not recv_bytes:
+            LOGGER.warning(f"{console.device} disconnected")
+            self._remove(console)
+            return
+
+        text = console.capture.feed(recv_bytes)
+        if self._output and text:
+            *lines, console.partial = (console.partial + text).split("\n")
+            if lines:
+                self._output.write("".join(f"{console.tag}{line}\n" for line in lines))
+                self._output.flush()
+
+    def rates(self, elapsed: float) -> List[ConsoleRate]:
+        """
+        Traffic from each device since the last call
+        args:
+            elapsed (float): Seconds since the last call
+        """
+        rates = []
+        for console in self._consoles.values():
+            received_bytes = console.capture.bytes_received
+            received_lines = console.capture.lines_received
+            rates.append(ConsoleRate(console.device,
+                                     (received_bytes - console.reported_bytes) / elapsed,
+                                     (received_lines - console.reported_lines) / elapsed,
+                                     received_bytes, received_lines))
+            console.reported_bytes = received_bytes
+            console.reported_lines = received_lines
+        return rates
+
+    def run(self,
+            report_interval: Optional[float] = None,
+            on_report: Optional[Callable[[List[ConsoleRate]], None]] = None
+            ):
+        """
+        Read every device until all have disconnected or the loop is interrupted
+        args:
+            report_interval (float): Seconds between rate reports
+            on_report (Callable): Called with the rate of each device every report_interval
+        """
+        last_report = time.monotonic()
+        try:
+            while self._consoles:
+                timeout = None
+                if report_interval and on_report:
+                    timeout = max(last_report + report_interval - time.monotonic(), 0)
+                for key, _ in self._selector.select(timeout):
+                    self._read(key.data)
+                if timeout is not None and (now := time.monotonic()) - last_report >= report_interval:
+                    on_report(self.rates(now - last_report))
+                    last_report = now
+        finally:
+            for console in list(self._consoles.values()):
+                self._remove(console)
+            self._selector.close()
@@ -0,0 +1,414 @@
+import os
+import re
+import json
+import stat
+import base64
+import socket
+import tempfile
+import functools
+import socketserver
+from pathlib import Path
+from typing import IO, Callable, Iterator, List, Optional
+
+from .exceptions import RemotePicoException, ResponseTimeout
+from .execution import EXEC_ERROR_MARKER, FileExecution
+from .fs import FileEntry
+from .logconfig import LOGGER
+from .sync import DEFAULT_SYNC_IGNORE, SyncPlan
+from .transfer import DOWNLOAD_BLOCK_SIZE, ProgressCallback
+
+DAEMON_AVAILABLE = hasattr(socket, "AF_UNIX")
+
+# Exceptions re-raised by the client with their original type
+FORWARDED_ERRORS = {
+    error.__name__: error
+    for error in (FileExistsError, FileNotFoundError, NotADirectoryError, IOError, ValueError)
+}
+
+# Calls the daemon may make on the client's file during an upload or download
+FILE_OPERATIONS = ("read", "write", "seek", "tell", "truncate", "seekable")
+
+
+def socket_path(device: str) -> Path:
+    """
+    Socket a daemon for a serial device listens on. Symlinks such as /dev/serial/by-id are resolved,
+    so every name for a device finds the same daemon
+    raises:
+        PermissionError - If the fallback directory in /tmp is not a private directory of this user
+    """
+    if runtime_dir := os.environ.get("XDG_RUNTIME_DIR"):
+        directory = Path(runtime_dir)
+    else:
+        directory = _private_directory(Path(tempfile.gettempdir()) / f"picox-{os.getuid()}")
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.realpath(device).strip("/"))
+    return directory / f"picox-{name}.sock"
+
+
+def _private_directory(directory: Path) -> Path:
+    """
+    Create a directory only this user can use. Another user could have created it first, in a shared
+    directory such as /tmp, to intercept the sockets in it, so an existing one must be ours and private
+    """
+    directory.mkdir(mode=0o700, exist_ok=True)
+    info = directory.lstat()
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+        raise PermissionError(f"{directory} is not a private directory owned by this user, remove it or set XDG_RUNTIME_DIR")
+    return directory
+
+
+def _encode_value(value):
+    """ JSON form of a file operation's argument or result, bytes as base64 """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"bytes": base64.b64encode(value).decode("ascii")}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return base64.b64decode(value["bytes"])
+    return value
+
+
+class _ClientFile:
+    """
+    The file an upload reads from or a download writes to, still open in the client. Each call is sent over
+    the request's connection and answered by the client, so neither side holds the whole file
+    """
+    def __init__(self, handler: "_RequestHandler"):
+        self._handler = handler
+
+    def _call(self, operation: str, *args):
+        self._handler._send({"file": [operation, *map(_encode_value, args)]})
+        reply = json.loads(self._handler.rfile.readline() or b'{"error": "IOError", "message": "Client went away"}')
+        if (error := reply.get("error")) is not None:
+            raise FORWARDED_ERRORS.get(error, IOError)(reply["message"])
+        return _decode_value(reply["result"])
+
+    def read(self, size: int = -1):
+        return self._call("read", size)
+
+    def write(self, data) -> int:
+        return self._call("write", data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._call("seek", offset, whence)
+
+    def tell(self) -> int:
+        return self._call("tell")
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        return self._call("truncate", size)
+
+    def seekable(self) -> bool:
+        return self._call("seekable")
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    One JSON request per connection. Progress and streamed items are sent as they happen, then the result.
+    Transfers call back to the client for its file, see _ClientFile
+    """
+    def _send(self, message: dict):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        daemon: PicoDaemon = self.server.daemon
+        try:
+            request = json.loads(self.rfile.readline())
+            result = daemon.dispatch(request["method"], request.get("params", {}), self._send, _ClientFile(self))
+            self._send({"result": result})
+        except RemotePicoException as err:
+            self._send({"error": type(err).__name__, "message": err.args[0], "remote_exception": err.remote_exception})
+        except ResponseTimeout as err:
+            self._send({"error": type(err).__name__, "message": err.args[0], "partial_output": err.partial_output})
+        except Exception as err:
+            LOGGER.debug(f"Request failed :: {err!r}")
+            self._send({"error": type(err).__name__, "message": str(err)})
+
+
+class PicoDaemon:
+    """
+    Hold a Pico session open and serve it to picox commands over a Unix socket, so each command skips
+    opening the port, stopping the device and the coms test. Requests are handled one at a time
+    """
+    def __init__(self, pico, path: Path):
+        """
+        args:
+            pico (Pico): Open session to serve
+            path (Path): Unix socket to listen on
+        """
+        self._pico = pico
+        self._path = path
+        self._user_code_started = False # exec or reboot may have left a program running
+        self._server: Optional[socketserver.UnixStreamServer] = None
+
+    def serve_forever(self):
+        """ Serve requests until interrupted. The socket is removed on exit """
+        if self._path.exists():
+            self._path.unlink() # Stale, callers check for a live daemon first
+        self._server = socketserver.UnixStreamServer(str(self._path), _RequestHandler)
+        self._server.daemon = self
+        os.chmod(self._path, 0o600)
+        LOGGER.info(f"Serving {self._pico._serial_port} on {self._path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._path.unlink(missing_ok=True)
+
+    def shutdown(self):
+        """ Stop serve_forever from another thread """
+        if self._server:
+            self._server.shutdown()
+
+    def dispatch(self, method: str, params: dict, send: Callable[[dict], None], client_file: Optional[IO] = None):
+        """
+        Run a request against the Pico
+        args:
+            method (str): Operation name
+            params (dict): Keyword arguments of the operation
+            send (Callable): Sends progress and streamed items to the client
+            client_file (IO): The client's file to upload from or download to
+        returns:
+            JSON serialisable result
+        """
+        def progress(done: int, total: Optional[int]):
+            send({"progress": [done, total]})
+
+        if method == "ping":
+            return self._pico._serial_port
+        if self._user_code_started and method != "stop_exec":
+            # Same state a fresh connection would get
+            self._pico.stop_exec()
+            self._user_code_started = False
+
+        match method:
+            case "get_file_list":
+                return self._pico.get_file_list()
+            case "walk":
+                for entry in self._pico.walk(params["remote_dir"], params["recursive"]):
+                    send({"item": list(entry)})
+                return None
+            case "upload_file":
+                return self._pico.upload_file(client_file, params["pico_file_path"], overwrite=params["overwrite"],
+                                              chunk_size=params["chunk_size"], progress_callback=progress,
+                                              compress=params["compress"], resume=params["resume"],
+                                              timeout=params["timeout"], idle_timeout=params["idle_timeout"])
+            case "download_file":
+                return self._pico.download_file(params["pico_filename"], client_file, binary=params["binary"],
+                                                block_size=params["block_size"], progress_callback=progress,
+                                                compress=params["compress"], resume=params["resume"],
+                                                timeout=params["timeout"], idle_timeout=params["idle_timeout"])
+            case "sync":
+                return list(self._pico.sync(Path(params["local_dir"]), params["remote_dir"], delete=params["delete"],
+                                            dry_run=params["dry_run"], ignore=params["ignore"]))
+            case "run_python_command":
+                return self._pico.run_python_command(params["command"], params["block_command"],
+                                                     timeout=params.get("timeout"), idle_timeout=params.get("idle_timeout"))
+            case "execute_file" | "run_script":
+                self._user_code_started = True
+                if method == "execute_file":
+                    start = functools.partial(self._pico.execute_file, params["file_name"])
+                else:
+                    # The daemon runs on this machine, it reads the script itself
+                    start = functools.partial(self._pico.run_script, params["local_path"],
+                                              shorten_names=params["shorten_names"])
+                if not params.get("follow"):
+                    start()
+                    return None
+                execution = start(follow=True, idle_timeout=params["idle_timeout"])
+                for line in execution:
+                    send({"item": line})
+                self._user_code_started = False # Finished
+                return execution.result.traceback
+            case "send_soft_reboot":
+                self._pico.send_soft_reboot()
+                self._user_code_started = True # main.py
+                return None
+            case "stop_exec":
+                self._pico.stop_exec()
+                self._user_code_started = False
+                return None
+        raise ValueError(f"Unknown daemon method '{method}'")
+
+
+class DaemonClient:
+    """
+    Send commands to a running picox daemon. Implements the Pico methods used by the CLI, with the
+    same arguments, so it can be used in place of a Pico
+    """
+    def __init__(self, path: Path):
+        self._path = path
+
+    def _request(self, method: str, progress_callback: Optional[ProgressCallback] = None,
+                 local_file: Optional[IO] = None, **params) -> Iterator[dict]:
+        """
+        Send a request and yield streamed items, ending with the result message
+        args:
+            local_file (IO): File the daemon reads from or writes to during a transfer
+        raises:
+            Errors raised by the operation in the daemon
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(self._path))
+            sock.sendall((json.dumps({"method": method, "params": params}) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as stream:
+                for line in stream:
+                    message = json.loads(line)
+                    if "progress" in message:
+                        if progress_callback:
+                            progress_callback(*message["progress"])
+                    elif "file" in message:
+                        sock.sendall(self._file_operation(local_file, message["file"]))
+                    elif "item" in message:
+                        yield message
+                    else:
+                        self._raise_error(message)
+                        yield message
+                        return
+        raise IOError(f"picox daemon at {self._path} closed the connection")
+
+    def _call(self, method: str, progress_callback: Optional[ProgressCallback] = None,
+              local_file: Optional[IO] = None, **params):
+        """ Send a request and return its result """
+        for message in self._request(method, progress_callback, local_file, **params):
+            if "result" in message:
+                return message["result"]
+
+    @staticmethod
+    def _file_operation(local_file: Optional[IO], call: list) -> bytes:
+        """ Run a call the daemon made on the local file, returning the reply to send back """
+        operation, *args = call
+        try:
+            if local_file is None or operation not in FILE_OPERATIONS:
+                raise ValueError(f"picox daemon asked for '{operation}' on a file, the request has none")
+            reply = {"result": _encode_value(getattr(local_file, operation)(*map(_decode_value, args)))}
+        except (OSError, ValueError) as err:
+            reply = {"error": type(err).__name__, "message": str(err)}
+        return (json.dumps(reply) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _raise_error(message: dict):
+        if (error := message.get("error")) is None:
+            return
+        if error == RemotePicoException.__name__:
+            raise RemotePicoException(message["message"], message["remote_exception"])
+        if error == ResponseTimeout.__name__:
+            raise ResponseTimeout(message["message"], message["partial_output"])
+        raise FORWARDED_ERRORS.get(error, RuntimeError)(message["message"])
+
+    def ping(self) -> str:
+        """ Serial port the daemon is serving """
+        return self._call("ping")
+
+    def get_file_list(self) -> List[str]:
+        return self._call("get_file_list")
+
+    def walk(self, remote_dir: str = "/", recursive: bool = True) -> Iterator[FileEntry]:
+        for message in self._request("walk", remote_dir=remote_dir, recursive=recursive):
+            if "item" in message:
+                yield FileEntry(*message["item"])
+
+    def upload_file(self,
+                    local_fp: IO,
+                    pico_file_path,
+                    overwrite: bool = False,
+                    chunk_size: Optional[int] = None,
+                    progress_callback: Optional[ProgressCallback] = None,
+                    compress: Optional[bool] = None,
+                    resume: bool = False,
+                    timeout: Optional[float] = None,
+                    idle_timeout: Optional[float] = None
+                    ) -> int:
+        # The daemon reads local_fp a chunk at a time as it uploads
+        return self._call("upload_file", progress_callback, local_fp, pico_file_path=str(pico_file_path),
+                          overwrite=overwrite, chunk_size=chunk_size, compress=compress, resume=resume,
+                          timeout=timeout, idle_timeout=idle_timeout)
+
+    def download_file(self,
+                      pico_filename,
+                      save_fp: IO,
+                      binary: bool = False,
+                      block_size: int = DOWNLOAD_BLOCK_SIZE,
+                      progress_callback: Optional[ProgressCallback] = None,
+                      compress: Optional[bool] = None,
+                      resume: bool = False,
+                      timeout: Optional[float] = None,
+                      idle_timeout: Optional[float] = None
+                      ) -> int:
+        # The daemon writes to save_fp a block at a time, and reads what is already saved to resume
+        return self._call("download_file", progress_callback, save_fp, pico_filename=str(pico_filename),
+                          binary=binary, block_size=block_size, compress=compress, resume=resume,
+                          timeout=timeout, idle_timeout=idle_timeout)
+
+    def sync(self,
+             local_dir: Path,
+             remote_dir: str = "/",
+             delete: bool = False,
+             dry_run: bool = False,
+             ignore=DEFAULT_SYNC_IGNORE
+             ) -> SyncPlan:
+        # The daemon runs on this machine, it reads the local directory itself
+        plan = self._call("sync", local_dir=str(Path(local_dir).resolve()), remote_dir=remote_dir,
+                          delete=delete, dry_run=dry_run, ignore=list(ignore))
+        return SyncPlan(*plan)
+
+    def run_python_command(self, command, block_command=False, timeout: Optional[float] = None,
+                           idle_timeout: Optional[float] = None):
+        return self._call("run_python_command", command=command, block_command=block_command, timeout=timeout,
+                          idle_timeout=idle_timeout)
+
+    def execute_file(self, file_name, follow: bool = False, idle_timeout: Optional[float] = None) -> Optional[FileExecution]:
+        if not follow:
+            return self._call("execute_file", file_name=str(file_name))
+        return FileExecution(file_name, self._follow_lines("execute_file", idle_timeout, file_name=str(file_name)))
+
+    def run_script(self, local_path, follow: bool = False, idle_timeout: Optional[float] = None,
+                   shorten_names: bool = False) -> Optional[FileExecution]:
+        params = dict(local_path=str(Path(local_path).resolve()), shorten_names=shorten_names)
+        if not follow:
+            return self._call("run_script", **params)
+        return FileExecution(local_path, self._follow_lines("run_script", idle_timeout, **params))
+
+    def _follow_lines(self, method: str, idle_timeout: Optional[float], **params) -> Iterator[str]:
+        """ Output lines streamed by the daemon, ending with the traceback framed as the device sends it """
+        for message in self._request(method, follow=True, idle_timeout=idle_timeout, **params):
+            if "item" in message:
+                yield message["item"]
+            elif (traceback := message["result"]) is not None:
+                yield EXEC_ERROR_MARKER
+                yield from traceback.splitlines()
+
+    def send_soft_reboot(self):
+        return self._call("send_soft_reboot")
+
+    def stop_exec(self):
+        return self._call("stop_exec")
+
+    def close(self):
+        pass # Each call has its own connection, the daemon keeps the device open
+
+
+def connect_daemon(device: str) -> Optional[DaemonClient]:
+    """
+    Find a running daemon for a serial device
+    returns:
+        DaemonClient or None if no daemon is serving the device
+    """
+    if not DAEMON_AVAILABLE:
+        return None
+    try:
+        path = socket_path(device)
+    except PermissionError as err:
+        LOGGER.warning(f"Not looking for a picox daemon :: {err}")
+        return None
+    if not path.exists():
+        return None
+    client = DaemonClient(path)
+    try:
+        client.ping()
+    except (ConnectionRefusedError, FileNotFoundError):
+        LOGGER.debug(f"Ignoring stale daemon socket {path}")
+        return None
+    return client
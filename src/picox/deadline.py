@@ -0,0 +1,32 @@
+import time
+from typing import Optional
+
+
+class ResponseDeadline:
+    """
+    Time limits for one call to the device: the whole call must finish within timeout seconds, and the device
+    may go quiet for at most idle_timeout seconds at a time. Each serial read waits for the idle timeout, cut
+    short by the deadline, so a call never overruns its limit by more than one read
+    """
+    def __init__(self, timeout: Optional[float] = None, idle_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None):
+        """
+        args:
+            timeout (float): Seconds for the whole call, None for no limit
+            idle_timeout (float): Seconds without data before giving up. Defaults to read_timeout
+            read_timeout (float): Serial read timeout outside the call, None waits forever
+        """
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout if idle_timeout is not None else read_timeout
+        self._expires = None if timeout is None else time.monotonic() + timeout
+
+    @property
+    def expired(self) -> bool:
+        return self._expires is not None and time.monotonic() >= self._expires
+
+    def read_timeout(self) -> Optional[float]:
+        """ Serial read timeout for the next read, None waits forever """
+        if self._expires is None:
+            return self.idle_timeout
+        remaining = max(self._expires - time.monotonic(), 0.0)
+        return remaining if self.idle_timeout is None else min(self.idle_timeout, remaining)
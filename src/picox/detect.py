@@ -1,6 +1,12 @@
+import os
 import glob
+import json
+import time
 import platform
-from typing import List, Optional
+import tempfile
+import concurrent.futures
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
 
 import serial
 import serial.tools.list_ports
@@ -8,6 +14,23 @@ import serial.tools.list_ports
 from .upy import Pico
 from .logconfig import LOGGER
 
+DEFAULT_PROBE_WORKERS = 16
+DEFAULT_PROBE_DEADLINE = 5.0 # Seconds each probe may take, from when it starts
+DEFAULT_CACHE_MAX_AGE = 24 * 60 * 60 # Seconds before a cached probe result is re-checked
+
+RP2040_VID = 0x2E8A
+MICROPYTHON_RP2040_PID = 0x0005
+
+
+class UsbPort(NamedTuple):
+    """USB descriptors of a serial device"""
+    device: str
+    vid: Optional[int]
+    pid: Optional[int]
+    serial_number: Optional[str]
+    product: Optional[str]
+    manufacturer: Optional[str]
+
 
 def get_serial_ports() -> List[str]:
     """
@@ -26,19 +49,192 @@ def get_serial_ports() -> List[str]:
         case _:
             raise NotImplementedError("Unsupported OS")
 
-def is_pico(device: str) -> bool:
+def _read_sysfs_attribute(path: Path) -> Optional[str]:
+    """Read a sysfs attribute file, None if it does not exist"""
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+def _list_usb_ports_sysfs(sysfs_root: Path) -> List[UsbPort]:
+    """
+    Read USB descriptors of ttyACM devices from sysfs without opening them.
+    class/tty/ttyACM*/device links to the USB interface, whose parent holds the device descriptors
+    """
+    usb_ports = []
+    for tty in sorted((sysfs_root / "class" / "tty").glob("ttyACM*")):
+        interface = tty / "device"
+        if not interface.exists():
+            continue
+        usb_device = interface.resolve().parent
+        vid = _read_sysfs_attribute(usb_device / "idVendor")
+        pid = _read_sysfs_attribute(usb_device / "idProduct")
+        usb_ports.append(UsbPort(
+            device=f"/dev/{tty.name}",
+            vid=int(vid, 16) if vid else None,
+            pid=int(pid, 16) if pid else None,
+            serial_number=_read_sysfs_attribute(usb_device / "serial"),
+            product=_read_sysfs_attribute(usb_device / "product"),
+            manufacturer=_read_sysfs_attribute(usb_device / "manufacturer"),
+        ))
+    return usb_ports
+
+def list_usb_ports(sysfs_root: Optional[Path] = None) -> List[UsbPort]:
+    """
+    Get USB descriptors for serial devices without opening any port
+    args:
+        sysfs_root (Path): Read descriptors from this sysfs tree instead of asking pyserial.
+            Defaults to /sys on Linux
+    returns:
+        List[UsbPort]
+    """
+    if sysfs_root is None and platform.system() == "Linux":
+        sysfs_root = Path("/sys")
+    if sysfs_root is not None:
+        return _list_usb_ports_sysfs(sysfs_root)
+    return [
+        UsbPort(port.device, port.vid, port.pid, port.serial_number, port.product, port.manufacturer)
+        for port in serial.tools.list_ports.comports()
+        if port.vid is not None
+    ]
+
+def is_micropython_rp2040(port: UsbPort) -> bool:
+    """
+    Check USB descriptors for an RP2040 running MicroPython
+    args:
+        port (UsbPort): Descriptors of a serial device
+    returns:
+        bool : True if the descriptors identify MicroPython on an RP2040
+    """
+    if port.vid != RP2040_VID:
+        return False
+    return port.pid == MICROPYTHON_RP2040_PID or port.manufacturer == "MicroPython"
+
+def default_cache_path() -> Path:
+    """Location of the detection cache for this user"""
+    if platform.system() == "Windows":
+        base = Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local"))
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    return base / "picox" / "detect.json"
+
+
+class DetectionCache:
+    """
+    Probe results stored on disk, keyed by USB serial number so a board is recognised on any port
+    """
+    def __init__(self, path: Optional[Path] = None, max_age: float = DEFAULT_CACHE_MAX_AGE):
+        """
+        args:
+            path (Path): Cache file, defaults to default_cache_path()
+            max_age (float): Seconds a result stays valid
+        """
+        self._path = path or default_cache_path()
+        self._max_age = max_age
+        self._dirty = False
+        try:
+            self._entries: Dict[str, dict] = json.loads(self._path.read_text())
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def lookup(self, port: UsbPort) -> Optional[bool]:
+        """
+        Get the cached probe result for a port
+        returns:
+            bool : Cached result, or None if there is no fresh result
+        """
+        if not port.serial_number:
+            return None
+        entry = self._entries.get(port.serial_number)
+        if not entry or time.time() - entry.get("checked", 0) > self._max_age:
+            return None
+        if (entry.get("vid"), entry.get("pid")) != (port.vid, port.pid):
+            return None # Same serial number on different hardware, do not trust it
+        return entry.get("is_pico")
+
+    def store(self, port: UsbPort, is_pico: bool):
+        """Remember the probe result for a port. Ports without a serial number are not cached"""
+        if not port.serial_number:
+            return
+        self._entries[port.serial_number] = {
+            "is_pico": is_pico,
+            "vid": port.vid,
+            "pid": port.pid,
+            "product": port.product,
+            "device": port.device,
+            "checked": time.time(),
+        }
+        self._dirty = True
+
+    def save(self):
+        """Write the cache to disk if it changed. Failures are logged, not raised"""
+        if not self._dirty:
+            return
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=self._path.parent, delete=False, suffix=".tmp") as tmp_fp:
+                json.dump(self._entries, tmp_fp, indent=2)
+            os.replace(tmp_fp.name, self._path)
+            self._dirty = False
+        except OSError as err:
+            LOGGER.debug(f"Unable to save detection cache {self._path}: {err}")
+
+
+class _ProbeSerial:
+    """
+    Serial port of a probe. Reads and writes give up once the probe's deadline has passed, so a port that
+    never answers ends its probe in time instead of holding a worker and the port
+    """
+    def __init__(self, port: serial.Serial, expires: float):
+        self._port = port
+        self._expires = expires
+        self.timeout = port.timeout
+
+    def read(self, size: int = 1) -> bytes:
+        remaining = self._expires - time.monotonic()
+        if remaining <= 0:
+            return b''
+        read_timeout = remaining if self.timeout is None else min(self.timeout, remaining)
+        if self._port.timeout != read_timeout:
+            self._port.timeout = read_timeout
+        return self._port.read(size)
+
+    def write(self, data: bytes) -> Optional[int]:
+        if time.monotonic() >= self._expires:
+            raise serial.SerialTimeoutException("Probe deadline passed")
+        return self._port.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self._port, name)
+
+
+def is_pico(device: str, reboot: bool = True, deadline: Optional[float] = None) -> bool:
     """
     Try to determine if USB serial device is a Pi Pico device
     args:
         device (str): USB serial device to test
+        reboot (bool): Stop and soft reboot the device before the coms test. When False the device
+            is only interrupted (Ctrl+C), which is faster and keeps its state
+        deadline (float): Seconds the probe may take, it is not a Pico if it has not answered by then
     returns:
         bool : True/False if MicroPython passed the coms test
     """
+    expires = None if deadline is None else time.monotonic() + deadline
+    opened = [] # Closed here if connecting fails, there is no Pico to close it
+
+    def serial_factory(**kwargs):
+        port = serial.Serial(**kwargs)
+        opened.append(port)
+        return port if expires is None else _ProbeSerial(port, expires)
+
+    pico = None
     try:
-        Pico(
+        pico = Pico(
             device,
             serial_read_timeout=1,
             serial_write_timeout=1,
+            reboot_on_connect=reboot,
+            serial_factory=serial_factory,
         )
     except Exception as err:
         if "[Errno 13]" in str(err):
@@ -46,39 +242,174 @@ def is_pico(device: str) -> bool:
         return False
     else:
         return True
+    finally:
+        closers = [pico.close] if pico is not None else [port.close for port in opened]
+        for close in closers:
+            try:
+                close()
+            except Exception as err:
+                LOGGER.debug(f"[{device}] :: Error closing port after probe: {err}")
 
-def search_ports_for_pico(serial_devices: List[str]) -> List[str]:
+def _probe_results(serial_devices: List[str],
+                   reboot: bool,
+                   first_only: bool,
+                   max_workers: int,
+                   deadline: float
+                   ) -> Dict[str, bool]:
     """
-    Iterate over list of strings and try to communicate on those USB serial ports with a Pi Pico
+    Probe serial devices in parallel, see probe_ports
+    returns:
+        Dict[str, bool] : Result of each probe that ran. Probes cancelled by first_only are left out
     """
-    for device in serial_devices:
-        if is_pico(device):
-            return device
-    else:
-        return None
+    if not serial_devices:
+        return {}
+
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(max_workers, len(serial_devices)),
+        thread_name_prefix="picox-probe",
+    )
+    # Each probe ends by itself within its deadline, however long it waited for a worker
+    futures = {executor.submit(is_pico, device, reboot, deadline): device for device in serial_devices}
+    results = {}
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+            if first_only and results[futures[future]]:
+                break
+    finally:
+        # Do not wait on the other probes after first_only found a Pico, they close their own port when done
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def probe_ports(serial_devices: Iterable[str],
+                reboot: bool = True,
+                first_only: bool = False,
+                max_workers: int = DEFAULT_PROBE_WORKERS,
+                deadline: float = DEFAULT_PROBE_DEADLINE
+                ) -> List[str]:
+    """
+    Probe serial devices for a Pi Pico in parallel
+    args:
+        serial_devices (Iterable[str]): Serial devices to probe
+        reboot (bool): Soft reboot each device during the probe, see is_pico
+        first_only (bool): Return as soon as one Pico is found, cancelling probes that have not started
+        max_workers (int): Most ports probed at the same time
+        deadline (float): Seconds each probe may take from when it starts. A port that has not answered by then
+            is not a Pico
+    returns:
+        List[str] : Detected Pico devices in the order they were given
+    """
+    serial_devices = list(serial_devices)
+    results = _probe_results(serial_devices, reboot, first_only, max_workers, deadline)
+    return [device for device in serial_devices if results.get(device)]
+
+def detect_picos(reboot: bool = True,
+                 first_only: bool = False,
+                 cache: Optional[DetectionCache] = None,
+                 sysfs_root: Optional[Path] = None,
+                 max_workers: int = DEFAULT_PROBE_WORKERS,
+                 deadline: float = DEFAULT_PROBE_DEADLINE
+                 ) -> List[str]:
+    """
+    Detect Pico devices using USB descriptors first, then cached results, and only probe the rest.
+    A port reporting MicroPython on an RP2040 (2E8A) is never opened
+    args:
+        reboot (bool): Soft reboot devices that need probing, see is_pico
+        first_only (bool): Stop at the first Pico found
+        cache (DetectionCache): Probe results by USB serial number. Defaults to the user cache file
+        sysfs_root (Path): Read USB descriptors from this sysfs tree. Only its ports are considered
+        max_workers (int): Most ports probed at the same time
+        deadline (float): Seconds each probe may take, see probe_ports
+    returns:
+        List[str] : Detected Pico devices
+    """
+    cache = cache or DetectionCache()
+    usb_ports = {port.device: port for port in list_usb_ports(sysfs_root)}
+    candidates = set(usb_ports)
+    if sysfs_root is None:
+        # macOS lists each port twice, as /dev/cu.* (with descriptors) and /dev/tty.*
+        candidates.update(device for device in get_serial_ports() if _callout_device(device) not in usb_ports)
+
+    detected = []
+    to_probe = []
+    for device in sorted(candidates):
+        port = usb_ports.get(device)
+        if port and is_micropython_rp2040(port):
+            detected.append(device)
+        elif (cached := cache.lookup(port) if port else None) is None:
+            to_probe.append(device)
+        elif cached:
+            detected.append(device)
+
+    if first_only and detected:
+        return detected[:1]
+
+    results = _probe_results(to_probe, reboot, first_only, max_workers, deadline)
+    for device, result in results.items():
+        if port := usb_ports.get(device):
+            cache.store(port, result)
+    cache.save()
+
+    detected.extend(device for device in to_probe if results.get(device))
+    detected.sort()
+    return detected[:1] if first_only else detected
+
+def _callout_device(device: str) -> str:
+    """ The macOS call-out device (/dev/cu.*) of a dial-in device (/dev/tty.*), other names unchanged """
+    if device.startswith("/dev/tty."):
+        return "/dev/cu." + device[len("/dev/tty."):]
+    return device
+
+def search_ports_for_pico(serial_devices: List[str], reboot: bool = True) -> Optional[str]:
+    """
+    Try to communicate on those USB serial ports with a Pi Pico, returning the first found
+    """
+    detected = probe_ports(serial_devices, reboot=reboot, first_only=True)
+    return detected[0] if detected else None
     
-def get_first_pico_serial() -> Optional[str]:
+def get_first_pico_serial(reboot: bool = True,
+                          max_workers: int = DEFAULT_PROBE_WORKERS,
+                          deadline: float = DEFAULT_PROBE_DEADLINE,
+                          use_descriptors: bool = True
+                          ) -> Optional[str]:
     """
-    Get ports + detect pico
+    Get ports + detect pico. Ports are probed in parallel and the first to respond wins
+    args:
+        use_descriptors (bool): Recognise Picos from USB descriptors and cached results before probing
     returns:
         str: serial device name or None
     """
-    serial_devices = get_serial_ports()
-    for device in serial_devices:
-        if is_pico(device):
-            return device
-    else:
-        return None
+    if use_descriptors:
+        detected = detect_picos(reboot=reboot, first_only=True, max_workers=max_workers, deadline=deadline)
+        return detected[0] if detected else None
+
+    detected = probe_ports(
+        get_serial_ports(),
+        reboot=reboot,
+        first_only=True,
+        max_workers=max_workers,
+        deadline=deadline,
+    )
+    return detected[0] if detected else None
 
-def get_all_pico_serial() -> List[str]:
+def get_all_pico_serial(reboot: bool = True,
+                        max_workers: int = DEFAULT_PROBE_WORKERS,
+                        deadline: float = DEFAULT_PROBE_DEADLINE,
+                        use_descriptors: bool = True
+                        ) -> List[str]:
     """
-    Get ports then return all detected pico devices
+    Get ports then return all detected pico devices. Ports are probed in parallel
+    args:
+        use_descriptors (bool): Recognise Picos from USB descriptors and cached results before probing
     returns:
         List[str] : List of potential Pico serial devices
     """
-    serial_devices = get_serial_ports()
-    pico_devices = []
-    for serial_device in serial_devices:
-        if is_pico(serial_device):
-            pico_devices.append(serial_device)
-    return pico_devices
\ No newline at end of file
+    if use_descriptors:
+        return detect_picos(reboot=reboot, max_workers=max_workers, deadline=deadline)
+
+    return probe_ports(
+        get_serial_ports(),
+        reboot=reboot,
+        max_workers=max_workers,
+        deadline=deadline,
+    )
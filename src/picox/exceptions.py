@@ -17,3 +17,20 @@ class RemotePicoException(Exception):
         Return the string representation of the exception,
         """
         return f"{self.args[0]}\nRemote Exception:\n{self.remote_exception}"
+
+
+class TransferError(IOError):
+    """A chunk or block of a file transfer was rejected, garbled or lost on the way"""
+
+
+class ResponseTimeout(TimeoutError):
+    """The device did not finish responding in time"""
+
+    def __init__(self, message: str, partial_output: str = ""):
+        """
+        Args:
+            message (str): A human-readable message describing the timeout.
+            partial_output (str): What the device sent before the timeout, not yet returned to the caller.
+        """
+        super().__init__(message)
+        self.partial_output = partial_output
@@ -0,0 +1,118 @@
+import time
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from .compiler import CompileCache, CompiledSource, compile_source
+
+# Printed on the device when the file raises, followed by the traceback
+EXEC_ERROR_MARKER = "---6c3f2a90-1d7e-4b85-a4c2-93e8f05b7d61---RAISED"
+
+# Runs a file in the REPL namespace, like exec(open(...).read()), and reports an exception instead of
+# raising it. SystemExit is a normal end of the script
+EXEC_TEMPLATE = """import sys
+try:
+    exec(open({file_name!r}).read())
+except SystemExit:
+    pass
+except Exception as _e:
+    print({error!r})
+    sys.print_exception(_e)
+"""
+
+# Except clauses for a script sent from this machine, reporting how it ended as EXEC_TEMPLATE does
+SCRIPT_HANDLERS = """except SystemExit:
+    pass
+except Exception as _e:
+    import sys
+    print({error!r})
+    sys.print_exception(_e)
+"""
+
+
+class ExecutionResult(NamedTuple):
+    """How a file run on the device ended"""
+    file_name: str
+    traceback: Optional[str]  # Printed by the device if the file raised, otherwise None
+    duration: float           # Wall clock seconds from starting the file until it finished
+
+    @property
+    def ok(self) -> bool:
+        return self.traceback is None
+
+    @property
+    def error(self) -> Optional[str]:
+        """ Last line of the traceback, e.g. 'ZeroDivisionError: divide by zero' """
+        return self.traceback.splitlines()[-1] if self.traceback else None
+
+
+def build_exec_command(file_name) -> str:
+    """
+    Build one REPL line that runs a file on the device and reports how it ended
+    returns:
+        str : Single line command
+    """
+    script = EXEC_TEMPLATE.format(file_name=str(file_name), error=EXEC_ERROR_MARKER)
+    return f"exec({script!r})"
+
+
+def build_script_command(source: str, follow: bool = False, shorten_names: bool = False,
+                         filename: str = "<script>", cache: Optional[CompileCache] = None) -> CompiledSource:
+    """
+    Compile a script from this machine into one REPL line that runs it, see picox.compiler. Asserts are
+    kept, scripts such as on-device tests rely on them
+    args:
+        source (str): Python source of the script
+        follow (bool): Report how the script ended, as build_exec_command does
+        shorten_names (bool): Shorten local variable names
+        filename (str): Shown in syntax errors
+        cache (CompileCache): Reuse the result of compiling the same script before
+    returns:
+        CompiledSource : The line to send is its payload. Tracebacks on the device refer to its lines
+    raises:
+        SyntaxError: The script is not valid Python
+    """
+    handlers = SCRIPT_HANDLERS.format(error=EXEC_ERROR_MARKER) if follow else None
+    return compile_source(source, shorten_names=shorten_names, strip_asserts=False, handlers=handlers, filename=filename,
+                          cache=cache)
+
+
+class FileExecution:
+    """
+    Output of a file running on the device, yielded line by line as it arrives. Once iterated to the
+    end, result holds the traceback (if the file raised) and how long it ran
+
+        execution = pico.execute_file("test.py", follow=True)
+        for line in execution:
+            print(line)
+        if not execution.result.ok:
+            print(execution.result.traceback)
+    """
+    def __init__(self, file_name, lines: Iterable[str]):
+        """
+        args:
+            file_name (str): File being run
+            lines (Iterable[str]): Output lines of the command from build_exec_command
+        """
+        self.file_name = str(file_name)
+        self._lines = lines
+        self._start = time.perf_counter()
+        self.result: Optional[ExecutionResult] = None
+
+    def __iter__(self) -> Iterator[str]:
+        if self.result is not None:
+            return
+        traceback = None
+        for line in self._lines:
+            if traceback is not None:
+                traceback.append(line)
+            elif line == EXEC_ERROR_MARKER:
+                traceback = []
+            else:
+                yield line
+        self.result = ExecutionResult(self.file_name, "\n".join(traceback) if traceback is not None else None,
+                                      time.perf_counter() - self._start)
+
+    def wait(self) -> ExecutionResult:
+        """ Discard the remaining output and wait for the file to finish """
+        for _ in self:
+            pass
+        return self.result
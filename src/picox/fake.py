@@ -0,0 +1,765 @@
+import os
+import io
+import ast
+import sys
+import time
+import types
+import errno
+import socket
+import codeop
+import argparse
+import builtins
+import queue
+import tempfile
+import threading
+import posixpath
+import zlib
+from pathlib import Path
+from typing import Callable, Optional
+
+MICROPYTHON_BANNER = b'MicroPython v1.23.0 on 2024-06-02; Raspberry Pi Pico with RP2040\r\nType "help()" for more information.\r\n'
+SOFT_REBOOT_BANNER = b"MPY: soft reboot\r\n"
+FRIENDLY_PROMPT = b">>> "
+CONTINUATION_PROMPT = b"... "
+RAW_REPL_BANNER = b"raw REPL; CTRL-B to exit\r\n>"
+RAW_PASTE_START = b"\x05A\x01"
+MODE_DIRECTORY = 0x4000
+MODE_FILE = 0x8000
+# Start, 8 data and stop bit: a UART moves baudrate / 10 bytes per second
+BITS_PER_BYTE = 10
+
+
+class _DisplayExpressions(ast.NodeTransformer):
+    """Print the value of top level expression statements, as the interactive REPL does"""
+    def visit_Module(self, node):
+        node.body = [
+            ast.Expr(ast.Call(ast.Name("__display__", ast.Load()), [stmt.value], []))
+            if isinstance(stmt, ast.Expr) else stmt
+            for stmt in node.body
+        ]
+        return ast.fix_missing_locations(node)
+
+
+class _DeviceStream:
+    """sys.stdout of the fake device. Text is sent to the host with MicroPython's CRLF line endings"""
+    def __init__(self, device: "FakeMicroPython"):
+        self._device = device
+
+    def write(self, text) -> int:
+        data = text if isinstance(text, (bytes, bytearray)) else str(text).encode("utf-8")
+        self._device._emit(bytes(data).replace(b"\n", b"\r\n"))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _micropython_errors(function: Callable) -> Callable:
+    """Raise OSError the way MicroPython formats it, '[Errno 2] ENOENT', without host paths"""
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        except OSError as err:
+            if err.errno is None:
+                raise
+            raise OSError(err.errno, errno.errorcode.get(err.errno, str(err.errno))) from None
+    return wrapper
+
+
+class FakeMicroPython:
+    """
+    Software model of a Raspberry Pi Pico running MicroPython, for running picox without hardware.
+
+    Bytes written to the device are fed in with feed() and everything the device sends back is passed
+    to the output callback. The friendly REPL (echo, continuation lines, Ctrl-C/Ctrl-D), the raw REPL and
+    raw-paste flow control are modelled. Commands run with CPython in a worker thread, so output streams
+    while they run and input arriving meanwhile is queued like a UART buffer. The device filesystem is a
+    host directory, absolute device paths cannot reach outside it.
+    """
+    def __init__(self,
+                 root: Path,
+                 output: Callable[[bytes], None],
+                 mem_free: int = 180_000,
+                 paste_window: int = 128,
+                 has_deflate: bool = True,
+                 has_compressor: bool = True
+                 ):
+        """
+        args:
+            root (Path): Host directory used as the device filesystem
+            output (Callable[[bytes], None]): Receives bytes sent by the device
+            mem_free (int): Value reported by gc.mem_free()
+            paste_window (int): Raw-paste flow control window in bytes
+            has_deflate (bool): Provide the deflate module, as MicroPython 1.21 and later do
+            has_compressor (bool): The deflate module can compress. Firmware such as stock rp2 is built with
+                decompression only, writing to a DeflateIO raises OSError there
+        """
+        self.root = Path(root).resolve()
+        self.mem_free = mem_free
+        self.paste_window = paste_window
+        self.has_deflate = has_deflate
+        self.has_compressor = has_compressor
+        self._output = output
+        self._lock = threading.RLock()
+        self._pending = bytearray()  # Received while a command runs
+        self._job: Optional[threading.Thread] = None
+        self._interrupt_requested = False
+        self.raw_mode = False
+        self._line = bytearray()
+        self._block = []
+        self._raw_buffer = bytearray()
+        self._paste: Optional[bytearray] = None
+        self._paste_received = 0
+        self._escape = False
+        self._stdout = _DeviceStream(self)
+        self._modules = self._build_modules()
+        self._reset_session()
+
+    # ---- Host side ----
+
+    def feed(self, data: bytes):
+        """ Bytes written to the device by the host """
+        with self._lock:
+            if self._job is not None and b"\x03" in data:
+                self._interrupt_requested = True
+                data = data.replace(b"\x03", b"")
+            self._pending += data
+            self._drain()
+
+    def _emit(self, data: bytes):
+        self._output(data)
+
+    def _drain(self):
+        """ Handle queued input until a command starts running """
+        while self._pending and self._job is None:
+            byte = self._pending[0]
+            del self._pending[0]
+            if self.raw_mode:
+                self._raw_byte(byte)
+            else:
+                self._friendly_byte(byte)
+
+    # ---- Friendly REPL ----
+
+    def _friendly_byte(self, byte: int):
+        if self._escape:
+            # Skip terminal escape sequences such as arrow keys
+            self._escape = byte in b"[0123456789;"
+            return
+        if byte == 0x1b:
+            self._escape = True
+        elif byte == 0x03:
+            self._line.clear()
+            self._block.clear()
+            self._emit(b"\r\n" + FRIENDLY_PROMPT)
+        elif byte == 0x04:
+            if not self._line and not self._block:
+                self._soft_reboot()
+        elif byte == 0x01:
+            self.raw_mode = True
+            self._raw_buffer.clear()
+            self._emit(b"\r\n" + RAW_REPL_BANNER)
+        elif byte == 0x02:
+            self._emit(b"\r\n" + MICROPYTHON_BANNER + FRIENDLY_PROMPT)
+        elif byte in (0x08, 0x7f):
+            if self._line:
+                self._line.pop()
+                self._emit(b"\x08 \x08")
+        elif byte == 0x0d or (byte == 0x0a and self._line):
+            self._friendly_line(self._line.decode("utf-8", errors="replace"))
+            self._line.clear()
+        elif byte >= 0x20 or byte == 0x09:
+            self._line.append(byte)
+            self._emit(bytes([byte]))
+
+    def _friendly_line(self, line: str):
+        self._emit(b"\r\n")
+        self._block.append(line)
+        source = "\n".join(self._block)
+        if not (len(self._block) > 1 and not line.strip()):
+            try:
+                if codeop.compile_command(source, "<stdin>", "single") is None:
+                    self._emit(CONTINUATION_PROMPT)
+                    return
+            except (SyntaxError, ValueError, OverflowError):
+                pass # Reported when run
+        self._block.clear()
+        if not source.strip():
+            self._emit(FRIENDLY_PROMPT)
+            return
+        self._start_job(source, interactive=True, finish=self._finish_friendly)
+
+    def _finish_friendly(self, error: Optional[BaseException]):
+        if error is not None:
+            self._emit(self._format_traceback(error))
+        self._emit(FRIENDLY_PROMPT)
+
+    def _soft_reboot(self):
+        self._emit(b"\r\n" + SOFT_REBOOT_BANNER)
+        self._reset_session()
+        main_path = self.root / "main.py"
+        if main_path.is_file():
+            source = main_path.read_text(encoding="utf-8")
+            self._start_job(source, interactive=False, finish=self._finish_boot)
+        else:
+            self._finish_boot(None)
+
+    def _finish_boot(self, error: Optional[BaseException]):
+        if error is not None:
+            self._emit(self._format_traceback(error, "main.py"))
+        self._emit(MICROPYTHON_BANNER + FRIENDLY_PROMPT)
+
+    # ---- Raw REPL ----
+
+    def _raw_byte(self, byte: int):
+        if self._paste is not None:
+            if byte == 0x04:
+                source, self._paste = self._paste.decode("utf-8", errors="replace"), None
+                self._emit(b"\x04")
+                self._start_job(source, interactive=False, finish=self._finish_raw)
+                return
+            if byte == 0x03:
+                # Ends the paste and interrupts compiling it
+                self._paste = None
+                self._emit(b"\x04")
+                self._finish_raw(KeyboardInterrupt())
+                return
+            self._paste.append(byte)
+            self._paste_received += 1
+            if self._paste_received % self.paste_window == 0:
+                self._emit(b"\x01")
+            return
+
+        if byte == 0x01:
+            if self._raw_buffer.endswith(RAW_PASTE_START[:-1]):
+                # Ctrl-E A Ctrl-A requests raw-paste mode
+                self._raw_buffer.clear()
+                self._paste = bytearray()
+                self._paste_received = 0
+                self._emit(b"R\x01" + self.paste_window.to_bytes(2, "little"))
+                return
+            self._raw_buffer.clear()
+            self._emit(b"\r\n" + RAW_REPL_BANNER)
+        elif byte == 0x02:
+            self.raw_mode = False
+            self._raw_buffer.clear()
+            self._emit(b"\r\n" + MICROPYTHON_BANNER + FRIENDLY_PROMPT)
+        elif byte == 0x03:
+            self._raw_buffer.clear()
+        elif byte == 0x04:
+            if not self._raw_buffer:
+                self._emit(b"OK\r\n" + SOFT_REBOOT_BANNER + RAW_REPL_BANNER)
+                self._reset_session()
+                return
+            source = self._raw_buffer.decode("utf-8", errors="replace")
+            self._raw_buffer.clear()
+            self._emit(b"OK")
+            self._start_job(source, interactive=False, finish=self._finish_raw)
+        else:
+            self._raw_buffer.append(byte)
+
+    def _finish_raw(self, error: Optional[BaseException]):
+        stderr = self._format_traceback(error) if error is not None else b""
+        self._emit(b"\x04" + stderr + b"\x04>")
+
+    # ---- Execution ----
+
+    def _reset_session(self):
+        self._modules["sys"].modules.clear()
+        self.cwd = "/"
+        self._namespace = {"__name__": "__main__", "__builtins__": self._builtins}
+
+    def _start_job(self, source: str, interactive: bool, finish: Callable[[Optional[BaseException]], None]):
+        """ Run source in a worker thread. finish is called with the exception raised, if any """
+        def run():
+            error = None
+            sys.settrace(self._trace)
+            try:
+                tree = ast.parse(source, "<stdin>", "exec")
+                if interactive:
+                    tree = _DisplayExpressions().visit(tree)
+                exec(compile(tree, "<stdin>", "exec"), self._namespace)
+            except BaseException as err:
+                error = err
+            finally:
+                sys.settrace(None)
+            with self._lock:
+                self._interrupt_requested = False
+                self._job = None
+                finish(error)
+                self._drain()
+
+        self._interrupt_requested = False
+        self._job = threading.Thread(target=run, name="fake-micropython", daemon=True)
+        self._job.start()
+
+    def _trace(self, frame, event, arg):
+        """ Deliver Ctrl-C to the running command as KeyboardInterrupt """
+        if event == "call":
+            frame.f_trace_opcodes = True # Tight loops stay on one line, check between instructions
+        if self._interrupt_requested:
+            self._interrupt_requested = False
+            raise KeyboardInterrupt()
+        return self._trace
+
+    def _format_traceback(self, error: BaseException, file_name: str = "<stdin>") -> bytes:
+        message = f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+        return (
+            f'Traceback (most recent call last):\r\n  File "{file_name}", line 1, in <module>\r\n{message}\r\n'
+        ).encode("utf-8")
+
+    # ---- Device modules and filesystem ----
+
+    def host_path(self, path) -> str:
+        """ Host path for a device path. Device paths are confined to the root directory """
+        device_path = posixpath.normpath(posixpath.join(self.cwd, str(path)))
+        return os.path.join(self.root, device_path.lstrip("/"))
+
+    def _build_modules(self) -> dict:
+        device = self
+
+        @_micropython_errors
+        def open_file(file, mode="r", *args, **kwargs):
+            return builtins.open(device.host_path(file), mode, *args, **kwargs)
+
+        def display(value):
+            if value is not None:
+                device._stdout.write(repr(value) + "\n")
+
+        def print_(*args, sep=" ", end="\n", file=None):
+            (file or device._stdout).write(sep.join(map(str, args)) + end)
+
+        def import_(name, globals=None, locals=None, fromlist=(), level=0):
+            top_name = name.partition(".")[0]
+            if top_name in device._modules:
+                return device._modules[top_name]
+            loaded = device._modules["sys"].modules
+            if name in loaded:
+                return loaded[name]
+            for directory in ("", "lib"):
+                module_path = Path(device.host_path(posixpath.join("/", directory, name + ".py")))
+                if module_path.is_file():
+                    module = types.ModuleType(name)
+                    module.__dict__["__builtins__"] = device._builtins
+                    loaded[name] = module
+                    exec(compile(module_path.read_text(encoding="utf-8"), name + ".py", "exec"), module.__dict__)
+                    return module
+            return builtins.__import__(name, None, None, fromlist, level)
+
+        def run_source(run: Callable, mode: str) -> Callable:
+            # Strings are compiled first: an interrupt escaping exec() of a string would make CPython
+            # exit the host process with SIGINT. Nested namespaces keep the device builtins
+            def wrapper(source, globals=None, locals=None):
+                if globals is None:
+                    caller = sys._getframe(1)
+                    globals, locals = caller.f_globals, caller.f_locals if locals is None else locals
+                globals.setdefault("__builtins__", device._builtins)
+                if isinstance(source, (str, bytes)):
+                    source = compile(source, "<string>", mode)
+                return run(source, globals, locals)
+            return wrapper
+
+        self._builtins = dict(vars(builtins), open=open_file, print=print_, __import__=import_, __display__=display,
+                              exec=run_source(builtins.exec, "exec"), eval=run_source(builtins.eval, "eval"))
+
+        fake_os = types.ModuleType("os")
+        fake_os.sep = "/"
+
+        @_micropython_errors
+        def stat(path):
+            result = os.stat(device.host_path(path))
+            mode = MODE_DIRECTORY if os.path.isdir(device.host_path(path)) else MODE_FILE
+            mtime = int(result.st_mtime)
+            return (mode, 0, 0, 0, 0, 0, result.st_size, mtime, mtime, mtime)
+
+        @_micropython_errors
+        def ilistdir(path="."):
+            with os.scandir(device.host_path(path)) as entries:
+                listing = [(entry.name, MODE_DIRECTORY if entry.is_dir() else MODE_FILE, 0,
+                            0 if entry.is_dir() else entry.stat().st_size) for entry in entries]
+            return iter(sorted(listing))
+
+        @_micropython_errors
+        def chdir(path):
+            if not os.path.isdir(device.host_path(path)):
+                raise OSError(errno.ENOENT, "")
+            device.cwd = posixpath.normpath(posixpath.join(device.cwd, path))
+
+        fake_os.stat = stat
+        fake_os.ilistdir = ilistdir
+        fake_os.chdir = chdir
+        fake_os.getcwd = lambda: device.cwd
+        fake_os.listdir = _micropython_errors(lambda path=".": sorted(os.listdir(device.host_path(path))))
+        fake_os.mkdir = _micropython_errors(lambda path: os.mkdir(device.host_path(path)))
+        fake_os.rmdir = _micropython_errors(lambda path: os.rmdir(device.host_path(path)))
+        fake_os.remove = _micropython_errors(lambda path: os.remove(device.host_path(path)))
+        fake_os.rename = _micropython_errors(lambda old, new: os.rename(device.host_path(old), device.host_path(new)))
+        fake_os.statvfs = lambda path="/": (4096, 4096, 352, 300, 300, 0, 0, 0, 0, 255)
+        fake_os.uname = lambda: ("rp2", "rp2", "1.23.0", "v1.23.0", "Raspberry Pi Pico with RP2040")
+
+        fake_gc = types.ModuleType("gc")
+        fake_gc.collect = lambda: None
+        fake_gc.mem_free = lambda: device.mem_free
+        fake_gc.mem_alloc = lambda: 264_000 - device.mem_free
+
+        fake_time = types.ModuleType("time")
+        start = time.monotonic()
+
+        def sleep(seconds):
+            # Short steps so Ctrl-C interrupts a sleep promptly
+            deadline = time.monotonic() + seconds
+            while (remaining := deadline - time.monotonic()) > 0:
+                time.sleep(min(remaining, 0.01))
+
+        fake_time.sleep = sleep
+        fake_time.sleep_ms = lambda ms: sleep(ms / 1000)
+        fake_time.sleep_us = lambda us: sleep(us / 1_000_000)
+        fake_time.ticks_ms = lambda: int((time.monotonic() - start) * 1000) & 0x3fffffff
+        fake_time.ticks_us = lambda: int((time.monotonic() - start) * 1_000_000) & 0x3fffffff
+        fake_time.ticks_diff = lambda end, begin: ((end - begin + 0x20000000) & 0x3fffffff) - 0x20000000
+        fake_time.ticks_add = lambda ticks, delta: (ticks + delta) & 0x3fffffff
+        fake_time.time = lambda: int(time.time())
+        fake_time.time_ns = time.time_ns
+        fake_time.localtime = time.localtime
+
+        fake_sys = types.ModuleType("sys")
+        fake_sys.modules = {}
+        fake_sys.path = ["", "/lib"]
+        fake_sys.platform = "rp2"
+        fake_sys.version = "3.4.0; MicroPython v1.23.0 on 2024-06-02"
+        fake_sys.implementation = types.SimpleNamespace(name="micropython", version=(1, 23, 0, ""))
+        fake_sys.stdout = self._stdout
+        fake_sys.stderr = self._stdout
+        fake_sys.exit = sys.exit
+        fake_sys.print_exception = lambda error, file=None: (file or device._stdout).write(
+            device._format_traceback(error).decode("utf-8").replace("\r\n", "\n"))
+
+        modules = {"os": fake_os, "uos": fake_os, "gc": fake_gc, "time": fake_time, "utime": fake_time, "sys": fake_sys}
+        if self.has_deflate:
+            modules["deflate"] = _build_deflate_module(self.has_compressor)
+        return modules
+
+
+def _build_deflate_module(has_compressor: bool = True) -> types.ModuleType:
+    """ MicroPython's deflate module (1.21+) on top of zlib, optionally without compression """
+    fake_deflate = types.ModuleType("deflate")
+    fake_deflate.AUTO, fake_deflate.RAW, fake_deflate.ZLIB, fake_deflate.GZIP = range(4)
+
+    class DeflateIO:
+        def __init__(self, stream, format=fake_deflate.AUTO, wbits=0, close=False):
+            self._stream = stream
+            self._format = format
+            self._wbits = wbits or 8 # Smallest zlib window when not given
+            self._close_stream = close
+            self._compressor = None
+            self._inflated: Optional[io.BytesIO] = None
+
+        def _zlib_wbits(self, wbits: int) -> int:
+            return {fake_deflate.RAW: -wbits, fake_deflate.ZLIB: wbits, fake_deflate.GZIP: 16 + wbits}.get(self._format, 32 + wbits)
+
+        def read(self, size=-1) -> bytes:
+            if self._inflated is None:
+                decompressor = zlib.decompressobj(self._zlib_wbits(15))
+                self._inflated = io.BytesIO(decompressor.decompress(self._stream.read()) + decompressor.flush())
+            return self._inflated.read(size)
+
+        def write(self, data) -> int:
+            if not has_compressor:
+                raise OSError("stream operation not supported")
+            if self._compressor is None:
+                self._compressor = zlib.compressobj(9, zlib.DEFLATED, self._zlib_wbits(max(self._wbits, 9)))
+            self._stream.write(self._compressor.compress(bytes(data)))
+            return len(data)
+
+        def close(self):
+            if self._compressor is not None:
+                self._stream.write(self._compressor.flush())
+                self._compressor = None
+            if self._close_stream:
+                self._stream.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            self.close()
+
+    fake_deflate.DeflateIO = DeflateIO
+    return fake_deflate
+
+
+class LinkEmulation:
+    """
+    Speed and latency of a fake link, so timings measured against a fake device resemble real hardware.
+    Bytes leave at the link speed and arrive latency seconds later. Writes do not wait for each other's
+    latency, the link is a pipeline as a real one is
+    """
+    def __init__(self, bytes_per_second: Optional[float] = None, latency: float = 0.0):
+        """
+        args:
+            bytes_per_second (float): Link speed, None for no limit
+            latency (float): Seconds between bytes being sent and arriving, e.g. USB frames or a UART bridge
+        """
+        self.bytes_per_second = bytes_per_second
+        self.latency = latency
+
+    @classmethod
+    def from_baudrate(cls, baudrate: Optional[int], latency: float = 0.0) -> "LinkEmulation":
+        """ Link of a UART at baudrate, 8N1 """
+        return cls(baudrate / BITS_PER_BYTE if baudrate else None, latency)
+
+    def channel(self, deliver: Callable[[bytes], None]) -> "_LinkChannel":
+        """ One direction of the link, calling deliver with bytes when they arrive """
+        return _LinkChannel(self, deliver)
+
+
+class _LinkChannel:
+    """One direction of a LinkEmulation. Bytes are delivered in order by a thread of its own"""
+    def __init__(self, link: LinkEmulation, deliver: Callable[[bytes], None]):
+        self._link = link
+        self._deliver = deliver
+        self._free_at = 0.0 # When the bytes already sent have left
+        self._thread = None
+        if link.bytes_per_second or link.latency:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name="fake-link", daemon=True)
+            self._thread.start()
+
+    def send(self, data: bytes):
+        if self._thread is None:
+            self._deliver(data) # No emulation, deliver straight away
+            return
+        now = time.monotonic()
+        self._free_at = max(self._free_at, now)
+        if self._link.bytes_per_second:
+            self._free_at += len(data) / self._link.bytes_per_second
+        self._queue.put((self._free_at + self._link.latency, data))
+
+    def _run(self):
+        while (item := self._queue.get()) is not None:
+            arrive_at, data = item
+            if (wait := arrive_at - time.monotonic()) > 0:
+                time.sleep(wait)
+            try:
+                self._deliver(data)
+            except OSError:
+                return # Other end closed
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+
+
+class FakeSerial:
+    """
+    serial.Serial stand-in wired to a FakeMicroPython in the same process
+
+        pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(root, **kwargs))
+
+    bytes_per_second and latency emulate the link in both directions, see LinkEmulation. packet_size caps
+    in_waiting, as a USB CDC device delivers its output in packets
+    """
+    def __init__(self,
+                 root: Path,
+                 port: str = "FAKE",
+                 timeout: Optional[float] = None,
+                 write_timeout=None,
+                 bytes_per_second: Optional[float] = None,
+                 latency: float = 0.0,
+                 has_deflate: bool = True,
+                 has_compressor: bool = True,
+                 packet_size: Optional[int] = None,
+                 **kwargs
+                 ):
+        self.port = port
+        self.packet_size = packet_size
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = True
+        self._buffer = bytearray()
+        self._ready = threading.Condition()
+        link = LinkEmulation(bytes_per_second, latency)
+        self._to_host = link.channel(self._receive)
+        self.device = FakeMicroPython(root, self._to_host.send, has_deflate=has_deflate, has_compressor=has_compressor)
+        self._to_device = link.channel(self.device.feed)
+
+    def _receive(self, data: bytes):
+        with self._ready:
+            self._buffer += data
+            self._ready.notify_all()
+
+    def inject(self, data: bytes):
+        """ Bytes for the host to read as if the device had sent them, e.g. a canned response """
+        self._receive(data)
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._buffer) if self.packet_size is None else min(len(self._buffer), self.packet_size)
+
+    def read(self, size: int = 1) -> bytes:
+        """ Block until size bytes have arrived or the timeout passes, like serial.Serial """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._ready:
+            while len(self._buffer) < size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def write(self, data: bytes) -> int:
+        self._to_device.send(bytes(data))
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._ready:
+            self._buffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self._to_host.close()
+        self._to_device.close()
+
+
+class PtyDevice:
+    """
+    Serve a FakeMicroPython on a pseudo terminal, so it can be opened by path like a real serial port.
+    link slows both directions down like a real connection, see LinkEmulation. POSIX only
+    """
+    def __init__(self, root: Path, link: Optional[LinkEmulation] = None):
+        import pty
+        import tty
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        link = link or LinkEmulation()
+        self._to_host = link.channel(self._send)
+        self.device = FakeMicroPython(root, self._to_host.send)
+        self._to_device = link.channel(self.device.feed)
+        self._thread: Optional[threading.Thread] = None
+
+    def _send(self, data: bytes):
+        try:
+            os.write(self._master, data)
+        except OSError:
+            pass # Closed while the device was still printing
+
+    def serve_forever(self):
+        """ Feed bytes written to the pty into the device until closed """
+        while True:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return # Closed
+            if not data:
+                return
+            self._to_device.send(data)
+
+    def start(self) -> "PtyDevice":
+        """ Serve in a background thread """
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-pty", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._to_host.close()
+        self._to_device.close()
+        for fd in (self._slave, self._master):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self) -> "PtyDevice":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SocketDevice:
+    """
+    Serve a FakeMicroPython on one end of a socket pair. The other end is a file descriptor that behaves
+    like an open serial port, for AsyncPico or select based code
+
+        with SocketDevice(root) as device:
+            pico = await AsyncPico.open_fd(device.fileno(), "FAKE")
+    """
+    def __init__(self, root: Path, link: Optional[LinkEmulation] = None):
+        self.host_socket, self._device_socket = socket.socketpair()
+        link = link or LinkEmulation()
+        self._to_host = link.channel(self._send)
+        self.device = FakeMicroPython(root, self._to_host.send)
+        self._to_device = link.channel(self.device.feed)
+        self._thread: Optional[threading.Thread] = None
+
+    def _send(self, data: bytes):
+        try:
+            self._device_socket.sendall(data)
+        except OSError:
+            pass # Closed while the device was still printing
+
+    def fileno(self) -> int:
+        """ Host end of the connection """
+        return self.host_socket.fileno()
+
+    def serve_forever(self):
+        """ Feed bytes sent by the host into the device until closed """
+        while True:
+            try:
+                data = self._device_socket.recv(4096)
+            except OSError:
+                return # Closed
+            if not data:
+                return
+            self._to_device.send(data)
+
+    def start(self) -> "SocketDevice":
+        """ Serve in a background thread """
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-socket", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._to_host.close()
+        self._to_device.close()
+        self.host_socket.close()
+        self._device_socket.close()
+
+    def __enter__(self) -> "SocketDevice":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake MicroPython Pico on a pseudo terminal")
+    parser.add_argument("root", nargs="?", type=Path, default=None, help="Directory used as the device filesystem (default: a new temporary directory)")
+    parser.add_argument("--baud", type=int, default=None, help="Emulate a UART at this baud rate (default: no limit)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every transfer in each direction")
+    args = parser.parse_args()
+
+    root = args.root or Path(tempfile.mkdtemp(prefix="picox-fake-"))
+    device = PtyDevice(root, LinkEmulation.from_baudrate(args.baud, args.latency))
+    link = f", {args.baud} baud" if args.baud else ""
+    link += f", {args.latency * 1000:g} ms latency" if args.latency else ""
+    print(f"Fake Pico on {device.path} (filesystem: {root}{link})", flush=True)
+    try:
+        device.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.close()
+
+
+if __name__ == "__main__":
+    main()
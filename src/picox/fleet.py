@@ -0,0 +1,145 @@
+import io
+import time
+import concurrent.futures
+from pathlib import Path
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from .upy import Pico
+from .exceptions import RemotePicoException
+from .execution import FileExecution
+from .sync import DEFAULT_SYNC_IGNORE
+from .detect import get_all_pico_serial
+from .logconfig import LOGGER
+
+DEFAULT_FLEET_WORKERS = 8
+
+
+class DeviceResult(NamedTuple):
+    """Outcome of a fleet operation on one device"""
+    device: str
+    duration: float  # Seconds, including connecting
+    bytes: int       # Bytes transferred
+    value: Any       # Returned by the operation
+    error: Optional[str]
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class PicoFleet:
+    """
+    Run the same operation on many devices at once. Each device gets its own connection in a worker
+    thread, so a rack of boards takes about as long as the slowest one
+    """
+    def __init__(self,
+                 devices: Optional[List[str]] = None,
+                 max_workers: int = DEFAULT_FLEET_WORKERS,
+                 pico_factory: Callable[[str], Pico] = Pico
+                 ):
+        """
+        args:
+            devices (List[str]): Serial devices. Defaults to every Pico found by detect.get_all_pico_serial
+            max_workers (int): Most devices worked on at the same time
+            pico_factory (Callable): Connects to a device, e.g. functools.partial(Pico, use_agent=True)
+        """
+        self.devices = list(devices) if devices is not None else get_all_pico_serial()
+        self._max_workers = max_workers
+        self._pico_factory = pico_factory
+
+    def _run_one(self, device: str, operation: Callable[[Pico], Any], count_bytes: Callable[[Any], int]) -> DeviceResult:
+        """ Connect, run the operation and record the outcome. Errors are recorded, not raised """
+        start = time.perf_counter()
+        pico = None
+        try:
+            pico = self._pico_factory(device)
+            value = operation(pico)
+        except Exception as err:
+            LOGGER.debug(f"[{device}] :: {err!r}")
+            return DeviceResult(device, time.perf_counter() - start, 0, None, f"{type(err).__name__}: {err}")
+        finally:
+            if pico is not None:
+                try:
+                    pico.close()
+                except Exception:
+                    pass
+        return DeviceResult(device, time.perf_counter() - start, count_bytes(value), value, None)
+
+    def run(self, operation: Callable[[Pico], Any], count_bytes: Callable[[Any], int] = lambda value: 0) -> List[DeviceResult]:
+        """
+        Run an operation on every device concurrently
+        args:
+            operation (Callable): Called with a connected Pico, its return value is kept in the result
+            count_bytes (Callable): Bytes transferred, from the operation's return value
+        returns:
+            List[DeviceResult] : One per device, in device order
+        """
+        if not self.devices:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self._max_workers, len(self.devices))) as executor:
+            futures = [executor.submit(self._run_one, device, operation, count_bytes) for device in self.devices]
+            return [future.result() for future in futures]
+
+    def upload_file(self, local_path: Path, pico_file_path, overwrite: bool = False, chunk_size: Optional[int] = None,
+                    compress: Optional[bool] = None, resume: bool = False) -> List[DeviceResult]:
+        """ Upload the same file to every device. With resume, each device continues from what it already has """
+        data = Path(local_path).read_bytes() # Read once, each device gets its own stream
+        return self.run(
+            lambda pico: pico.upload_file(io.BytesIO(data), pico_file_path, overwrite=overwrite, chunk_size=chunk_size,
+                                          compress=compress, resume=resume),
+            count_bytes=lambda sent: sent,
+        )
+
+    def execute_file(self, file_name, follow: bool = False, idle_timeout: Optional[float] = None) -> List[DeviceResult]:
+        """
+        Start executing a file on every device. With follow, wait for it to finish on each device; the output
+        lines are each result's value and a file that raised is an error
+        """
+        if not follow:
+            return self.run(lambda pico: pico.execute_file(file_name))
+        return self.run(lambda pico: _run_to_end(pico.execute_file(file_name, follow=True, idle_timeout=idle_timeout)))
+
+    def run_script(self, local_path: Path, follow: bool = False, idle_timeout: Optional[float] = None,
+                   shorten_names: bool = False) -> List[DeviceResult]:
+        """ Run a script from this machine on every device without uploading it, see Pico.run_script """
+        if not follow:
+            return self.run(lambda pico: pico.run_script(local_path, shorten_names=shorten_names))
+        return self.run(lambda pico: _run_to_end(pico.run_script(local_path, follow=True, idle_timeout=idle_timeout,
+                                                                 shorten_names=shorten_names)))
+
+    def run_python_command(self, command: str, timeout: Optional[float] = None,
+                           idle_timeout: Optional[float] = None) -> List[DeviceResult]:
+        """ Run a command on every device, the output is each result's value. A device that times out is an error """
+        return self.run(lambda pico: pico.run_python_command(command, timeout=timeout, idle_timeout=idle_timeout))
+
+    def sync(self, local_dir: Path, remote_dir: str = "/", delete: bool = False, dry_run: bool = False,
+             ignore=DEFAULT_SYNC_IGNORE) -> List[DeviceResult]:
+        """ Sync a directory to every device, each result's value is its SyncPlan """
+        local_dir = Path(local_dir)
+        return self.run(
+            lambda pico: pico.sync(local_dir, remote_dir, delete=delete, dry_run=dry_run, ignore=ignore),
+            count_bytes=lambda plan: 0 if dry_run else sum((local_dir / path).stat().st_size for path in plan.upload),
+        )
+
+
+def _run_to_end(execution: FileExecution) -> List[str]:
+    """ Output lines of a followed execution. Raises if the code raised """
+    output = list(execution)
+    if not execution.result.ok:
+        raise RemotePicoException(f"{execution.file_name} raised {execution.result.error}", execution.result.traceback)
+    return output
+
+
+def format_results(results: List[DeviceResult]) -> str:
+    """ Results as a table, one row per device """
+    rows = [("DEVICE", "STATUS", "SECONDS", "BYTES", "ERROR")]
+    rows += [
+        (result.device, "ok" if result.ok else "failed", f"{result.duration:.2f}", str(result.bytes),
+         result.error.splitlines()[0] if result.error else "")
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(4)]
+    return "\n".join(
+        ("  ".join(cell.ljust(width) for cell, width in zip(row, widths)) + "  " + row[4]).rstrip()
+        for row in rows
+    )
@@ -0,0 +1,118 @@
+import posixpath
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class FileEntry(NamedTuple):
+    """A file or directory on the Pico"""
+    path: str
+    is_dir: bool
+    size: int
+
+
+def parse_walk_line(line: str) -> FileEntry:
+    """
+    Parse a line from the WALK_TREE command, '<D|F> <size> <path>'
+    raises:
+        ValueError - If the line is not a walk entry
+    """
+    try:
+        kind, size, path = line.split(" ", 2)
+        if kind not in ("D", "F"):
+            raise ValueError(kind)
+        return FileEntry(path, kind == "D", int(size))
+    except ValueError as err:
+        raise ValueError(f"Unexpected line in remote file tree :: {line}") from err
+
+
+def parse_stat_line(line: str, path: str) -> Optional[FileEntry]:
+    """
+    Parse the response of the STAT_PATH command, '<D|F> <size>' or '-' if the path does not exist
+    raises:
+        ValueError - If the response is not a stat result
+    """
+    if line == "-":
+        return None
+    return parse_walk_line(f"{line} {path}")
+
+
+def normalise_path(path: str) -> str:
+    """Absolute form of a device path, relative paths are from the root"""
+    return posixpath.normpath("/" + str(path).lstrip("/"))
+
+
+class MetadataCache:
+    """
+    Directory listing and stat results for one Pico session.
+    picox's own writes, mkdirs and deletes update it, anything that may run user code clears it.
+    """
+    def __init__(self):
+        self._listing: Optional[List[str]] = None
+        self._stats: Dict[str, Optional[FileEntry]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get_listing(self) -> Optional[List[str]]:
+        """Cached top level listing, or None if it needs fetching"""
+        self._count(self._listing is not None)
+        return list(self._listing) if self._listing is not None else None
+
+    def set_listing(self, listing: List[str]):
+        self._listing = list(listing)
+
+    def lookup_stat(self, path: str) -> Tuple[bool, Optional[FileEntry]]:
+        """
+        returns:
+            Tuple[bool, FileEntry] : Whether the path is cached, and its entry (None if it does not exist)
+        """
+        key = normalise_path(path)
+        cached = key in self._stats
+        self._count(cached)
+        return cached, self._stats.get(key)
+
+    def set_stat(self, path: str, entry: Optional[FileEntry]):
+        self._stats[normalise_path(path)] = entry
+
+    def _update_listing(self, path: str, exists: bool):
+        """Keep the top level listing in step with a change to a top level path"""
+        key = normalise_path(path)
+        if self._listing is None or posixpath.dirname(key) != "/":
+            return
+        name = posixpath.basename(key)
+        if exists and name not in self._listing:
+            self._listing.append(name)
+        elif not exists and name in self._listing:
+            self._listing.remove(name)
+
+    def record_write(self, path: str, size: int):
+        """A file was written"""
+        self.set_stat(path, FileEntry(str(path), False, size))
+        self._update_listing(path, exists=True)
+
+    def record_mkdir(self, path: str):
+        """A directory was created"""
+        self.set_stat(path, FileEntry(str(path), True, 0))
+        self._update_listing(path, exists=True)
+
+    def record_delete(self, path: str):
+        """A file or directory was deleted, along with anything cached beneath it"""
+        key = normalise_path(path)
+        for cached_path in [cached_path for cached_path in self._stats if cached_path.startswith(key + "/")]:
+            del self._stats[cached_path]
+        self._stats[key] = None
+        self._update_listing(path, exists=False)
+
+    def forget(self, path: str):
+        """The state of a path is unknown, e.g. after a failed write"""
+        self._stats.pop(normalise_path(path), None)
+        self._listing = None
+
+    def invalidate(self):
+        """Drop everything, the filesystem may have been changed outside picox"""
+        self._listing = None
+        self._stats.clear()
@@ -0,0 +1,187 @@
+import json
+import time
+import threading
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Any, Callable, List, NamedTuple, Optional
+
+# Characters of an operation's first argument (a path or a command) kept in its record
+DETAIL_LENGTH = 60
+
+
+class ProtocolStats(NamedTuple):
+    """Serial traffic of a session or an operation, and where its time went"""
+    write_seconds: float   # Writing to the serial port
+    device_seconds: float  # From the end of a write to the first byte of the reply: the link and the device working
+    read_seconds: float    # From the first byte of a reply to the last byte read
+    bytes_sent: int
+    bytes_received: int    # Including the echo of commands in the friendly REPL
+    echo_bytes: int        # Received bytes that were the device echoing a command back
+    round_trips: int       # Writes the device replied to
+    timeouts: int          # Reads that ran out of time
+
+    def since(self, earlier: "ProtocolStats") -> "ProtocolStats":
+        """ Traffic between an earlier snapshot and this one """
+        return ProtocolStats(*(now - then for now, then in zip(self, earlier)))
+
+
+class ProtocolCounters:
+    """
+    Running totals of a session's serial traffic, fed by every read and write. A reply starts with the
+    first byte read after a write and lasts until the next write, so waiting for the device and reading
+    its output are told apart
+    """
+    def __init__(self):
+        self._write_seconds = 0.0
+        self._device_seconds = 0.0
+        self._read_seconds = 0.0
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        self._echo_bytes = 0
+        self._round_trips = 0
+        self._timeouts = 0
+        self._awaiting_since: Optional[float] = None  # End of the last write, until its reply starts
+        self._reply_since: Optional[float] = None     # Start of the reply being read, or of its unsettled part
+        self._last_read = 0.0
+
+    def _settle_reply(self):
+        """ Count the reply read so far as read time """
+        if self._reply_since is not None:
+            self._read_seconds += self._last_read - self._reply_since
+            self._reply_since = self._last_read
+
+    def wrote(self, size: int, started: float, ended: float, echoed: bool = False):
+        """
+        args:
+            size (int): Bytes written
+            started, ended (float): time.perf_counter() around the write
+            echoed (bool): The device echoes these bytes back (a command typed into the friendly REPL)
+        """
+        self._settle_reply()
+        self._reply_since = None
+        self._write_seconds += ended - started
+        self._bytes_sent += size
+        if echoed:
+            self._echo_bytes += size
+        self._awaiting_since = ended
+
+    def received(self, size: int, requested: int, ended: float):
+        """
+        args:
+            size (int): Bytes read
+            requested (int): Bytes the read waited for, it timed out if fewer arrived. 0 for reads that may come back empty
+            ended (float): time.perf_counter() after the read
+        """
+        if size < requested:
+            self._timeouts += 1
+        if not size:
+            return
+        self._bytes_received += size
+        if self._awaiting_since is not None:
+            self._device_seconds += ended - self._awaiting_since
+            self._round_trips += 1
+            self._awaiting_since = None
+            self._reply_since = ended
+        self._last_read = ended
+
+    def snapshot(self) -> ProtocolStats:
+        """ Totals so far """
+        self._settle_reply()
+        return ProtocolStats(self._write_seconds, self._device_seconds, self._read_seconds, self._bytes_sent,
+                             self._bytes_received, self._echo_bytes, self._round_trips, self._timeouts)
+
+
+class OperationRecord(NamedTuple):
+    """One call of a Pico operation, see Profiler"""
+    name: str              # Method, e.g. "upload_file", or "communicate" for each command sent
+    device: str
+    detail: Optional[str]  # Start of the first argument, e.g. the path or the command
+    start: float           # Seconds since the profiler was created
+    duration: float
+    depth: int             # 0 for operations called directly, 1 for the operations they call, ...
+    stats: ProtocolStats   # Traffic of the operation, including the operations it called
+    error: Optional[str]   # Exception the operation raised
+
+    @property
+    def host_seconds(self) -> float:
+        """ Time not spent on the serial port: picox itself, reading local files, compressing """
+        return max(self.duration - self.stats.write_seconds - self.stats.device_seconds - self.stats.read_seconds, 0.0)
+
+    def to_dict(self) -> dict:
+        record = self._asdict()
+        record.update(record.pop("stats")._asdict(), host_seconds=self.host_seconds)
+        return record
+
+
+class Profiler:
+    """
+    Record every operation of the Pico sessions it is given to, as a timeline with the serial traffic of each
+
+        profiler = Profiler()
+        pico = Pico(serial_device, profiler=profiler)
+        ...
+        profiler.write_json(Path("profile.json"))
+
+    Operations can also be passed to a callback as they finish, or traced as OpenTelemetry spans (any tracer
+    with start_as_current_span). Sessions without a profiler skip all of this
+    """
+    def __init__(self,
+                 on_operation: Optional[Callable[[OperationRecord], None]] = None,
+                 tracer: Any = None,
+                 keep_records: bool = True
+                 ):
+        """
+        args:
+            on_operation (Callable): Called with each OperationRecord as the operation finishes
+            tracer: Opens a span for each operation, e.g. opentelemetry.trace.get_tracer("picox").
+                Spans get the operation's traffic as picox.* attributes
+            keep_records (bool): Keep the records in records, turn off for long running sessions with a callback
+        """
+        self.records: List[OperationRecord] = []
+        self._on_operation = on_operation
+        self._tracer = tracer
+        self._keep_records = keep_records
+        self._started = time.perf_counter()
+        self._local = threading.local() # Depth of the operation in progress, per thread (PicoFleet)
+
+    @contextmanager
+    def operation(self, name: str, device: str, counters: ProtocolCounters, detail: Optional[str] = None):
+        """ Record what happens inside as one operation """
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        if detail is not None and len(detail) > DETAIL_LENGTH:
+            detail = detail[:DETAIL_LENGTH] + "..."
+        with ExitStack() as stack:
+            span = stack.enter_context(self._tracer.start_as_current_span(f"picox.{name}")) if self._tracer else None
+            before = counters.snapshot()
+            started = time.perf_counter()
+            error = None
+            try:
+                yield
+            except GeneratorExit:
+                raise # Output of a streaming operation was not read to the end
+            except BaseException as err:
+                error = f"{type(err).__name__}: {err}".splitlines()[0]
+                raise
+            finally:
+                self._local.depth = depth
+                record = OperationRecord(name, device, detail, started - self._started, time.perf_counter() - started,
+                                         depth, counters.snapshot().since(before), error)
+                if self._keep_records:
+                    self.records.append(record)
+                if span is not None:
+                    for key, value in record.to_dict().items():
+                        if value is not None and key != "name":
+                            span.set_attribute(f"picox.{key}", value)
+                if self._on_operation:
+                    self._on_operation(record)
+
+    def write_json(self, path: Path, **metadata):
+        """
+        Write the timeline, operations in the order they started
+        args:
+            metadata: Added to the top level, e.g. the command line
+        """
+        operations = sorted(self.records, key=lambda record: record.start)
+        Path(path).write_text(json.dumps({**metadata, "operations": [record.to_dict() for record in operations]},
+                                         indent=2) + "\n")
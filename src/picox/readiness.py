@@ -0,0 +1,71 @@
+from enum import Enum
+from typing import NamedTuple, Set
+
+SOFT_REBOOT_BANNER = b"MPY: soft reboot"
+FRIENDLY_PROMPT = b">>> "
+RAW_REPL_PROMPT = b"raw REPL; CTRL-B to exit\r\n>"
+
+# Seconds to wait for each step of getting a device ready
+PROMPT_TIMEOUT = 0.5        # Prompt after a Ctrl+C
+REBOOT_BANNER_TIMEOUT = 2.0 # Soft reboot banner after Ctrl+D
+BOOT_PROMPT_TIMEOUT = 0.1   # Prompt after the banner. Longer means main.py is running and is interrupted
+INTERRUPT_ATTEMPTS = 5      # Ctrl+C sent before giving up, programs may catch KeyboardInterrupt
+
+
+class DeviceEvent(Enum):
+    """Output that shows what state the device is in"""
+    PROMPT = "prompt"            # Waiting at the friendly REPL prompt, nothing received after it
+    RAW_PROMPT = "raw_prompt"    # Waiting at the raw REPL prompt
+    SOFT_REBOOT = "soft_reboot"  # Soft reboot started, boot.py and main.py run next
+
+
+class ConnectMetrics(NamedTuple):
+    """Time taken by each step of connecting to a device, in seconds"""
+    open_seconds: float       # Opening the serial port
+    ready_seconds: float      # Interrupting (and rebooting) until the REPL prompt
+    coms_test_seconds: float  # Round trip of the coms test
+    total_seconds: float
+    rebooted: bool
+    interrupts: int           # Ctrl+C sent to reach the prompt
+
+
+class ReadinessScanner:
+    """
+    Follow device output while it is interrupted or rebooted. Events are recognised from what the
+    device sends rather than waiting a fixed time
+    """
+    def __init__(self):
+        self._tail = b''
+        # Enough to finish a banner split across reads, and to hold a whole prompt for the events check
+        self._overlap = max(len(SOFT_REBOOT_BANNER) - 1, len(RAW_REPL_PROMPT), len(FRIENDLY_PROMPT))
+        self._seen: Set[DeviceEvent] = set()
+        self.bytes_received = 0
+
+    def feed(self, data: bytes) -> Set[DeviceEvent]:
+        """
+        Add received bytes
+        returns:
+            Set[DeviceEvent] : Events seen since the last clear(). Prompts only count while they are
+                the last thing received
+        """
+        window = self._tail + data
+        self.bytes_received += len(data)
+        # Only look for the banner where it ends in the new data, so it is not found twice
+        if window.find(SOFT_REBOOT_BANNER, max(len(self._tail) - len(SOFT_REBOOT_BANNER) + 1, 0)) != -1:
+            self._seen.add(DeviceEvent.SOFT_REBOOT)
+        self._tail = window[-self._overlap:]
+        return self.events
+
+    @property
+    def events(self) -> Set[DeviceEvent]:
+        events = set(self._seen)
+        if self._tail.endswith(FRIENDLY_PROMPT):
+            events.add(DeviceEvent.PROMPT)
+        if self._tail.endswith(RAW_REPL_PROMPT):
+            events.add(DeviceEvent.RAW_PROMPT)
+        return events
+
+    def clear(self):
+        """ Forget events seen so far, before sending something that causes a new one """
+        self._seen.clear()
+        self._tail = b''
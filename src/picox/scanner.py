@@ -0,0 +1,248 @@
+from typing import List, Optional
+
+
+class MarkerScanner:
+    """
+    Incremental scanner for end markers in a stream of bytes read from a Pico.
+
+    Bytes are fed in chunks of any size and appended to a preallocated buffer. Only the
+    newly received tail (plus enough overlap to catch a marker split across chunks) is
+    searched on each feed, so total scan cost is linear in the size of the response.
+    """
+    def __init__(self,
+                 end_markers: List[bytes],
+                 failed_marker: Optional[bytes] = None,
+                 max_failed_markers: int = 2,
+                 traceback_marker: Optional[bytes] = None,
+                 prompt_marker: Optional[bytes] = None,
+                 capacity: int = 4096
+                 ):
+        """
+        args:
+            end_markers (List[bytes]): Any of these markers completes the response
+            failed_marker (bytes): Marker that signals a remote exception
+            max_failed_markers (int): Occurrences of the failed marker that complete the response.
+                The failed marker is echoed once with the command and printed again if it failed
+            traceback_marker (bytes): Start of a traceback. A prompt_marker after it completes the response too,
+                the command raised before it could print an end marker
+            prompt_marker (bytes): Prompt shown by the device once it is ready for the next command
+            capacity (int): Initial size of the receive buffer
+        """
+        self._end_markers = [marker for marker in end_markers if marker]
+        self._failed_marker = failed_marker
+        self._max_failed_markers = max_failed_markers
+        self._failed_markers_seen = 0
+        self._failed_search_from = 0
+        self._traceback_marker = traceback_marker if prompt_marker else None
+        self._prompt_marker = prompt_marker
+        self._traceback_at = None  # Index of the first traceback
+
+        # Longest marker decides how far back into old data a split marker can start
+        all_markers = self._end_markers + [marker for marker in (failed_marker, traceback_marker, prompt_marker) if marker]
+        self._overlap = max((len(marker) for marker in all_markers), default=1) - 1
+
+        self._buffer = bytearray(capacity)
+        self._length = 0
+        self._end = None  # Index just past the completing marker
+        self.matched_marker: Optional[bytes] = None
+        self.raised = False  # Completed on the prompt after a traceback
+
+    @property
+    def done(self) -> bool:
+        """True once an end marker or the final failed marker has been seen"""
+        return self._end is not None
+
+    @property
+    def failed(self) -> bool:
+        """True if the response completed on the failed marker"""
+        return self.done and self.matched_marker == self._failed_marker
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _append(self, data: bytes):
+        """Copy data into the buffer, doubling its capacity when needed"""
+        new_length = self._length + len(data)
+        if new_length > len(self._buffer):
+            capacity = len(self._buffer) or 1
+            while capacity < new_length:
+                capacity *= 2
+            self._buffer.extend(bytes(capacity - len(self._buffer)))
+        self._buffer[self._length:new_length] = data
+        self._length = new_length
+
+    def feed(self, data: bytes) -> bool:
+        """
+        Add received bytes and scan them for markers.
+        args:
+            data (bytes): Newly received bytes
+        returns:
+            bool : True if the response is complete
+        """
+        if self.done or not data:
+            return self.done
+
+        scan_from = max(self._length - self._overlap, 0)
+        self._append(data)
+        view = self._buffer
+
+        # Earliest completing marker in the new tail wins
+        best_end = None
+        for marker in self._end_markers:
+            index = view.find(marker, scan_from, self._length)
+            if index != -1 and (best_end is None or index + len(marker) < best_end):
+                best_end = index + len(marker)
+                self.matched_marker = marker
+
+        if self._traceback_marker:
+            if self._traceback_at is None and (index := view.find(self._traceback_marker, scan_from, self._length)) != -1:
+                self._traceback_at = index
+            if self._traceback_at is not None:
+                index = view.find(self._prompt_marker, max(scan_from, self._traceback_at), self._length)
+                if index != -1 and (best_end is None or index + len(self._prompt_marker) < best_end):
+                    best_end = index + len(self._prompt_marker)
+                    self.matched_marker = self._prompt_marker
+                    self.raised = True
+
+        if self._failed_marker:
+            search_from = max(scan_from, self._failed_search_from)
+            while (index := view.find(self._failed_marker, search_from, self._length)) != -1:
+                marker_end = index + len(self._failed_marker)
+                if best_end is not None and marker_end > best_end:
+                    break
+                self._failed_markers_seen += 1
+                search_from = marker_end
+                if self._failed_markers_seen >= self._max_failed_markers:
+                    best_end = marker_end
+                    self.matched_marker = self._failed_marker
+                    self.raised = False
+                    break
+            self._failed_search_from = search_from
+
+        if best_end is not None:
+            self._end = best_end
+        return self.done
+
+    def getvalue(self) -> bytes:
+        """Bytes received up to and including the completing marker (or all bytes if incomplete)"""
+        end = self._end if self._end is not None else self._length
+        return bytes(self._buffer[:end])
+
+    def remainder(self) -> bytes:
+        """Bytes received after the completing marker, these belong to whatever comes next"""
+        if self._end is None:
+            return b''
+        return bytes(self._buffer[self._end:self._length])
+
+
+class LineSplitter:
+    """
+    Split a stream of bytes into lines as it arrives, holding only the unfinished line.
+    Line endings (LF, CRLF and the CR CR LF seen on Windows) are removed.
+    """
+    def __init__(self):
+        self._partial = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Add received bytes
+        returns:
+            List[bytes] : Lines completed by this data
+        """
+        self._partial += data
+        if b"\n" not in data:
+            return []
+        *lines, rest = self._partial.split(b"\n")
+        self._partial = bytearray(rest)
+        return [bytes(line.rstrip(b"\r")) for line in lines]
+
+    @property
+    def partial(self) -> bytes:
+        """Bytes received since the last complete line"""
+        return bytes(self._partial)
+
+
+class ResponseLineParser:
+    """
+    Parse a friendly REPL response line by line as it arrives. Lines up to the end of the command echo
+    are skipped, output lines are returned, and the response ends at the end of response line. Bytes
+    received after that belong to the next response.
+
+    A traceback followed by the prompt also ends the response, as a failure: the command raised before it
+    printed the end of response line. Traceback lines are held back until it is clear whether the command
+    raised or printed them and carried on.
+    """
+    def __init__(self, echo_end: str, end_line: str, failed_marker: str,
+                 traceback_start: Optional[str] = None, prompt: Optional[str] = None):
+        """
+        args:
+            echo_end (str): The echoed command line ends with this
+            end_line (str): Line printed after the command's output
+            failed_marker (str): A line ending with this ends the response as a failure
+            traceback_start (str): First line of a traceback
+            prompt (str): The device is ready for the next command once a line starts with this
+        """
+        self._splitter = LineSplitter()
+        self._echo_end = echo_end
+        self._end_line = end_line
+        self._failed_marker = failed_marker
+        self._traceback_start = traceback_start if prompt else None
+        self._prompt = prompt
+        self._echo_done = False
+        self._traceback: Optional[List[str]] = None  # Held lines of a traceback
+        self._traceback_ended = False                # Its exception line has arrived
+        self.done = False
+        self.failed_line: Optional[str] = None
+        self.remainder = b''
+
+    @property
+    def pending(self) -> str:
+        """ Output received but not returned yet: held traceback lines and the start of the next line """
+        return "\r\n".join((self._traceback or []) + [self._splitter.partial.decode("utf-8", errors="replace")])
+
+    def _raised(self, rest: List[bytes]):
+        """ The prompt came back after a traceback, rest is what came with and after it """
+        self.done = True
+        self.failed_line = "\r\n".join(self._traceback)
+        self.remainder = b"\r\n".join(rest + [self._splitter.partial])
+
+    def feed(self, data: bytes) -> List[str]:
+        """
+        Add received bytes
+        returns:
+            List[str] : Output lines completed by this data
+        """
+        output = []
+        lines = self._splitter.feed(data)
+        for index, raw_line in enumerate(lines):
+            line = raw_line.decode("utf-8", errors="replace")
+            if not self._echo_done:
+                self._echo_done = line.endswith(self._echo_end)
+                continue
+            ends_response = line.endswith(self._end_line) or line.endswith(self._failed_marker)
+            if self._traceback is not None:
+                if line.startswith(self._prompt):
+                    self._raised(lines[index:])
+                    break
+                if not self._traceback_ended and not ends_response:
+                    self._traceback.append(line)
+                    self._traceback_ended = not line.startswith(" ") # File lines are indented
+                    continue
+                output += self._traceback # Printed by the command, which carried on
+                self._traceback = None
+            if ends_response:
+                self.done = True
+                if not line.endswith(self._end_line):
+                    self.failed_line = line
+                elif line != self._end_line:
+                    output.append(line[:-len(self._end_line)]) # Output did not end with a newline
+                self.remainder = b"\r\n".join(lines[index + 1:] + [self._splitter.partial])
+                break
+            if self._traceback_start and line.startswith(self._traceback_start):
+                self._traceback, self._traceback_ended = [line], False
+                continue
+            output.append(line)
+        if not self.done and self._traceback is not None and \
+                self._splitter.partial.decode("utf-8", errors="replace").startswith(self._prompt):
+            self._raised([])
+        return output
@@ -0,0 +1,105 @@
+import os
+import hashlib
+import fnmatch
+import posixpath
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+DEFAULT_SYNC_IGNORE = ("__pycache__", "*.pyc")
+
+
+class SyncPlan(NamedTuple):
+    """Changes needed to make a remote directory match a local one. Paths are relative to the directories"""
+    upload: List[str]
+    delete: List[str]
+    create_directories: List[str]
+    unchanged: List[str]
+
+
+def _is_ignored(relative_path: str, ignore: Iterable[str]) -> bool:
+    """True if any part of the path matches an ignore pattern"""
+    return any(fnmatch.fnmatch(part, pattern) for part in relative_path.split("/") for pattern in ignore)
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 hex digest of a local file, read in blocks"""
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        while block := fp.read(65536):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_local_tree(local_dir: Path, ignore: Iterable[str] = DEFAULT_SYNC_IGNORE) -> Tuple[Dict[str, str], Set[str]]:
+    """
+    Hash every file under a local directory
+    args:
+        local_dir (Path): Directory to hash
+        ignore (Iterable[str]): fnmatch patterns for file and directory names to skip
+    returns:
+        Tuple[Dict[str, str], Set[str]] : SHA-256 by relative file path, and relative directory paths
+    """
+    files = {}
+    directories = set()
+    for dir_path, dir_names, file_names in os.walk(local_dir):
+        relative_dir = Path(dir_path).relative_to(local_dir).as_posix()
+        relative_dir = "" if relative_dir == "." else relative_dir
+        # Prune ignored directories so they are not walked
+        dir_names[:] = [name for name in dir_names if not _is_ignored(name, ignore)]
+        for name in dir_names:
+            directories.add(posixpath.join(relative_dir, name))
+        for name in file_names:
+            if not _is_ignored(name, ignore):
+                files[posixpath.join(relative_dir, name)] = hash_file(Path(dir_path) / name)
+    return files, directories
+
+
+def parse_hash_tree_line(line: str, remote_dir: str) -> Tuple[str, str, str]:
+    """
+    Parse a line from the HASH_TREE command, 'D <path>' or 'F <sha256> <path>'
+    returns:
+        Tuple[str, str, str] : Kind ('D' or 'F'), hash ('' for directories) and path relative to remote_dir.
+            remote_dir itself is reported as directory ''
+    raises:
+        ValueError - If the line is not a hash tree entry
+    """
+    prefix = remote_dir.rstrip("/") + "/"
+    if line.startswith("D "):
+        kind, digest, path = "D", "", line[2:]
+    elif line.startswith("F "):
+        kind, digest, path = line.split(" ", 2)
+    else:
+        raise ValueError(f"Unexpected line in remote hash tree :: {line}")
+    if not path.startswith(prefix):
+        raise ValueError(f"Remote path '{path}' is outside '{remote_dir}'")
+    return kind, digest, path[len(prefix):]
+
+
+def plan_sync(local_files: Dict[str, str],
+              local_directories: Set[str],
+              remote_files: Dict[str, str],
+              remote_directories: Set[str],
+              delete: bool = False
+              ) -> SyncPlan:
+    """
+    Compare local and remote trees by hash
+    args:
+        delete (bool): Plan to delete remote files that do not exist locally
+    returns:
+        SyncPlan
+    """
+    upload = sorted(path for path, digest in local_files.items() if remote_files.get(path) != digest)
+    unchanged = sorted(path for path, digest in local_files.items() if remote_files.get(path) == digest)
+
+    # Parents of every local file and directory must exist before uploading. "" is the synced directory itself
+    needed_directories = set(local_directories) | {""}
+    for path in local_files:
+        parent = posixpath.dirname(path)
+        while parent:
+            needed_directories.add(parent)
+            parent = posixpath.dirname(parent)
+    # Sorted so parents are created before children
+    create_directories = sorted(needed_directories - remote_directories, key=lambda path: (path.count("/"), path))
+
+    to_delete = sorted(set(remote_files) - set(local_files)) if delete else []
+    return SyncPlan(upload, to_delete, create_directories, unchanged)
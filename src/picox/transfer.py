@@ -0,0 +1,581 @@
+import re
+import zlib
+import codecs
+import base64
+import hashlib
+import binascii
+from io import IncrementalNewlineDecoder
+from pathlib import PurePosixPath
+from typing import Callable, Dict, IO, NamedTuple, Optional, Tuple
+
+from .exceptions import RemotePicoException, ResponseTimeout, TransferError
+from .logconfig import LOGGER
+
+# Called with (bytes transferred so far, total bytes or None if unknown)
+ProgressCallback = Callable[[int, Optional[int]], None]
+
+MIN_CHUNK_SIZE = 192
+MAX_CHUNK_SIZE = 24_576
+INITIAL_CHUNK_SIZE = 1_536
+
+# Bytes read per block when downloading. 4 KB of base64 per line
+DOWNLOAD_BLOCK_SIZE = 3_072
+
+# Bytes of device heap needed per byte of chunk. The REPL holds the base64 line (4/3x),
+# the exec string and the decoded bytes at the same time, leave plenty of headroom
+HEAP_BYTES_PER_CHUNK_BYTE = 8
+
+
+# Text and source files compress well. Other types are usually compressed already (images, archives, .mpy)
+COMPRESSIBLE_SUFFIXES = frozenset({
+    ".py", ".txt", ".log", ".csv", ".tsv", ".json", ".html", ".htm", ".css", ".js",
+    ".md", ".xml", ".svg", ".cfg", ".ini", ".toml", ".yaml", ".yml",
+})
+
+# Files smaller than this are sent as they are, the saving does not cover importing deflate on the device
+COMPRESS_MIN_SIZE = 1_024
+
+# zlib window of compressed chunks is 2 ** DEFLATE_WBITS bytes. The device allocates the window to
+# decompress, a small one keeps that cheap. Matches the window the device compresses downloads with
+DEFLATE_WBITS = 10
+
+# Marks a download block frame whose data is zlib compressed: '<offset> <length> <crc32> z <base64>'
+COMPRESSED_FRAME_PREFIX = "z "
+
+# Times a chunk or block that was rejected, garbled or lost is sent again before the transfer fails
+TRANSFER_RETRIES = 3
+
+# Filesystem errors printed by the device (full flash, missing directory). Sending the data again cannot fix these
+DEVICE_FILE_ERROR = re.compile(r"\[Errno \d+\]|\bE(?:NOENT|EXIST|NOSPC|ISDIR|NOTDIR|ACCES|ROFS)\b")
+
+
+class BlockFrame(NamedTuple):
+    """A block of a download, checked against its CRC32"""
+    offset: int         # Position of the block in the file
+    data: bytes
+    compressed: bool    # Sent deflated
+
+
+class TransferStats(NamedTuple):
+    """Outcome of the last upload or download"""
+    bytes: int          # File bytes transferred
+    wire_bytes: int     # Encoded bytes sent over serial for the file data
+    seconds: float
+    compressed: bool    # At least one chunk was compressed
+
+    @property
+    def throughput(self) -> float:
+        """ Effective file bytes per second """
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+
+def _align(size: int) -> int:
+    """Round down to a multiple of 3 so base64 chunks never need padding"""
+    return max(size - size % 3, 3)
+
+
+def stream_size(fp: IO) -> Optional[int]:
+    """
+    Get the remaining size of a file object without reading it
+    returns:
+        int : Bytes left to read or None if the stream is not seekable
+    """
+    try:
+        if not fp.seekable():
+            return None
+        position = fp.tell()
+        end = fp.seek(0, 2)
+        fp.seek(position)
+    except (AttributeError, OSError):
+        return None
+    return end - position
+
+
+class ChunkSizer:
+    """
+    Choose transfer chunk sizes from free device memory and measured throughput.
+
+    The chunk size starts small and doubles while each larger chunk gives better throughput
+    than the last, never exceeding a ceiling derived from free heap on the device. A failed
+    chunk halves the ceiling. A fixed size disables adaptation.
+    """
+    def __init__(self, mem_free: Optional[int] = None, fixed_size: Optional[int] = None):
+        """
+        args:
+            mem_free (int): Free heap on the device in bytes, from gc.mem_free()
+            fixed_size (int): Always use this chunk size
+        """
+        self._fixed = fixed_size is not None
+        if self._fixed:
+            if fixed_size <= 0:
+                raise ValueError(f"Chunk size must be positive, got {fixed_size}")
+            self._ceiling = fixed_size
+            self.size = fixed_size
+            return
+
+        ceiling = MAX_CHUNK_SIZE
+        if mem_free is not None:
+            ceiling = min(ceiling, mem_free // HEAP_BYTES_PER_CHUNK_BYTE)
+        self._ceiling = _align(max(ceiling, MIN_CHUNK_SIZE))
+        self.size = min(INITIAL_CHUNK_SIZE, self._ceiling)
+        self._last_throughput = 0.0
+        self._growing = True
+
+    def record(self, num_bytes: int, elapsed: float):
+        """
+        Feed back how long a chunk took to transfer
+        args:
+            num_bytes (int): Bytes in the chunk
+            elapsed (float): Round-trip seconds for the chunk
+        """
+        if self._fixed or not self._growing or num_bytes < self.size:
+            return
+        throughput = num_bytes / elapsed if elapsed > 0 else float("inf")
+        if throughput <= self._last_throughput * 1.05:
+            self._growing = False # Bigger chunks stopped paying off
+            return
+        self._last_throughput = throughput
+        self.size = min(_align(self.size * 2), self._ceiling)
+
+    def shrink(self) -> bool:
+        """
+        Halve the chunk size after a failed chunk
+        returns:
+            bool : False if already at the minimum size and retrying is pointless
+        """
+        if self._fixed or self.size <= MIN_CHUNK_SIZE:
+            return False
+        self._ceiling = _align(max(self.size // 2, MIN_CHUNK_SIZE))
+        self.size = self._ceiling
+        self._growing = False
+        return True
+
+
+def should_compress(path, size: Optional[int]) -> bool:
+    """
+    Decide whether a transfer is worth compressing
+    args:
+        path (str): File path, its suffix gives the file type
+        size (int): File size in bytes or None if unknown
+    """
+    if PurePosixPath(str(path)).suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+        return False
+    return size is None or size >= COMPRESS_MIN_SIZE
+
+
+def compress_chunk(chunk: bytes) -> Optional[bytes]:
+    """
+    Compress an upload chunk as a zlib stream the device can decompress with deflate.DeflateIO
+    returns:
+        bytes : Compressed chunk or None if compressing does not make it smaller
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, DEFLATE_WBITS)
+    compressed = compressor.compress(chunk) + compressor.flush()
+    return compressed if len(compressed) < len(chunk) else None
+
+
+def parse_size_header(header: Optional[str]) -> int:
+    """
+    Parse the file size the device sends before the blocks of a download
+    raises:
+        IOError - If the header is missing or not a number
+    """
+    try:
+        return int(header)
+    except (TypeError, ValueError) as err:
+        raise IOError(f"Expected file size from device, got {header!r}") from err
+
+
+def frame_crc(data: bytes, *header) -> int:
+    """
+    CRC32 of a transfer frame: its data, seeded with the CRC32 of its header fields joined by spaces.
+    A corrupted path or offset is caught the same way as corrupted data, instead of writing good data in the wrong place
+    """
+    return binascii.crc32(data, binascii.crc32(" ".join(map(str, header)).encode("utf-8")))
+
+
+def decode_block_frame(frame: str) -> BlockFrame:
+    """
+    Decode one '<offset> <length> <crc32> <base64>' or compressed '<offset> <length> <crc32> z <base64>' block
+    sent by the device during a download. The CRC32 covers the offset and the uncompressed data, see frame_crc
+    raises:
+        TransferError - If the frame is malformed or its length or CRC32 does not match
+    """
+    try:
+        offset, length, crc, encoded = frame.split(" ", 3)
+        compressed = encoded.startswith(COMPRESSED_FRAME_PREFIX)
+        if compressed:
+            block = zlib.decompress(base64.b64decode(encoded[len(COMPRESSED_FRAME_PREFIX):], validate=True))
+        else:
+            block = base64.b64decode(encoded, validate=True)
+        offset, expected_length, expected_crc = int(offset), int(length), int(crc)
+    except (ValueError, binascii.Error, zlib.error) as err:
+        raise TransferError(f"Malformed block from device :: {frame[:80]!r}") from err
+    if len(block) != expected_length:
+        raise TransferError(f"Block length mismatch at offset {offset}, expected {expected_length} got {len(block)}")
+    if frame_crc(block, offset) != expected_crc:
+        raise TransferError(f"Block CRC32 mismatch at offset {offset}")
+    return BlockFrame(offset, block, compressed)
+
+
+def check_chunk_ack(response: Optional[str], offset: int):
+    """
+    Check the device's reply to an upload chunk: 'A <offset> <crc32>' once written, 'N <offset> <crc32>' if the
+    CRC32 of the chunk it received did not match, see frame_crc
+    raises:
+        TransferError - If the chunk was rejected, or the reply is garbled or for another chunk
+    """
+    fields = (response or "").split()
+    if len(fields) != 3 or fields[0] not in ("A", "N") or fields[1] != str(offset):
+        raise TransferError(f"Expected acknowledgement of the chunk at offset {offset}, got {(response or '')[:80]!r}")
+    if fields[0] == "N":
+        raise TransferError(f"Device rejected the chunk at offset {offset}, CRC32 mismatch")
+
+
+def parse_prefix_hash(line: str) -> Optional[Tuple[int, str]]:
+    """
+    Parse the size and prefix SHA-256 of a remote file, from the HASH_PREFIX command
+    returns:
+        Tuple[int, str] : File size and hex digest, None if the file does not exist
+    raises:
+        TransferError - If the line is malformed
+    """
+    if line.strip() == "-":
+        return None
+    try:
+        size, digest = line.split()
+        return int(size), digest
+    except ValueError as err:
+        raise TransferError(f"Expected file size and hash from device, got {line[:80]!r}") from err
+
+
+def hash_prefix(fp: IO[bytes], length: int) -> str:
+    """
+    SHA-256 of the next length bytes of a file, as HASH_PREFIX computes it on the device. The file is left after them
+    raises:
+        ValueError - If the file has fewer than length bytes left
+    """
+    digest = hashlib.sha256()
+    remaining = length
+    while remaining:
+        if not (block := fp.read(min(65_536, remaining))):
+            raise ValueError(f"File ended {remaining} bytes before the {length} byte prefix")
+        digest.update(block)
+        remaining -= len(block)
+    return digest.hexdigest()
+
+
+def is_retryable(err: Exception) -> bool:
+    """
+    Whether sending a chunk or block again can fix a transfer error: lost, garbled or rejected frames and
+    timeouts can, filesystem errors on the device and on this machine cannot
+    """
+    if isinstance(err, RemotePicoException):
+        return not DEVICE_FILE_ERROR.search(err.remote_exception)
+    return isinstance(err, (TransferError, ResponseTimeout)) or type(err) in (IOError, TimeoutError)
+
+
+def upload_resume_offset(local_fp: IO[bytes], local_size: int, remote: Optional[Tuple[int, str]], pico_file_path) -> int:
+    """
+    Bytes of the remote file that match the start of local_fp, given its size and prefix hash from HASH_PREFIX.
+    local_fp is left at their end
+    """
+    if remote is None:
+        return 0
+    remote_size, remote_digest = remote
+    start = local_fp.tell()
+    if 0 < remote_size <= local_size and hash_prefix(local_fp, remote_size) == remote_digest:
+        LOGGER.info(f"Resuming upload of {pico_file_path} from {remote_size} of {local_size} bytes")
+        return remote_size
+    LOGGER.info(f"{pico_file_path} does not match the start of the local file, uploading it all again")
+    local_fp.seek(start)
+    return 0
+
+
+def download_resume_offset(save_fp: IO[bytes], saved: int, remote: Optional[Tuple[int, str]], pico_filename) -> int:
+    """
+    Bytes already in save_fp that match the start of the remote file, given its size and the hash of its first
+    saved bytes from HASH_PREFIX. save_fp is left at their end, or truncated if they do not match
+    raises:
+        FileNotFoundError - If the remote file does not exist
+    """
+    if remote is None:
+        raise FileNotFoundError(f"File '{pico_filename}' does not exist on Pico")
+    remote_size, remote_digest = remote
+    save_fp.seek(0)
+    if saved <= remote_size and hash_prefix(save_fp, saved) == remote_digest:
+        LOGGER.info(f"Resuming download of {pico_filename} from {saved} of {remote_size} bytes")
+        return saved
+    LOGGER.info(f"Saved data does not match {pico_filename}, downloading it all again")
+    save_fp.seek(0)
+    save_fp.truncate()
+    return 0
+
+
+class UploadChunk(NamedTuple):
+    """A chunk of an upload, ready to frame and send"""
+    position: int   # Offset of the chunk in the remote file
+    data: bytes
+    encoded: str    # base64 of the data as sent, compressed if packed
+    packed: bool    # Sent zlib compressed
+
+
+class UploadLoop:
+    """
+    Chunking and retry decisions of an upload, without the IO, so Pico and AsyncPico send chunks the same way.
+    The caller frames each chunk for the device and reports how it went
+
+        while (chunk := upload.next_chunk()) is not None:
+            try:
+                ... send the chunk, check_chunk_ack(reply, chunk.position)
+            except (RemotePicoException, IOError) as err:
+                if upload.adapt(chunk, err):
+                    continue
+                if upload.retry(err, out_of_time):
+                    ... get the device back to the prompt
+                    continue
+                raise
+            upload.acked(chunk, elapsed)
+    """
+    def __init__(self,
+                 local_fp: IO[bytes],
+                 pico_file_path,
+                 chunk_sizer: ChunkSizer,
+                 offset: int = 0,
+                 file_mode: str = "w",
+                 compress: bool = False,
+                 progress_callback: Optional[ProgressCallback] = None):
+        """
+        args:
+            local_fp (IO[bytes]): File opened in binary mode, positioned after offset bytes that are already uploaded
+            pico_file_path (str): Destination path on the Pico
+            chunk_sizer (ChunkSizer): Chooses the size of each chunk
+            offset (int): Bytes already on the device, from a resumed upload
+            file_mode (str): Mode the device opens the file in for the first chunk, later chunks use "r+"
+            compress (bool): Compress chunks that get smaller
+            progress_callback (Callable): Called with (bytes sent, total bytes) after each chunk
+        """
+        self.pico_file_path = pico_file_path
+        self.chunk_sizer = chunk_sizer
+        self.file_mode = file_mode
+        self.compress = compress
+        self.deflate_available: Optional[bool] = None # Learnt from the device's replies
+        self.offset = offset
+        self.position = offset # Offset of the next chunk in the remote file
+        self.total_size = stream_size(local_fp)
+        if self.total_size is not None:
+            self.total_size += offset
+        self.wire_bytes = 0
+        self.compressed_any = False
+        self._local_fp = local_fp
+        self._progress_callback = progress_callback
+        self._pending = b''
+        self._retries = 0
+        self._finished = False
+
+    @property
+    def bytes_sent(self) -> int:
+        """ Bytes uploaded, not counting a resumed prefix """
+        return self.position - self.offset
+
+    def next_chunk(self) -> Optional[UploadChunk]:
+        """
+        Read the next chunk from the file. The same chunk is returned again until it is acked, resized if the
+        chunk size changed
+        returns:
+            UploadChunk : Chunk to send, None once the upload is complete. An empty file is sent as one empty chunk
+        """
+        if self._finished:
+            return None
+        if len(self._pending) < self.chunk_sizer.size:
+            local_data = self._local_fp.read(self.chunk_sizer.size - len(self._pending))
+            if not isinstance(local_data, bytes):
+                raise ValueError(f"File is not open in binary format got {type(local_data)}")
+            self._pending += local_data
+
+        chunk = self._pending[:self.chunk_sizer.size]
+        if not chunk and self.position:
+            return None
+        packed_chunk = compress_chunk(chunk) if self.compress else None
+        encoded_chunk = base64.b64encode(packed_chunk if packed_chunk is not None else chunk).decode("ascii")
+        return UploadChunk(self.position, chunk, encoded_chunk, packed_chunk is not None)
+
+    def adapt(self, chunk: UploadChunk, err: Exception) -> bool:
+        """
+        Change how chunks are sent after an error the device reported while at the prompt: drop compression
+        if it has no deflate module, use smaller chunks if it ran out of memory
+        returns:
+            bool : True to send the chunk again straight away
+        """
+        if not isinstance(err, RemotePicoException):
+            return False
+        if chunk.packed and "deflate" in err.remote_exception:
+            LOGGER.info("Device has no deflate module, uploading without compression")
+            self.deflate_available = self.compress = False
+            return True
+        if "memory" in err.remote_exception.lower() and self.chunk_sizer.shrink():
+            LOGGER.warning(f"Pico ran out of memory, retrying with {self.chunk_sizer.size} byte chunks")
+            return True
+        return False
+
+    def retry(self, err: Exception, out_of_time: bool = False) -> bool:
+        """
+        Decide whether to send a chunk again after it was rejected, garbled or lost
+        args:
+            out_of_time (bool): The upload's deadline has passed
+        returns:
+            bool : True to get the device back to the prompt and send the chunk again
+        """
+        if self._retries < TRANSFER_RETRIES and is_retryable(err) and not out_of_time:
+            self._retries += 1
+            LOGGER.warning(f"Sending the chunk at offset {self.position} again ({self._retries}/{TRANSFER_RETRIES}) :: {err}")
+            if self.file_mode == "n":
+                self.file_mode = "w" # The lost attempt may have created the file
+            return True
+        LOGGER.error(f"Upload was not successful: {err}")
+        return False
+
+    def acked(self, chunk: UploadChunk, elapsed: float):
+        """
+        The device wrote the chunk
+        args:
+            elapsed (float): Seconds from sending the chunk to its acknowledgement
+        """
+        self.chunk_sizer.record(len(chunk.data), elapsed)
+        if chunk.packed:
+            self.deflate_available = self.compressed_any = True
+        self._pending = self._pending[len(chunk.data):]
+        self.position += len(chunk.data)
+        self.wire_bytes += len(chunk.encoded)
+        self._retries = 0
+        self.file_mode = "r+"
+        if self._progress_callback:
+            self._progress_callback(self.position, self.total_size)
+        if not chunk.data:
+            self._finished = True # Empty file has been created
+
+
+class DownloadLoop:
+    """
+    Reassembly and retry decisions of a download, without the IO, so Pico and AsyncPico download the same way.
+    Blocks are written to save_fp in order as they arrive. Blocks after a missing or garbled one are held, and the
+    gap is requested again by offset
+
+        while not download.done:
+            position, count = download.request()
+            try:
+                lines = ... read count bytes from position in blocks
+                download.start(first line)
+                for frame in lines:
+                    download.feed(frame)
+            except (RemotePicoException, IOError) as err:
+                if not download.retry(err, out_of_time):
+                    raise
+                ... get the device back to the prompt
+            download.check_progress()
+        download.finish()
+    """
+    def __init__(self,
+                 save_fp: IO,
+                 pico_filename,
+                 binary: bool = False,
+                 offset: int = 0,
+                 progress_callback: Optional[ProgressCallback] = None):
+        """
+        args:
+            save_fp (IO): File opened in "wb" mode if binary, otherwise "w", positioned after offset bytes
+            pico_filename (str): File on the Pico
+            binary (bool): Write bytes exactly as stored. Text mode decodes UTF-8 and normalises line endings to \\n
+            offset (int): Bytes already saved, from a resumed download
+            progress_callback (Callable): Called with (bytes received, total bytes) after each block
+        """
+        self.pico_filename = pico_filename
+        self.offset = offset
+        self.position = offset # Everything before this has been saved
+        self.total_size: Optional[int] = None
+        self.wire_bytes = 0
+        self.compressed_any = False
+        self._save_fp = save_fp
+        self._binary = binary
+        self._progress_callback = progress_callback
+        self._text_decoder = None
+        if not binary:
+            self._text_decoder = IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+        self._held: Dict[int, bytes] = {} # Good blocks that arrived after a missing one, by offset
+        self._requested_from = offset
+        self._retries = 0
+
+    @property
+    def done(self) -> bool:
+        return self.total_size is not None and self.position >= self.total_size
+
+    def request(self) -> Tuple[int, int]:
+        """
+        The first missing range: up to the next block already held, or the rest of the file
+        returns:
+            Tuple[int, int] : Offset and byte count to read, -1 for the rest of the file
+        """
+        self._requested_from = self.position
+        return self.position, min(self._held) - self.position if self._held else -1
+
+    def start(self, header: Optional[str]):
+        """ The device sends the file size before the blocks """
+        self.total_size = parse_size_header(header)
+
+    def feed(self, frame: str):
+        """ Save a block frame, and any held blocks that follow it """
+        self.wire_bytes += len(frame)
+        try:
+            block = decode_block_frame(frame)
+        except TransferError as err:
+            LOGGER.warning(f"Dropped a block of {self.pico_filename}, it will be requested again :: {err}")
+            return
+        if block.offset < self.position:
+            return # Duplicate of a block already saved
+        self._held[block.offset] = block.data
+        self.compressed_any |= block.compressed
+        while self.position in self._held:
+            data = self._held.pop(self.position)
+            self._save_fp.write(data if self._binary else self._text_decoder.decode(data))
+            self.position += len(data)
+            if self._progress_callback:
+                self._progress_callback(self.position, self.total_size)
+
+    def retry(self, err: Exception, out_of_time: bool = False) -> bool:
+        """
+        Decide whether to carry on after a request was cut short
+        args:
+            out_of_time (bool): The download's deadline has passed
+        returns:
+            bool : True to get the device back to the prompt and request the rest again
+        """
+        if not is_retryable(err) or out_of_time or \
+                (self._retries == TRANSFER_RETRIES and self.position == self._requested_from):
+            LOGGER.error(f"Download was not successful: {err}")
+            return False
+        LOGGER.warning(f"Download of {self.pico_filename} interrupted at offset {self.position} :: {err}")
+        return True
+
+    def check_progress(self):
+        """
+        Count a request that saved nothing against the retries of the block it asked for
+        raises:
+            TransferError - If the block has failed TRANSFER_RETRIES + 1 times
+        """
+        if self.position == self._requested_from and self.position != self.total_size:
+            if self._retries == TRANSFER_RETRIES:
+                raise TransferError(f"Block at offset {self.position} of {self.pico_filename} failed {self._retries + 1} times")
+            self._retries += 1
+            LOGGER.warning(f"Requesting {self.pico_filename} again from offset {self.position} ({self._retries}/{TRANSFER_RETRIES})")
+        else:
+            self._retries = 0 # Progress was made, the next gap gets its own retries
+
+    def finish(self) -> int:
+        """
+        Flush text still held by the decoder
+        returns:
+            int : Bytes downloaded, not counting a resumed prefix
+        """
+        if self._text_decoder:
+            self._save_fp.write(self._text_decoder.decode(b'', final=True))
+        return self.position - self.offset
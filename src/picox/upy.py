@@ -1,17 +1,41 @@
+import os
 import ast
+import sys
 import time
+import selectors
+import logging
 import re
 import platform
+import inspect
+import functools
+import posixpath
+from contextlib import contextmanager
 from enum import Enum
-from typing import IO, Optional, List
+from typing import IO, Optional, List, Callable, Iterator, Dict, Set, Tuple, Iterable
 from pathlib import Path
-from io import StringIO
+from io import BytesIO
 
 import serial
 
-from .exceptions import RemotePicoException
+from .exceptions import RemotePicoException, ResponseTimeout
+from .scanner import MarkerScanner, LineSplitter, ResponseLineParser
+from .deadline import ResponseDeadline
+from .agent import AGENT_FILE, AGENT_MODULE, agent_call, agent_file_error, agent_version, build_agent_source
 from .logconfig import LOGGER
-from .commands.compiled import DOWNLOAD_FILE, UPLOAD_FILE
+from .transfer import (ChunkSizer, DownloadLoop, ProgressCallback, TransferStats, UploadLoop, DOWNLOAD_BLOCK_SIZE,
+                       check_chunk_ack, download_resume_offset, frame_crc, parse_prefix_hash, should_compress, stream_size,
+                       upload_resume_offset)
+from .sync import DEFAULT_SYNC_IGNORE, SyncPlan, _is_ignored, hash_local_tree, parse_hash_tree_line, plan_sync
+from .batch import CommandBatch
+from .console import CONSOLE_READ_SIZE, ConsoleCapture
+from .execution import FileExecution, build_exec_command, build_script_command
+from .compiler import default_cache as default_compile_cache
+from .readiness import (BOOT_PROMPT_TIMEOUT, INTERRUPT_ATTEMPTS, PROMPT_TIMEOUT, REBOOT_BANNER_TIMEOUT,
+                        ConnectMetrics, DeviceEvent, ReadinessScanner)
+from .fs import FileEntry, MetadataCache, parse_stat_line, parse_walk_line
+from .profiling import Profiler, ProtocolCounters, ProtocolStats
+from .commands.compiled import (HASH_PREFIX, HASH_TREE, READ_COMPRESSED_BLOCKS, READ_FILE_BLOCKS, REMOVE_FILE, STAT_PATH,
+                                WALK_TREE, WRITE_FRAMED_CHUNK)
 
 # Constants for communication patterns
 TERMINATOR = '\r\n'  
@@ -22,14 +46,63 @@ EOR_TOKEN  = f"{EOR_MARKER}{UPY_PROMPT}"
 EOR_MARKER_COMMAND = f";print('{EOR_MARKER}')"
 EOM_MARKER = f';pass;pass;pass;pass{EOR_MARKER_COMMAND}'
 FAILED_MARKER = f"FAILED---0dfe99a5-4543-4fc0-8986-5d7fd5e51d7b---ERROR"
+TRACEBACK_MARKER = "Traceback (most recent call last):" # Printed when a command raises, followed by the prompt
+AGENT_SOURCE = build_agent_source(FAILED_MARKER)
+AGENT_VERSION = agent_version(AGENT_SOURCE)
+AGENT_VERSION_COMMAND = (
+    f'exec("import sys\\nsys.modules.pop(\'{AGENT_MODULE}\', None)\\ntry:\\n import {AGENT_MODULE}\\n'
+    f' print({AGENT_MODULE}.VERSION)\\nexcept ImportError:\\n print(\'-\')")'
+)
 RE_MATCH_BACKSPACE_BEGINNING = re.compile('^' + re.escape("\x08") + '+')
 
+# Raw REPL control sequences
+RAW_REPL_BANNER = b"raw REPL; CTRL-B to exit\r\n>"
+RAW_REPL_ENTER = b"\r\x01"  # Ctrl+A
+RAW_REPL_EXIT = b"\r\x02"  # Ctrl+B
+RAW_PASTE_ENTER = b"\x05A\x01"
+RAW_PASTE_SUPPORTED = b"R\x01"
+RAW_PASTE_UNSUPPORTED = b"R\x00"
+RAW_END_OF_TEXT = b"\x04"
+RAW_WINDOW_INCREMENT = b"\x01"
+RAW_PROMPT = b">"
+
+
+def _profiled(method):
+    """ Record each call of a Pico method as an operation if the session has a profiler, see Profiler """
+    name = method.__name__.lstrip("_")
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._profiler is None:
+                return (yield from method(self, *args, **kwargs))
+            with self._profiler.operation(name, self._serial_port, self._protocol_counters, _operation_detail(args)):
+                return (yield from method(self, *args, **kwargs))
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._profiler is None:
+                return method(self, *args, **kwargs)
+            with self._profiler.operation(name, self._serial_port, self._protocol_counters, _operation_detail(args)):
+                return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _operation_detail(args: tuple) -> Optional[str]:
+    """ The first path or command passed to an operation """
+    return next((str(arg) for arg in args if isinstance(arg, (str, Path))), None)
+
 
 class MicroPython_Version(Enum):
     """Enumeration of supported MicroPython versions."""
     v1_21_0 = "1.21.0"
 
 
+class ReplMode(Enum):
+    """How commands are sent to the device."""
+    FRIENDLY = "friendly"  # Interactive REPL, commands are echoed and results scraped between markers
+    RAW = "raw"            # Raw REPL with raw-paste flow control, no echo and stdout/stderr returned separately
+
+
 class Pico:
     """Manage communications with a MicroPython RP2040 device via serial."""
     def __init__(self, 
@@ -39,7 +112,13 @@ class Pico:
                  skip_stop_exec: bool=False,
                  skip_coms_test: bool=False,
                  serial_read_timeout: int=15, 
-                 serial_write_timeout: Optional[int]=None
+                 serial_write_timeout: Optional[int]=None,
+                 serial_factory: Callable[..., serial.Serial]=serial.Serial,
+                 repl_mode: ReplMode=ReplMode.FRIENDLY,
+                 use_agent: bool=False,
+                 cache_metadata: bool=False,
+                 reboot_on_connect: bool=True,
+                 profiler: Optional[Profiler]=None
                  ):
         """
         New RP2040 device running MicroPython.
@@ -50,86 +129,235 @@ class Pico:
             skip_stop_exec (bool): Skip stopping execution of pico running code. Good if your Pico has a main autoexec script
             skip_coms_test (bool) : Skip a coms test that verifies the coms is good between the computer and Pico
             serial_read_timeout (int): Read timeout supplied to serial.Serial
-            serial_write_timeout (int): Write timeout supplied to serial.Serial
+            serial_write_timeout (int): Write timeout supplied to serial.Serial, 0.5 s if None
+            serial_factory (Callable): Creates the serial transport. Takes serial.Serial keyword arguments.
+                Swap for a fake serial object to run without hardware
+            repl_mode (ReplMode): Send commands through the friendly REPL or the raw REPL
+            use_agent (bool): Install the picox agent module on the device (if missing or outdated) and use it
+                for file operations. Each operation then sends a short call instead of a full command
+            cache_metadata (bool): Keep file listings and stat results for the session. picox's own file operations
+                keep the cache up to date, running user code or rebooting clears it
+            reboot_on_connect (bool): Soft reboot the device when stopping it on connect. When False running code
+                is only interrupted (Ctrl+C), which is faster and keeps the device's state
+            profiler (Profiler): Record each operation with the time and bytes it took on the serial port.
+                Without one nothing is measured
         """
         self._serial_read_timeout = serial_read_timeout
         self._serial_write_timeout = serial_write_timeout
         self._upy_version = micropython_version
         self._serial_port = serial_port
+        self._serial_factory = serial_factory
+        self._repl_mode = repl_mode
+        self._raw_repl_active = False
+        self._raw_busy = False # A raw command has been sent and its output not fully read
+        self._raw_paste_supported = True
+        self._raw_pending = b'' # Bytes read past the end of the last raw read
+        self._line_carry = b'' # Bytes read past the end of the last line based response
+        self._deadline: Optional[ResponseDeadline] = None # Time limits of the call in progress
+        self._profiler = profiler
+        self._protocol_counters = ProtocolCounters() if profiler else None
+        self._agent_ready = False
+        self._deflate_available: Optional[bool] = None # Device has the deflate module, None until a compressed upload
+        self._transfer_stats: Optional[TransferStats] = None
+        self._metadata_cache = MetadataCache() if cache_metadata else None
         self._serial = None
+        self._connect_metrics: Optional[ConnectMetrics] = None
         if not start_closed:
+            started = time.perf_counter()
             # Open the serial device here
             self._open_serial()
+            opened = time.perf_counter()
 
-            # Send stop and reboot to reset Pico state
+            # Send stop (and reboot) to reset Pico state
+            interrupts = 0
             if not skip_stop_exec:
-                self.stop_exec()
-                self._serial.reset_output_buffer()
-                self._serial.reset_input_buffer()
+                interrupts = self.stop_exec(reboot=reboot_on_connect)
+            ready = time.perf_counter()
 
             # Run a sanity test to ensure the serial device responds as expected (e.g. does it run micropython)
             if not skip_coms_test:
                 if not self.coms_test():
                     raise IOError("Did not get expected response from device during coms test")
+            tested = time.perf_counter()
+
+            self._connect_metrics = ConnectMetrics(
+                open_seconds=opened - started,
+                ready_seconds=ready - opened,
+                coms_test_seconds=tested - ready,
+                total_seconds=tested - started,
+                rebooted=reboot_on_connect and not skip_stop_exec,
+                interrupts=interrupts,
+            )
+            LOGGER.debug(f"Connected to {serial_port} in {(tested - started) * 1000:.1f} ms :: {self._connect_metrics}")
+
+            if use_agent:
+                self.install_agent()
 
     def _open_serial(self):
         """Initializes the serial connection with the specified parameters."""
-        self._serial = serial.Serial(
+        self._serial = self._serial_factory(
             port=self._serial_port, 
             baudrate=115200, 
             timeout=self._serial_read_timeout,
-            write_timeout=0.5
+            write_timeout=0.5 if self._serial_write_timeout is None else self._serial_write_timeout
         )
 
-    def _serial_read(self, end_markers: List[str] = None, command_failed_marker: str = FAILED_MARKER) -> bytearray:
+    @property
+    def connect_metrics(self) -> Optional[ConnectMetrics]:
+        """Time taken by each step of connecting, None if the device was created closed"""
+        return self._connect_metrics
+
+    @property
+    def transfer_stats(self) -> Optional[TransferStats]:
+        """Bytes, bytes on the wire and time of the last upload or download, None before the first"""
+        return self._transfer_stats
+
+    @property
+    def protocol_stats(self) -> Optional[ProtocolStats]:
+        """Serial traffic of the session so far and where its time went, None unless the session has a profiler"""
+        return self._protocol_counters.snapshot() if self._protocol_counters else None
+
+    @property
+    def metadata_cache(self) -> Optional[MetadataCache]:
+        """Session metadata cache with hit/miss counters, None unless cache_metadata was set"""
+        return self._metadata_cache
+
+    def _invalidate_metadata(self):
+        """Forget cached metadata, user code may have changed the filesystem"""
+        if self._metadata_cache:
+            self._metadata_cache.invalidate()
+
+    def close(self):
+        """Close the serial connection"""
+        if self._serial is not None:
+            self._exit_raw_repl()
+            self._serial.close()
+            self._serial = None
+
+    def _serial_read(self, end_markers: List[str] = None, command_failed_marker: str = FAILED_MARKER) -> bytes:
         """
-        Read from serial byte-by-byte and check if we hit an end marker
+        Read from serial in bulk and incrementally scan the new bytes for an end marker. The prompt after a
+        traceback also ends the read, the command raised before printing its end marker
+        raises:
+            ResponseTimeout - If the device goes quiet, or the call's deadline passes, before the end
         """
         if not end_markers:
             end_markers = [EOR_TOKEN] # Default to end of response marker
 
-        max_failed_marker_occurances = 2 # Failure marker will show once in the command and once again if failed
-        failed_marker_occurances = 0 # Count times encountered failure markers
+        scanner = MarkerScanner(
+            end_markers=[marker.encode('utf-8') for marker in end_markers],
+            failed_marker=command_failed_marker.encode('utf-8'),
+            max_failed_markers=2, # Failure marker will show once in the command and once again if failed
+            traceback_marker=TRACEBACK_MARKER.encode('utf-8'),
+            prompt_marker=UPY_PROMPT.encode('utf-8'),
+        )
+        debug_enabled = LOGGER.isEnabledFor(logging.DEBUG)
 
-        end_markers_encoded = list(map(lambda marker: marker.encode('utf-8'), end_markers))
-        failed_marker_encoded = command_failed_marker.encode('utf-8')
+        while not scanner.done:
+            if not (recv_bytes := self._serial_recv()):
+                partial_output = scanner.getvalue().decode("utf-8", errors="replace")
+                if not partial_output:
+                    raise ResponseTimeout(f"No response from {self._serial_port} when expected")
+                raise ResponseTimeout(f"Timed out waiting for the end of the response from {self._serial_port}",
+                                      partial_output)
+            if debug_enabled:
+                LOGGER.debug(f"RECV(part) {self._serial_port} :: {recv_bytes}")
+            scanner.feed(recv_bytes)
 
-        recv_buffer = b''
-        while True:
-            recv_bytes = self._serial.read()
-            if not recv_bytes:
-                break # did not recv any bytes
+        recv_buffer = scanner.getvalue().strip()
+        if debug_enabled:
+            LOGGER.debug(f"RECV {self._serial_port} :: {recv_buffer}")
+        return recv_buffer
+    
+    def fileno(self) -> int:
+        """
+        File descriptor of the serial port, e.g. for a ConsoleMultiplexer
+        raises:
+            AttributeError, OSError - If the port has no file descriptor (Windows)
+        """
+        return self._serial.fileno()
 
-            recv_buffer += recv_bytes
-            LOGGER.debug(f"RECV(part) {self._serial_port} :: {recv_buffer}")
+    def read_console(self) -> Iterator[bytes]:
+        """
+        Yield console output as it arrives, without sending anything. Waits in select() until the port
+        is readable, then reads everything that is waiting, so nothing is polled and nothing is dropped
+        raises:
+            SerialException, OSError - If the device disconnects
+        """
+        try:
+            fileno = self.fileno()
+        except (AttributeError, OSError):
+            fileno = None # Windows and serial stand-ins, use blocking reads instead
+        if fileno is None:
+            self._serial.timeout = None
+            while True:
+                yield self._serial.read(self._serial.in_waiting or 1)
 
-            # Check if the buffer ends with any of the markers
-            if any(recv_buffer.endswith(end_marker) for end_marker in end_markers_encoded):
-                break
+        with selectors.DefaultSelector() as selector:
+            selector.register(fileno, selectors.EVENT_READ)
+            while True:
+                selector.select()
+                # Readable with nothing to read means the device has gone
+                if not (recv_bytes := os.read(fileno, CONSOLE_READ_SIZE)):
+                    raise serial.SerialException(f"{self._serial_port} disconnected")
+                yield recv_bytes
 
-            # Check if the error marker has been hit
-            if recv_buffer.endswith(failed_marker_encoded):
-                failed_marker_occurances += 1
-                if failed_marker_occurances >= max_failed_marker_occurances:
-                    break
-    
-        recv_buffer = recv_buffer.strip()
-        LOGGER.debug(f"RECV {self._serial_port} :: {recv_buffer}")
-        return recv_buffer
-    
-    def _serial_read_endless(self):
-        """Endless read from serial, useful for viewing all console output"""
-        self._serial.timeout = 0
-        while True:
-            if data_from_serial := self._serial.read(self._serial.in_waiting or 1).decode("utf-8"):
-                print(f"{data_from_serial}")
-            else:
-                time.sleep(0.05)
+    def _serial_recv(self, size: Optional[int] = None) -> bytes:
+        """
+        Read size bytes, or block for the first byte and then drain whatever else has already arrived. Within
+        a call with time limits each read waits for the idle timeout at most, and nothing is read once the
+        deadline has passed
+        returns:
+            bytes : Empty if the read timed out
+        """
+        if (deadline := self._deadline) is not None and deadline.expired:
+            recv_bytes = b''
+        else:
+            if deadline is not None and (read_timeout := deadline.read_timeout()) != self._serial.timeout:
+                self._serial.timeout = read_timeout
+            recv_bytes = self._serial.read(size or self._serial.in_waiting or 1)
+        if self._protocol_counters:
+            self._protocol_counters.received(len(recv_bytes), size or 1, time.perf_counter())
+        return recv_bytes
+
+    @contextmanager
+    def _time_limits(self, timeout: Optional[float], idle_timeout: Optional[float]):
+        """
+        Apply a call's time limits to every read made inside it, see ResponseDeadline. The limits of an
+        enclosing call stay in place. If they are hit the device is interrupted, so the session can still be used
+        """
+        if self._deadline is not None or (timeout is None and idle_timeout is None):
+            yield
+            return
+        read_timeout = self._serial.timeout
+        self._deadline = ResponseDeadline(timeout, idle_timeout, read_timeout)
+        try:
+            yield
+        except ResponseTimeout:
+            self._deadline = None
+            self._serial.timeout = read_timeout
+            try:
+                self.stop_exec(reboot=False)
+            except IOError as err:
+                LOGGER.warning(f"Could not interrupt {self._serial_port} after a timeout :: {err}")
+            raise
+        finally:
+            self._deadline = None
+            self._serial.timeout = read_timeout
 
-    def _serial_write(self, command: bytes):
-        """Writes a command to the serial port after clearing the input and output buffers."""
+    def _serial_write(self, command: bytes, echoed: bool = False):
+        """
+        Writes a command to the serial port
+        args:
+            echoed (bool): The device echoes the command back, it is typed into the friendly REPL
+        """
         LOGGER.debug(f"SEND {self._serial_port} :: {command}")
+        if not self._protocol_counters:
+            self._serial.write(command)
+            return
+        started = time.perf_counter()
         self._serial.write(command)
+        self._protocol_counters.wrote(len(command), started, time.perf_counter(), echoed)
 
     def _extract_response_payload(self, response: str, start_marker: str, end_marker: str) -> Optional[str]:
         """Extracts a payload from a response delimited by specified start and end markers."""
@@ -170,12 +398,30 @@ class Pico:
             response = response[:-2] # Take only the last newline off
         return response
 
+    @_profiled
     def _communicate(self,
                      command: str, 
                      is_block_command: bool = False, 
-                     ignore_response: bool = False
+                     ignore_response: bool = False,
+                     timeout: Optional[float] = None,
+                     idle_timeout: Optional[float] = None
                      ) -> Optional[str]:
-        """Handles the sending and receiving of a command to/from the MicroPython device."""
+        """
+        Handles the sending and receiving of a command to/from the MicroPython device.
+        args:
+            timeout (float): Seconds for the whole response, None for no limit
+            idle_timeout (float): Seconds the device may go quiet for. Defaults to the serial read timeout
+        raises:
+            RemotePicoException - If the command raised or printed the failed marker
+            ResponseTimeout - If a time limit passed first. The command is interrupted if it had time limits
+        """
+        with self._time_limits(timeout, idle_timeout):
+            if self._repl_mode is ReplMode.RAW:
+                return self._communicate_raw(command, ignore_response)
+            return self._communicate_friendly(command, is_block_command, ignore_response)
+
+    def _communicate_friendly(self, command: str, is_block_command: bool, ignore_response: bool) -> Optional[str]:
+        """ Friendly REPL version of _communicate """
         command += EOM_MARKER + TERMINATOR
         if is_block_command:
             command += TERMINATOR
@@ -183,23 +429,284 @@ class Pico:
         self._serial.reset_output_buffer()
         self._serial.reset_input_buffer()
 
-        self._serial_write(command.encode("utf8"))
+        self._serial_write(command.encode("utf8"), echoed=True)
 
         if not ignore_response:
-            if response := self._serial_read().decode():
-                # Did the response show an exception on the Pico?
-                if response.endswith(FAILED_MARKER):
-                    raise RemotePicoException("Detected exception from device", response)
-                
-                # Good response, Get the payload and return it
-                return self._clean_response(response)
-            else:
-                raise Exception("No response when expected")
+            try:
+                response = self._serial_read().decode()
+            except ResponseTimeout as err:
+                # Output only, without the echo of the command
+                echo_end = err.partial_output.rfind(EOM_MARKER)
+                err.partial_output = "" if echo_end == -1 else err.partial_output[echo_end + len(EOM_MARKER):].lstrip()
+                raise
+            # Did the response show an exception on the Pico?
+            if response.endswith(FAILED_MARKER):
+                raise RemotePicoException("Detected exception from device", response)
+            if not response.endswith(EOR_TOKEN):
+                # Raised before the end of response marker, the prompt came straight after the traceback
+                traceback = response[response.rfind(TRACEBACK_MARKER):-len(UPY_PROMPT)].strip()
+                raise RemotePicoException("Detected exception from device", traceback)
+
+            # Good response, Get the payload and return it
+            payload = self._clean_response(response)
+            if payload.endswith(FAILED_MARKER):
+                raise RemotePicoException("Detected exception from device", payload)
+            return payload
         return None
 
+    @_profiled
+    def _communicate_lines(self, command: str) -> Iterator[str]:
+        """
+        Send a command and yield each line of its output as it arrives, so large outputs are never
+        held in memory. The command echo is skipped and the generator ends at the end of response marker.
+        raises:
+            RemotePicoException - If the command printed the failed marker
+            IOError - If the device stops responding before the end of response marker
+        """
+        if self._repl_mode is ReplMode.RAW:
+            yield from self._communicate_lines_raw(command)
+            return
+
+        self._send_line_command(command)
+        yield from self._read_response_lines()
+
+    def _send_line_command(self, command: str, pipelined: bool = False):
+        """
+        Write a command for _read_response_lines to the friendly REPL
+        args:
+            pipelined (bool): Keep responses to earlier commands that have not been read yet.
+                The device queues the command until it finishes the ones before it
+        """
+        if not pipelined:
+            self._serial.reset_output_buffer()
+            self._serial.reset_input_buffer()
+            self._line_carry = b''
+        self._serial_write((command + EOM_MARKER + TERMINATOR).encode("utf8"), echoed=True)
+
+    def _read_response_lines(self) -> Iterator[str]:
+        """
+        Yield the output lines of the oldest unread friendly REPL response. Bytes received after its
+        end of response marker are kept for the next response
+        """
+        parser = ResponseLineParser(EOM_MARKER, EOR_MARKER, FAILED_MARKER, TRACEBACK_MARKER, UPY_PROMPT.strip())
+        recv_bytes, self._line_carry = self._line_carry, b''
+        while not parser.done:
+            if not recv_bytes:
+                recv_bytes = self._serial_recv()
+                if not recv_bytes:
+                    raise ResponseTimeout(f"Timed out waiting for response from {self._serial_port}", parser.pending)
+            yield from parser.feed(recv_bytes)
+            recv_bytes = b''
+        self._line_carry = parser.remainder # Anything after the response belongs to the next one
+        if parser.failed_line is not None:
+            raise RemotePicoException("Detected exception from device", parser.failed_line)
+
+    def _raw_read_until(self, marker: bytes) -> bytes:
+        """
+        Read until a marker while in the raw REPL. Bytes read past the marker are kept for the next read
+        returns:
+            bytes : Data before the marker
+        raises:
+            IOError - If the device stops responding before the marker
+        """
+        scanner = MarkerScanner(end_markers=[marker])
+        scanner.feed(self._raw_pending)
+        while not scanner.done:
+            recv_bytes = self._serial_recv()
+            if not recv_bytes:
+                raise ResponseTimeout(f"Timed out waiting for {marker!r} from raw REPL on {self._serial_port}",
+                                      scanner.getvalue().decode("utf-8", errors="replace"))
+            scanner.feed(recv_bytes)
+        self._raw_pending = scanner.remainder()
+        return scanner.getvalue()[:-len(marker)]
+
+    def _raw_read_available(self) -> bytes:
+        """ Read whatever is next from the raw REPL, starting with bytes left over from the last read """
+        if pending := self._raw_pending:
+            self._raw_pending = b''
+            return pending
+        recv_bytes = self._serial_recv()
+        if not recv_bytes:
+            raise ResponseTimeout(f"Timed out waiting for response from raw REPL on {self._serial_port}")
+        return recv_bytes
+
+    def _enter_raw_repl(self):
+        """ Interrupt anything running and switch the device to the raw REPL """
+        LOGGER.debug("Entering raw REPL (Ctrl+A)")
+        self._send_stop_exec(quantity=2)
+        self._serial.reset_input_buffer()
+        self._raw_pending = b''
+        self._serial_write(RAW_REPL_ENTER)
+        self._raw_read_until(RAW_REPL_BANNER)
+        self._raw_repl_active = True
+        self._raw_busy = False
+
+    def _exit_raw_repl(self):
+        """ Return the device to the friendly REPL """
+        if self._raw_repl_active:
+            LOGGER.debug("Exiting raw REPL (Ctrl+B)")
+            if self._raw_busy:
+                self._send_stop_exec() # A command, or a raw-paste, is still running and would take Ctrl+B as input
+            self._serial_write(RAW_REPL_EXIT)
+            self._raw_repl_active = False
+            self._raw_pending = b''
+
+    def _raw_paste_write(self, command_bytes: bytes):
+        """ Write a command in raw-paste mode, only sending as much as the device says it has room for """
+        window_size = int.from_bytes(self._serial_recv(2), "little")
+        window_remaining = window_size
+
+        sent = 0
+        while sent < len(command_bytes):
+            while window_remaining == 0 or self._serial.in_waiting:
+                flow_byte = self._serial_recv(1)
+                if flow_byte == RAW_WINDOW_INCREMENT:
+                    window_remaining += window_size
+                elif flow_byte == RAW_END_OF_TEXT:
+                    # Device ended the paste early (e.g. a syntax error). Acknowledge it
+                    self._serial_write(RAW_END_OF_TEXT)
+                    return
+                elif not flow_byte:
+                    raise ResponseTimeout(f"Timed out waiting for raw paste flow control from {self._serial_port}")
+                else:
+                    raise IOError(f"Unexpected data during raw paste: {flow_byte!r}")
+            part = command_bytes[sent:sent + window_remaining]
+            self._serial_write(part)
+            window_remaining -= len(part)
+            sent += len(part)
+
+        # End of data, the device acknowledges once the command has compiled
+        self._serial_write(RAW_END_OF_TEXT)
+        self._raw_read_until(RAW_END_OF_TEXT)
+
+    def _raw_submit(self, command: str):
+        """ Send a command to the raw REPL for execution, using raw-paste mode if the device supports it """
+        if not self._raw_repl_active or self._raw_busy:
+            self._enter_raw_repl()
+        command_bytes = command.encode("utf8")
+        self._raw_busy = True
+
+        if self._raw_paste_supported:
+            self._serial_write(RAW_PASTE_ENTER)
+            paste_response = self._serial_recv(2)
+            if paste_response == RAW_PASTE_SUPPORTED:
+                self._raw_paste_write(command_bytes)
+                return
+            if paste_response != RAW_PASTE_UNSUPPORTED:
+                # Firmware without raw-paste echoes the raw REPL banner instead
+                self._raw_pending = paste_response
+                self._raw_read_until(RAW_REPL_BANNER)
+            LOGGER.debug("Device does not support raw-paste mode, using standard raw REPL")
+            self._raw_paste_supported = False
+
+        # Standard raw REPL has no flow control, send in small pieces
+        for index in range(0, len(command_bytes), 256):
+            self._serial_write(command_bytes[index:index + 256])
+            time.sleep(0.01)
+        self._serial_write(RAW_END_OF_TEXT)
+        if (response := self._serial_recv(2)) != b"OK":
+            raise IOError(f"Raw REPL did not accept command (response: {response!r})")
+
+    def _raw_finish(self) -> str:
+        """ Read stderr and the prompt that close a raw REPL response """
+        stderr = self._raw_read_until(RAW_END_OF_TEXT).decode("utf-8", errors="replace")
+        self._raw_read_until(RAW_PROMPT)
+        self._raw_busy = False
+        return stderr
+
+    def _communicate_raw(self, command: str, ignore_response: bool = False) -> Optional[str]:
+        """
+        Run a command through the raw REPL. There is no echo, stdout is returned and stderr raised
+        raises:
+            RemotePicoException - If the command wrote to stderr or printed the failed marker
+        """
+        self._raw_submit(command)
+        if ignore_response:
+            return None
+
+        stdout = self._raw_read_until(RAW_END_OF_TEXT).decode("utf-8", errors="replace")
+        if stderr := self._raw_finish():
+            raise RemotePicoException("Detected exception from device", stderr)
+        if stdout.rstrip().endswith(FAILED_MARKER):
+            raise RemotePicoException("Detected exception from device", stdout)
+        if stdout.endswith("\r\n"):
+            stdout = stdout[:-2] # Take only the last newline off
+        return stdout
+
+    def _communicate_lines_raw(self, command: str) -> Iterator[str]:
+        """ Raw REPL version of _communicate_lines """
+        self._raw_submit(command)
+        yield from self._read_response_lines_raw()
+
+    def _read_response_lines_raw(self) -> Iterator[str]:
+        """ Yield the output lines of the submitted raw REPL command """
+        splitter = LineSplitter()
+        failed_line = None
+        end_of_stdout = False
+        while not end_of_stdout:
+            recv_bytes = self._raw_read_available()
+            stdout_bytes, end_of_stdout, self._raw_pending = recv_bytes.partition(RAW_END_OF_TEXT)
+            lines = splitter.feed(stdout_bytes)
+            if end_of_stdout and splitter.partial:
+                lines.append(splitter.partial)
+            for raw_line in lines:
+                line = raw_line.decode("utf-8", errors="replace")
+                if line.endswith(FAILED_MARKER):
+                    failed_line = line
+                elif failed_line is None:
+                    yield line
+
+        # Always read to the prompt so the raw REPL is ready for the next command
+        if stderr := self._raw_finish():
+            raise RemotePicoException("Detected exception from device", stderr)
+        if failed_line is not None:
+            raise RemotePicoException("Detected exception from device", failed_line)
+
+    @_profiled
+    def install_agent(self, force: bool = False) -> bool:
+        """
+        Install the picox agent module on the device unless the same version is already there
+        args:
+            force (bool): Upload the agent even if it is up to date
+        returns:
+            bool : True if the agent was uploaded
+        """
+        self._agent_ready = False
+        installed_version = self._communicate(AGENT_VERSION_COMMAND).strip()
+        uploaded = False
+        if force or installed_version != AGENT_VERSION:
+            LOGGER.debug(f"Installing agent {AGENT_VERSION} (found {installed_version})")
+            self.upload_file(BytesIO(AGENT_SOURCE.encode("utf-8")), AGENT_FILE, overwrite=True)
+            installed_version = self._communicate(AGENT_VERSION_COMMAND).strip()
+            if installed_version != AGENT_VERSION:
+                raise IOError(f"Agent did not install correctly, device reports version '{installed_version}'")
+            uploaded = True
+        self._agent_ready = True
+        return uploaded
+
+    def _agent_communicate(self, function: str, *args) -> str:
+        """
+        Call an agent function on the device, translating missing and existing file errors
+        raises:
+            FileNotFoundError, FileExistsError, RemotePicoException
+        """
+        try:
+            return self._communicate(agent_call(function, *args))
+        except RemotePicoException as err:
+            if (file_error := agent_file_error(err, args[0] if args else "")) is not err:
+                raise file_error from err
+            raise
+
+    @_profiled
     def get_file_list(self):
         """ Get a list of files stored on the device """
-        string_list = self._communicate('import os; os.listdir()')
+        if self._metadata_cache and (cached_listing := self._metadata_cache.get_listing()) is not None:
+            return cached_listing
+
+        if self._agent_ready:
+            string_list = self._agent_communicate("ls")
+        else:
+            string_list = self._communicate('import os; print(os.listdir())')
         
         # Ensure response looks like a list
         if not string_list:
@@ -207,16 +714,121 @@ class Pico:
         if string_list[0] != "[" and string_list[-1] != "]":
             raise RuntimeError(f"Did not get back a list from file listing command :: {string_list}")
         else:
-            return ast.literal_eval(string_list) if string_list else []
+            file_list = ast.literal_eval(string_list) if string_list else []
+            if self._metadata_cache:
+                self._metadata_cache.set_listing(file_list)
+            return file_list
 
-    def stop_exec(self):
-        """ Stop execution by a combinatino of reboot and Ctrl+C. Flushes buffers afterwards to get device in known state """
-        self._send_stop_exec(quantity=5)
-        self.send_soft_reboot()
-        time.sleep(0.2)
-        self._send_stop_exec(quantity=5) # If there is an auto boot script, this will clear it
-        time.sleep(0.2)
-        self._send_enter()
+    @_profiled
+    def walk(self, remote_dir: str = "/", recursive: bool = True) -> Iterator[FileEntry]:
+        """
+        List files and directories with their size in a single command. Entries are yielded as they
+        arrive, so large trees are never held in memory
+        args:
+            remote_dir (str): Directory on the Pico to list
+            recursive (bool): Include the contents of subdirectories
+        returns:
+            Iterator[FileEntry] : Entries with paths that start with remote_dir
+        """
+        for line in self._communicate_lines(WALK_TREE(remote_dir, int(recursive))):
+            entry = parse_walk_line(line)
+            if self._metadata_cache:
+                self._metadata_cache.set_stat(entry.path, entry)
+            yield entry
+
+    @_profiled
+    def stat(self, pico_path) -> Optional[FileEntry]:
+        """
+        Get the type and size of a path on the Pico
+        returns:
+            FileEntry : Entry for the path, or None if it does not exist
+        """
+        if self._metadata_cache:
+            cached, entry = self._metadata_cache.lookup_stat(pico_path)
+            if cached:
+                return entry
+
+        entry = parse_stat_line(self._communicate(STAT_PATH(pico_path)).strip(), str(pico_path))
+        if self._metadata_cache:
+            self._metadata_cache.set_stat(pico_path, entry)
+        return entry
+
+    @_profiled
+    def stop_exec(self, reboot: bool = True) -> int:
+        """
+        Stop execution and wait until the device is at the REPL prompt. Each step waits for the device to
+        show it has happened (prompt or soft reboot banner) rather than a fixed time.
+        args:
+            reboot (bool): Soft reboot once stopped, then interrupt main.py if it starts running
+        returns:
+            int : Number of Ctrl+C sent
+        raises:
+            IOError - If the device never returns to the prompt
+        """
+        self._exit_raw_repl()
+        scanner = ReadinessScanner()
+        interrupts = self._interrupt_to_prompt(scanner)
+        if reboot:
+            scanner.clear()
+            self.send_soft_reboot()
+            if not self._wait_for_event(scanner, DeviceEvent.SOFT_REBOOT, REBOOT_BANNER_TIMEOUT):
+                raise IOError(f"No soft reboot banner from {self._serial_port}")
+            # Prompt comes straight after the banner unless main.py is running
+            if not self._wait_for_event(scanner, DeviceEvent.PROMPT, BOOT_PROMPT_TIMEOUT):
+                LOGGER.debug("Device busy after soft reboot (main.py), interrupting")
+                interrupts += self._interrupt_to_prompt(scanner)
+        self._serial.reset_input_buffer()
+        self._line_carry = b''
+        return interrupts
+
+    def _interrupt_to_prompt(self, scanner: ReadinessScanner) -> int:
+        """
+        Send Ctrl+C until the device shows the friendly REPL prompt. A device left in the raw REPL, which
+        takes Ctrl+C without printing anything, is switched back with Ctrl+B
+        returns:
+            int : Number of Ctrl+C sent
+        raises:
+            IOError - If the prompt does not appear after INTERRUPT_ATTEMPTS tries
+        """
+        for attempt in range(1, INTERRUPT_ATTEMPTS + 1):
+            scanner.clear()
+            self._send_stop_exec()
+            if self._wait_for_event(scanner, DeviceEvent.PROMPT, PROMPT_TIMEOUT):
+                return attempt
+            if attempt == 1 or DeviceEvent.RAW_PROMPT in scanner.events:
+                LOGGER.debug("No prompt after Ctrl+C, leaving the raw REPL (Ctrl+B)")
+                scanner.clear()
+                self._serial_write(RAW_REPL_EXIT)
+                self._raw_repl_active = False
+                self._raw_pending = b''
+                if self._wait_for_event(scanner, DeviceEvent.PROMPT, PROMPT_TIMEOUT):
+                    return attempt
+        raise IOError(f"{self._serial_port} did not return to the REPL prompt after {INTERRUPT_ATTEMPTS} interrupts")
+
+    def _wait_for_event(self, scanner: ReadinessScanner, event: DeviceEvent, timeout: float) -> bool:
+        """
+        Read device output until the scanner reports an event
+        args:
+            timeout (float): Seconds to wait for the event
+        returns:
+            bool : True if the event happened in time
+        """
+        deadline = time.monotonic() + timeout
+        read_timeout = self._serial.timeout
+        try:
+            while event not in scanner.events:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._serial.timeout = remaining
+                recv_bytes = self._serial.read(self._serial.in_waiting or 1)
+                if self._protocol_counters:
+                    self._protocol_counters.received(len(recv_bytes), 0, time.perf_counter())
+                if recv_bytes:
+                    scanner.feed(recv_bytes)
+            return True
+        finally:
+            self._serial.timeout = read_timeout
 
     def _send_stop_exec(self, quantity=1):
         """ Send keyboard interrupt to stop execution 
@@ -227,83 +839,446 @@ class Pico:
         for _ in range(quantity):
             self._serial_write(b'\x03')  # Ctrl+C -> stop execution
 
+    @_profiled
     def send_soft_reboot(self):
         """ Send soft reboot command (Ctrl+D) """
         LOGGER.debug("Sending soft reboot to Pico (Ctrl+D)")
+        self._raw_busy = True # A raw REPL reboots into a fresh raw prompt, re-enter before the next command
+        self._invalidate_metadata() # boot.py / main.py may touch the filesystem
         self._serial_write(b'\x04')  # Ctrl+D -> Soft reboot if nothing executing and blank REPL
 
     def _send_enter(self):
         """ Send a blank enter to exit a block statement """
         self._serial_write(b'\r\n')
         
+    @_profiled
     def coms_test(self):
         response = self._communicate("x = 1 + 1; print(x)")
         return response == "2"
 
-    def run_python_command(self, command, block_command=False):
-        """ Run a generic python command """
-        return self._communicate(command, block_command)
+    @_profiled
+    def run_python_command(self, command, block_command=False, timeout: Optional[float] = None,
+                           idle_timeout: Optional[float] = None):
+        """
+        Run a generic python command
+        args:
+            timeout (float): Seconds for the command to finish, None for no limit
+            idle_timeout (float): Seconds the command may go without output. Defaults to the serial read timeout
+        raises:
+            RemotePicoException - If the command raised
+            ResponseTimeout - If a time limit passed first, with the output so far. The command is interrupted
+        """
+        self._invalidate_metadata()
+        return self._communicate(command, block_command, timeout=timeout, idle_timeout=idle_timeout)
 
-    def download_file(self, pico_filename, save_fp: IO[str]):
-        """ Download a file from the Pico to the host """
+    def batch(self, stop_on_error: bool = False, pipeline: bool = False) -> CommandBatch:
+        """
+        Queue commands to run on the device as one exec, see CommandBatch
+        args:
+            stop_on_error (bool): Skip the rest of a batch after a command raises
+            pipeline (bool): Send flushed batches without waiting for earlier responses (friendly REPL only)
+        """
+        if pipeline and self._repl_mode is ReplMode.RAW:
+            LOGGER.debug("Raw REPL needs a handshake per command, batches will not be pipelined")
+            pipeline = False
+        return CommandBatch(self, stop_on_error, pipeline)
+
+    @_profiled
+    def download_file(self,
+                      pico_filename,
+                      save_fp: IO,
+                      binary: bool = False,
+                      block_size: int = DOWNLOAD_BLOCK_SIZE,
+                      progress_callback: Optional[ProgressCallback] = None,
+                      compress: Optional[bool] = None,
+                      resume: bool = False,
+                      timeout: Optional[float] = None,
+                      idle_timeout: Optional[float] = None
+                      ) -> int:
+        """
+        Download a file from the Pico to the host. The file is read in blocks on the device, each sent as a base64
+        line with its offset and CRC32 and written to save_fp as it arrives. Compressed blocks are deflated on the
+        device. Blocks that arrive garbled, or not at all, are requested again by offset, up to TRANSFER_RETRIES times
+        args:
+            pico_filename (str): File on the Pico
+            save_fp (IO): File opened in "wb" mode if binary, otherwise "w". "a+b" to resume
+            binary (bool): Write bytes exactly as stored. Text mode decodes UTF-8 and normalises line endings to \\n
+            block_size (int): Bytes per block read on the device
+            progress_callback (Callable): Called with (bytes received, total bytes) after each block
+            compress (bool): Compress blocks that get smaller, if the device has the deflate module. By default
+                chosen from the file type and size
+            resume (bool): Continue an interrupted binary download. If what save_fp already holds matches the start
+                of the remote file (same SHA-256) only the rest is downloaded, otherwise save_fp is truncated
+            timeout (float): Seconds for the whole download, None for no limit. Blocks are not requested again
+                once it has passed
+            idle_timeout (float): Seconds the device may go quiet for. Defaults to the serial read timeout
+        returns:
+            int : Number of bytes downloaded, not counting a resumed prefix that was already saved
+        raises:
+            ResponseTimeout - If the timeout passed first
+        """
+        with self._time_limits(timeout, idle_timeout):
+            if resume and not binary:
+                raise ValueError("Only binary downloads can be resumed")
+            if self._agent_ready:
+                # Agent reports a missing file itself, no listing needed
+                compress = should_compress(pico_filename, None) if compress is None else compress
+            elif (entry := self.stat(pico_filename)) is None or entry.is_dir:
+                raise FileNotFoundError(f"File '{pico_filename}' does not exist on Pico")
+            else:
+                compress = should_compress(pico_filename, entry.size) if compress is None else compress
+            offset = self._resume_download_offset(pico_filename, save_fp) if resume else 0
 
-        if pico_filename not in self.get_file_list():
-            raise FileNotFoundError(f"File '{pico_filename}' does not exist on Pico")
+            download = DownloadLoop(save_fp, pico_filename, binary, offset, progress_callback)
+            start = time.perf_counter()
+            while not download.done:
+                position, count = download.request()
+                try:
+                    if self._agent_ready:
+                        command = agent_call("get", pico_filename, position, count, block_size, int(compress))
+                    else:
+                        read_blocks = READ_COMPRESSED_BLOCKS if compress else READ_FILE_BLOCKS
+                        command = read_blocks(pico_filename, position, count, block_size)
+                    lines = self._communicate_lines(command)
+                    download.start(next(lines, None))
+                    for frame in lines:
+                        download.feed(frame)
+                except (RemotePicoException, IOError) as err:
+                    if isinstance(err, RemotePicoException) and self._agent_ready and \
+                            (file_error := agent_file_error(err, pico_filename)) is not err:
+                        raise file_error from err
+                    if not download.retry(err, self._out_of_time()):
+                        raise
+                    self._recover_transfer()
+                except BaseException:
+                    self._recover_transfer() # The device may still be sending the rest of the file
+                    raise
+                download.check_progress()
+            bytes_received = download.finish()
+            self._record_transfer(bytes_received, download.wire_bytes, time.perf_counter() - start, download.compressed_any)
+            return bytes_received
 
-        try:
-            file_data = self._communicate(
-                DOWNLOAD_FILE(pico_filename)
-            )
-        except RemotePicoException as err:
-            LOGGER.error(f"Upload was not successful: {err}")
-        else:
-            # Fix line endings to \n and write to file!
-            source = StringIO(file_data)
-            normalized_lines = []
-            for line in source:
-                line = line.rstrip('\r\n') + '\n'
-                normalized_lines.append(line)
-            save_fp.write(''.join(normalized_lines))
+    def _resume_download_offset(self, pico_filename, save_fp: IO[bytes]) -> int:
+        """
+        Bytes already in save_fp that match the start of the remote file. save_fp is left at their end,
+        or truncated if they do not match
+        """
+        saved = save_fp.seek(0, 2)
+        remote = parse_prefix_hash(self._communicate(HASH_PREFIX(pico_filename, saved)).strip())
+        return download_resume_offset(save_fp, saved, remote, pico_filename)
+
+    def _out_of_time(self) -> bool:
+        """ The deadline of the call in progress has passed """
+        return self._deadline is not None and self._deadline.expired
+
+    def _recover_transfer(self):
+        """ Drop the rest of a chunk or block response that went wrong, and get the device back to the prompt """
+        self.stop_exec(reboot=False)
 
+    def _record_transfer(self, num_bytes: int, wire_bytes: int, seconds: float, compressed: bool):
+        self._transfer_stats = TransferStats(num_bytes, wire_bytes, seconds, compressed)
+        LOGGER.debug(f"Transferred {num_bytes} bytes as {wire_bytes} on the wire in {seconds:.3f} s "
+                     f"({self._transfer_stats.throughput / 1024:.1f} KB/s)")
+
+    @_profiled
     def create_directory(self, path: Path, overwrite=False):
-        if str(path) in self.get_file_list():
+        if self._agent_ready:
+            self._agent_communicate("mkdir", str(path), int(overwrite))
+            if self._metadata_cache:
+                self._metadata_cache.record_mkdir(str(path))
+            return
+
+        if (entry := self.stat(path)) is not None:
             if not overwrite:
                 raise FileExistsError(f"'{path}' already exists on the Pico. Set overwrite=True to overwrite.")
-        
+            if entry.is_dir:
+                return # Already there
+
         result = self._communicate(f"import os; os.mkdir('{path}')")
         LOGGER.debug(f"Response from mkdir: {result}")
         if "Traceback" in result:
             LOGGER.error(f"Pico raised Exception during upload :: {result}")
+        elif self._metadata_cache:
+            self._metadata_cache.record_mkdir(str(path))
 
-    def upload_file(self, local_fp: IO[str], pico_file_path, overwrite=False):
-        """ Upload a file from the host to the Pico """
-        if pico_file_path in self.get_file_list():
-            if not overwrite:
+    @_profiled
+    def get_mem_free(self) -> int:
+        """ Get free heap on the device in bytes, after a garbage collect """
+        return int(self._communicate('import gc; gc.collect(); print(gc.mem_free())'))
+
+    @_profiled
+    def upload_file(self,
+                    local_fp: IO[bytes],
+                    pico_file_path,
+                    overwrite=False,
+                    chunk_size: Optional[int] = None,
+                    progress_callback: Optional[ProgressCallback] = None,
+                    compress: Optional[bool] = None,
+                    resume: bool = False,
+                    timeout: Optional[float] = None,
+                    idle_timeout: Optional[float] = None
+                    ) -> int:
+        """
+        Upload a file from the host to the Pico in base64 chunks. Each chunk carries its offset in the file and
+        its CRC32, the device checks the CRC before writing the chunk at its offset and acknowledges it. A chunk
+        that is rejected, garbled or lost is sent again, up to TRANSFER_RETRIES times.
+        Compressed chunks are inflated on the device with the deflate module (MicroPython 1.21+) as they are written
+        args:
+            local_fp (IO[bytes]): File opened in binary mode
+            pico_file_path (str): Destination path on the Pico
+            overwrite (bool): Replace the file if it already exists
+            chunk_size (int): Fixed bytes per chunk. By default this adapts to free device memory and throughput
+            progress_callback (Callable): Called with (bytes sent, total bytes) after each chunk
+            compress (bool): zlib compress chunks that get smaller. By default chosen from the file type and size.
+                Falls back to plain chunks if the device has no deflate module
+            resume (bool): Continue an interrupted upload. If the remote file matches the start of local_fp (same
+                SHA-256) only the rest is sent, otherwise the remote file is replaced. local_fp must be seekable
+            timeout (float): Seconds for the whole upload, None for no limit. Chunks are not sent again once it
+                has passed
+            idle_timeout (float): Seconds to wait for each chunk to be acknowledged. Defaults to the serial read timeout
+        returns:
+            int : Number of bytes uploaded, not counting a resumed prefix that was already on the device
+        raises:
+            ResponseTimeout - If the timeout passed first
+        """
+        with self._time_limits(timeout, idle_timeout):
+            offset = self._resume_upload_offset(local_fp, pico_file_path) if resume else 0
+            if offset:
+                file_mode = "r+" # Write after the part that is already there
+            elif self._agent_ready:
+                file_mode = "w" if overwrite or resume else "n" # Agent refuses to replace an existing file in "n" mode
+            elif not (overwrite or resume) and self.stat(pico_file_path) is not None:
                 raise FileExistsError(f"File '{pico_file_path}' already exists on the Pico. Set overwrite=True to overwrite.")
+            else:
+                file_mode = "w" # First chunk truncates, the rest are written at their offset
 
-        # Read the file data from the host
-        local_data = local_fp.read()
-        if not isinstance(local_data, bytes):
-            raise ValueError(f"File is not open in binary format got {type(local_data)}")
-        
-        # Upload the file to the pico
+            if chunk_size is None:
+                chunk_sizer = ChunkSizer(mem_free=self.get_mem_free())
+            else:
+                chunk_sizer = ChunkSizer(fixed_size=chunk_size)
+            upload = UploadLoop(local_fp, pico_file_path, chunk_sizer, offset, file_mode,
+                                progress_callback=progress_callback)
+            if compress is None:
+                compress = should_compress(pico_file_path, upload.total_size)
+            upload.compress = compress and self._deflate_available is not False
+
+            upload_start = time.perf_counter()
+            try:
+                while (chunk := upload.next_chunk()) is not None:
+                    start = time.perf_counter()
+                    try:
+                        if self._agent_ready:
+                            crc = frame_crc(chunk.data, pico_file_path, upload.file_mode, chunk.position)
+                            ack = self._agent_communicate("put", pico_file_path, chunk.encoded, upload.file_mode,
+                                                          int(chunk.packed), chunk.position, crc)
+                        else:
+                            file_mode = upload.file_mode + "b"
+                            crc = frame_crc(chunk.data, pico_file_path, file_mode, chunk.position)
+                            ack = self._communicate(WRITE_FRAMED_CHUNK(pico_file_path, file_mode, chunk.position, crc,
+                                                                       int(chunk.packed), chunk.encoded))
+                        check_chunk_ack(ack, chunk.position)
+                    except FileExistsError:
+                        raise # Agent found the file in "n" mode, nothing was written
+                    except (RemotePicoException, IOError) as err:
+                        if upload.adapt(chunk, err):
+                            continue
+                        if upload.retry(err, self._out_of_time()):
+                            self._recover_transfer()
+                            continue
+                        if self._metadata_cache:
+                            self._metadata_cache.forget(pico_file_path) # Partially written
+                        raise
+                    upload.acked(chunk, time.perf_counter() - start)
+            finally:
+                if upload.deflate_available is not None:
+                    self._deflate_available = upload.deflate_available
+            if self._metadata_cache:
+                self._metadata_cache.record_write(pico_file_path, upload.position)
+            self._record_transfer(upload.bytes_sent, upload.wire_bytes, time.perf_counter() - upload_start,
+                                  upload.compressed_any)
+            return upload.bytes_sent
+
+    def _resume_upload_offset(self, local_fp: IO[bytes], pico_file_path) -> int:
+        """
+        Bytes of the remote file that match the start of local_fp. local_fp is left at their end
+        raises:
+            ValueError - If local_fp is not seekable
+        """
+        if (local_size := stream_size(local_fp)) is None:
+            raise ValueError("Resuming an upload needs a seekable file")
+        remote = parse_prefix_hash(self._communicate(HASH_PREFIX(pico_file_path, local_size)).strip())
+        return upload_resume_offset(local_fp, local_size, remote, pico_file_path)
+
+    @_profiled
+    def remove_file(self, pico_file_path):
+        """ Delete a file from the Pico """
         try:
-            result = self._communicate(
-                UPLOAD_FILE(local_data.hex(), pico_file_path)
-            )
+            self._communicate(REMOVE_FILE(pico_file_path))
+            if self._metadata_cache:
+                self._metadata_cache.record_delete(pico_file_path)
         except RemotePicoException as err:
-            LOGGER.error(f"Upload was not successful: {err}")
+            if (file_error := agent_file_error(err, pico_file_path)) is not err:
+                raise file_error from err
             raise
-        return result
 
-    def execute_file(self, file_name):
+    @_profiled
+    def hash_remote_tree(self, remote_dir: str = "/") -> Tuple[Dict[str, str], Set[str]]:
+        """
+        Hash every file under a directory on the Pico in a single pass on the device
+        args:
+            remote_dir (str): Directory on the Pico
+        returns:
+            Tuple[Dict[str, str], Set[str]] : SHA-256 by path relative to remote_dir, and relative directory paths.
+                The directories include "" for remote_dir itself, both are empty if it does not exist
+        """
+        files = {}
+        directories = set()
+        for line in self._communicate_lines(HASH_TREE(remote_dir)):
+            kind, digest, path = parse_hash_tree_line(line, remote_dir)
+            if kind == "D":
+                directories.add(path)
+            else:
+                files[path] = digest
+        return files, directories
+
+    @_profiled
+    def sync(self,
+             local_dir: Path,
+             remote_dir: str = "/",
+             delete: bool = False,
+             dry_run: bool = False,
+             ignore: Iterable[str] = DEFAULT_SYNC_IGNORE
+             ) -> SyncPlan:
+        """
+        Make a directory on the Pico match a local directory, only uploading new or changed files.
+        Files are compared by SHA-256, remote hashes are computed on the device
+        args:
+            local_dir (Path): Local directory to copy from
+            remote_dir (str): Directory on the Pico to copy to, created if missing
+            delete (bool): Delete remote files that do not exist locally. The resident agent is kept
+            dry_run (bool): Work out the changes without making them
+            ignore (Iterable[str]): fnmatch patterns for file and directory names to skip, locally and remotely
+        returns:
+            SyncPlan : Changes that were (or with dry_run would be) made
+        """
+        local_dir = Path(local_dir)
+        if not local_dir.is_dir():
+            raise NotADirectoryError(f"'{local_dir}' is not a directory")
+
+        remote_path = lambda relative_path: posixpath.join(remote_dir, relative_path).rstrip("/") or "/"
+        local_files, local_directories = hash_local_tree(local_dir, ignore)
+        remote_files, remote_directories = self.hash_remote_tree(remote_dir)
+        # The agent is not one of the synced files, it must survive delete
+        remote_files = {
+            path: digest for path, digest in remote_files.items()
+            if not _is_ignored(path, ignore) and posixpath.join("/", remote_path(path)) != AGENT_FILE
+        }
+
+        plan = plan_sync(local_files, local_directories, remote_files, remote_directories, delete=delete)
+        if dry_run:
+            return plan
+
+        for directory in plan.create_directories:
+            LOGGER.debug(f"Sync creating directory {remote_path(directory)}")
+            self.create_directory(remote_path(directory), overwrite=True)
+        for file in plan.upload:
+            LOGGER.info(f"Sync uploading {file}")
+            with (local_dir / file).open("rb") as local_fp:
+                self.upload_file(local_fp, remote_path(file), overwrite=True)
+        for file in plan.delete:
+            LOGGER.info(f"Sync deleting {file}")
+            self.remove_file(remote_path(file))
+        return plan
+
+    @_profiled
+    def execute_file(self, file_name, follow: bool = False, idle_timeout: Optional[float] = None) -> Optional[FileExecution]:
+        """
+        Run a file on the Pico
+        args:
+            file_name (str): File on the Pico
+            follow (bool): Follow the file's output until it finishes. Otherwise the file is started and left running
+            idle_timeout (float): With follow, seconds without output before giving up. None waits for the file to finish
+        returns:
+            FileExecution : With follow, output lines as they arrive, then the traceback and duration in its result
+        """
         LOGGER.debug(f"Executing file {file_name}")
+        if not follow:
+            return self._start_execution(file_name, f'exec(open("{file_name}").read())', follow, idle_timeout)
+        return self._start_execution(file_name, build_exec_command(file_name), follow, idle_timeout)
+
+    @_profiled
+    def run_script(self,
+                   local_path,
+                   follow: bool = False,
+                   idle_timeout: Optional[float] = None,
+                   shorten_names: bool = False
+                   ) -> Optional[FileExecution]:
+        """
+        Run a script from this machine on the Pico without uploading it. The script is compiled to the
+        smallest command that runs the same, see picox.compiler. Compiled scripts are cached, so running
+        an unchanged script again, or on many devices, compiles it once
+        args:
+            local_path (Path): Script on this machine
+            follow (bool): Follow the script's output until it finishes, see execute_file
+            idle_timeout (float): With follow, seconds without output before giving up
+            shorten_names (bool): Shorten local variable names in the script's functions
+        returns:
+            FileExecution : With follow, output lines as they arrive, then the traceback and duration in its result
+        raises:
+            SyntaxError: The script is not valid Python, nothing was sent
+        """
+        compiled = build_script_command(Path(local_path).read_text(), follow=follow, shorten_names=shorten_names,
+                                        filename=str(local_path), cache=default_compile_cache())
+        LOGGER.debug(f"Running {local_path}, compiled {compiled.original_size} -> {compiled.compiled_size} bytes")
+        return self._start_execution(local_path, compiled.payload, follow, idle_timeout)
+
+    def _start_execution(self, name, command: str, follow: bool, idle_timeout: Optional[float]) -> Optional[FileExecution]:
+        """ Send a command that runs user code, following its output if asked, see execute_file """
         self.stop_exec()
-        return self._communicate(f'exec(open("{file_name}").read())', ignore_response=True)
+        self._invalidate_metadata()
+        if not follow:
+            return self._communicate(command, ignore_response=True)
+
+        # Sent now so the code starts running straight away, output is read as it is iterated
+        if self._repl_mode is ReplMode.RAW:
+            self._raw_submit(command)
+            lines = self._read_response_lines_raw()
+        else:
+            self._send_line_command(command)
+            lines = self._read_response_lines()
+        return FileExecution(name, self._follow_lines(lines, idle_timeout))
+
+    @_profiled
+    def _follow_lines(self, lines: Iterator[str], idle_timeout: Optional[float]) -> Iterator[str]:
+        """
+        Read the output of a running file with the idle timeout as the serial read timeout. If the
+        timeout passes the file is interrupted, so the session can still be used
+        """
+        previous_timeout = self._serial.timeout
+        self._serial.timeout = idle_timeout
+        try:
+            yield from lines
+        except IOError:
+            self._serial.timeout = previous_timeout
+            self.stop_exec(reboot=False)
+            raise
+        finally:
+            self._serial.timeout = previous_timeout
 
-    def start_console_attach(self):
+    def start_console_attach(self, capture: Optional[ConsoleCapture] = None):
+        """
+        Show console output until interrupted
+        args:
+            capture (ConsoleCapture): Where the output goes. Defaults to stdout
+        """
         LOGGER.info(f"Starting console read from device {self._serial_port}...")
-        self._serial_read_endless()
+        self._exit_raw_repl()
+        capture = capture or ConsoleCapture([sys.stdout])
+        try:
+            for recv_bytes in self.read_console():
+                capture.feed(recv_bytes)
+        finally:
+            capture.close()
 
     def start_repl(self):
         end_markers = (UPY_PROMPT, BLOCK_PROMPT)
@@ -314,18 +1289,9 @@ class Pico:
         else:
             import readline
 
-        # Get the Pico in a known state
-        self.stop_exec()
-        self.send_soft_reboot()
-        time.sleep(0.5)
-        self._serial.reset_output_buffer()
-        self._serial.reset_input_buffer()
+        # Get the Pico in a known state, stop_exec returns once the prompt has been shown
         self.stop_exec()
-        time.sleep(0.5)
-
-        prompt = self._serial_read(end_markers=[UPY_PROMPT]).decode("utf-8")
-        self._serial.reset_output_buffer()
-        self._serial.reset_input_buffer()
+        prompt = UPY_PROMPT.strip()
         while True:
             raw_command = input(f"{prompt} ")
             if raw_command == "exit()":
@@ -334,7 +1300,10 @@ class Pico:
             command = f"{raw_command}\r" # Add an enter to submit
             self._serial_write(command.encode("utf-8"))
 
-            prompt = self._serial_read(end_markers=end_markers).decode("utf-8")
+            try:
+                prompt = self._serial_read(end_markers=end_markers).decode("utf-8")
+            except ResponseTimeout as err:
+                prompt = err.partial_output # Still running, show what it printed so far
             
             # Sometimes a backspace character appears at the left, remove it
             prompt = re.sub(RE_MATCH_BACKSPACE_BEGINNING, "", prompt)
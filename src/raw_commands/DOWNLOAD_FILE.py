@@ -1,2 +0,0 @@
-with open('{pico_filename}', 'r') as f:
-    print(f.read(), end='')
\ No newline at end of file
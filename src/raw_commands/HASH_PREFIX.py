@@ -0,0 +1,18 @@
+from os import stat
+from hashlib import sha256
+from binascii import hexlify
+try:
+    size = stat('{pico_path}')[6]
+except OSError:
+    print('-')
+else:
+    h = sha256()
+    remaining = min(size, {length})
+    with open('{pico_path}', 'rb') as f:
+        while remaining:
+            block = f.read(min(1024, remaining))
+            if not block:
+                break
+            h.update(block)
+            remaining -= len(block)
+    print(size, hexlify(h.digest()).decode())
@@ -0,0 +1,25 @@
+import os
+from hashlib import sha256
+from binascii import hexlify
+def hash_tree(d):
+    for entry in os.ilistdir(d):
+        path = d.rstrip('/') + '/' + entry[0]
+        if entry[1] == 0x4000:
+            print('D', path)
+            hash_tree(path)
+        else:
+            h = sha256()
+            with open(path, 'rb') as f:
+                while True:
+                    block = f.read(1024)
+                    if not block:
+                        break
+                    h.update(block)
+            print('F', hexlify(h.digest()).decode(), path)
+try:
+    os.stat('{remote_dir}')
+except OSError:
+    pass
+else:
+    print('D', '{remote_dir}'.rstrip('/') + '/')
+    hash_tree('{remote_dir}')
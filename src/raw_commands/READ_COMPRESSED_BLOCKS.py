@@ -0,0 +1,31 @@
+from binascii import b2a_base64, crc32
+from io import BytesIO
+from os import stat
+try:
+    from deflate import DeflateIO, ZLIB
+except ImportError:
+    DeflateIO = None
+print(stat('{pico_filename}')[6])
+with open('{pico_filename}', 'rb') as f:
+    offset = f.seek({offset})
+    remaining = {count}
+    while remaining:
+        block = f.read({block_size} if remaining < 0 else min({block_size}, remaining))
+        if not block:
+            break
+        packed = None
+        if DeflateIO:
+            try:
+                out = BytesIO()
+                compressor = DeflateIO(out, ZLIB, 10)
+                compressor.write(block)
+                compressor.close()
+                packed = out.getvalue()
+            except Exception:
+                DeflateIO = None # Built without compression, send the rest as is
+        if packed and len(packed) < len(block):
+            print(offset, len(block), crc32(block, crc32(str(offset).encode())), 'z', b2a_base64(packed).decode().strip())
+        else:
+            print(offset, len(block), crc32(block, crc32(str(offset).encode())), b2a_base64(block).decode().strip())
+        offset += len(block)
+        remaining -= len(block)
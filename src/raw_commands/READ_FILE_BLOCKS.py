@@ -0,0 +1,13 @@
+from binascii import b2a_base64, crc32
+from os import stat
+print(stat('{pico_filename}')[6])
+with open('{pico_filename}', 'rb') as f:
+    offset = f.seek({offset})
+    remaining = {count}
+    while remaining:
+        block = f.read({block_size} if remaining < 0 else min({block_size}, remaining))
+        if not block:
+            break
+        print(offset, len(block), crc32(block, crc32(str(offset).encode())), b2a_base64(block).decode().strip())
+        offset += len(block)
+        remaining -= len(block)
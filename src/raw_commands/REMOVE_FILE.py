@@ -0,0 +1,2 @@
+import os
+os.remove('{pico_file_path}')
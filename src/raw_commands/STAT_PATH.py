@@ -0,0 +1,7 @@
+import os
+try:
+    s = os.stat('{pico_path}')
+except OSError:
+    print('-')
+else:
+    print('D' if s[0] & 0x4000 else 'F', s[6])
@@ -0,0 +1,11 @@
+import os
+def walk_tree(d, recursive):
+    for entry in os.ilistdir(d):
+        path = d.rstrip('/') + '/' + entry[0]
+        if entry[1] == 0x4000:
+            print('D 0', path)
+            if recursive:
+                walk_tree(path, recursive)
+        else:
+            print('F', entry[3] if len(entry) > 3 else os.stat(path)[6], path)
+walk_tree('{remote_dir}', {recursive})
@@ -0,0 +1,15 @@
+from binascii import a2b_base64, crc32
+path, mode, offset, expected_crc, compressed = '{pico_file_path}', '{file_mode}', {offset}, {crc}, {compressed}
+data = a2b_base64('{b64_data}')
+if compressed:
+    from io import BytesIO
+    from deflate import DeflateIO, ZLIB
+    data = DeflateIO(BytesIO(data), ZLIB).read()
+crc = crc32(data, crc32(' '.join((path, mode, str(offset))).encode()))
+if crc != expected_crc:
+    print('N', offset, crc)
+else:
+    with open(path, mode) as f:
+        f.seek(offset)
+        f.write(data)
+    print('A', offset, crc)
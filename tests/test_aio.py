@@ -0,0 +1,181 @@
+import asyncio
+import io
+import os
+import socket
+import time
+
+import pytest
+import serial
+
+from picox.aio import AsyncPico
+from picox.exceptions import RemotePicoException, ResponseTimeout
+from picox.fake import LinkEmulation, SocketDevice
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="AsyncPico is POSIX only")
+
+
+def run(test, root, prepare=lambda device: None, link=None):
+    """ Run a coroutine function with an AsyncPico connected to a fake device serving root """
+    async def main():
+        with SocketDevice(root, link) as device:
+            prepare(device)
+            pico = await AsyncPico.open_fd(device.fileno(), "FAKE", read_timeout=5)
+            try:
+                return await test(pico)
+            finally:
+                pico.close()
+    return asyncio.run(main())
+
+
+def test_commands(tmp_path):
+    (tmp_path / "main.py").write_text("print('booted')\n")
+    async def test(pico):
+        assert pico.connect_metrics.interrupts == 1
+        assert await pico.run_python_command("print(1 + 1)") == "2"
+        assert await pico.run_python_command("for i in range(2):\n    print(i)") == "0\r\n1"
+        assert await pico.get_file_list() == ["main.py"]
+        assert (await pico.stat("main.py")).size == 16
+        assert await asyncio.gather(pico.run_python_command("print(5)"), pico.run_python_command("print(6)")) == ["5", "6"]
+        with pytest.raises(RemotePicoException, match="ZeroDivisionError"):
+            await pico.run_python_command("1 / 0")
+    run(test, tmp_path)
+
+
+def test_connect_from_raw_repl(tmp_path):
+    async def test(pico):
+        assert await pico.run_python_command("print(1 + 1)") == "2"
+    run(test, tmp_path, prepare=lambda device: device.device.feed(b"\x01"))
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_upload_and_download(tmp_path, compress):
+    data = os.urandom(6000) + b"line\n" * 4000
+    async def test(pico):
+        progress = []
+        assert await pico.upload_file(io.BytesIO(data), "data.txt", chunk_size=2048, compress=compress,
+                                      progress_callback=lambda done, total: progress.append((done, total))) == len(data)
+        assert (tmp_path / "data.txt").read_bytes() == data
+        assert progress[-1] == (len(data), len(data))
+        with pytest.raises(FileExistsError):
+            await pico.upload_file(io.BytesIO(data), "data.txt")
+
+        saved = io.BytesIO()
+        assert await pico.download_file("data.txt", saved, binary=True, block_size=1024, compress=compress) == len(data)
+        assert saved.getvalue() == data
+
+        (tmp_path / "text.txt").write_bytes("café\r\nline 2\r\n".encode("utf-8"))
+        text = io.StringIO()
+        await pico.download_file("text.txt", text, block_size=4) # Splits the UTF-8 and the \r\n
+        assert text.getvalue() == "café\nline 2\n"
+
+        with pytest.raises(FileNotFoundError):
+            await pico.download_file("missing.bin", io.BytesIO(), binary=True)
+    run(test, tmp_path)
+
+
+def test_empty_file(tmp_path):
+    async def test(pico):
+        assert await pico.upload_file(io.BytesIO(), "empty.bin") == 0
+        assert (tmp_path / "empty.bin").read_bytes() == b""
+        saved = io.BytesIO()
+        assert await pico.download_file("empty.bin", saved, binary=True) == 0
+    run(test, tmp_path)
+
+
+def garble(text: str, after: str) -> str:
+    """ Change the character 8 past a marker """
+    index = text.index(after) + len(after) + 8
+    return text[:index] + ("A" if text[index] != "A" else "B") + text[index + 1:]
+
+
+def test_garbled_chunk_is_sent_again(tmp_path):
+    data = os.urandom(5000)
+    async def test(pico):
+        write = pico._write
+        garbled = []
+        async def garble_first_chunk(data):
+            if not garbled and b"data=a2b_base64(" in data:
+                garbled.append(data)
+                data = garble(data.decode(), "data=a2b_base64(").encode()
+            await write(data)
+        pico._write = garble_first_chunk
+        assert await pico.upload_file(io.BytesIO(data), "data.bin", chunk_size=1000) == len(data)
+        assert garbled
+        assert (tmp_path / "data.bin").read_bytes() == data
+    run(test, tmp_path)
+
+
+def test_garbled_block_is_requested_again(tmp_path):
+    data = os.urandom(5000)
+    (tmp_path / "data.bin").write_bytes(data)
+    async def test(pico):
+        communicate_lines = pico._communicate_lines
+        garbled = []
+        async def garble_first_block(command):
+            async for line in communicate_lines(command):
+                if not garbled and line.startswith("1024 1024 "):
+                    garbled.append(line)
+                    line = garble(line, "1024 1024 ")
+                yield line
+        pico._communicate_lines = garble_first_block
+        saved = io.BytesIO()
+        assert await pico.download_file("data.bin", saved, binary=True, block_size=1024) == len(data)
+        assert garbled
+        assert saved.getvalue() == data
+    run(test, tmp_path)
+
+
+def test_resumed_transfers(tmp_path):
+    data = os.urandom(20_000)
+    (tmp_path / "data.bin").write_bytes(data[:5000])
+    async def test(pico):
+        assert await pico.upload_file(io.BytesIO(data), "data.bin", resume=True) == len(data) - 5000
+        assert (tmp_path / "data.bin").read_bytes() == data
+        saved = io.BytesIO(data[:7000])
+        assert await pico.download_file("data.bin", saved, binary=True, resume=True) == len(data) - 7000
+        assert saved.getvalue() == data
+        saved = io.BytesIO(b"x" * 7000) # Does not match, downloaded again
+        assert await pico.download_file("data.bin", saved, binary=True, resume=True) == len(data)
+        assert saved.getvalue() == data
+    run(test, tmp_path)
+
+
+def test_command_time_limits(tmp_path):
+    async def test(pico):
+        started = time.monotonic()
+        with pytest.raises(ResponseTimeout):
+            await pico.run_python_command("while True:\n    pass", timeout=0.3)
+        assert time.monotonic() - started < 2
+        with pytest.raises(ResponseTimeout) as raised:
+            await pico.run_python_command("import time; print('started'); time.sleep(10)", idle_timeout=0.3)
+        assert "started" in raised.value.partial_output
+        # Interrupted, the session can still be used
+        assert await pico.run_python_command("print(1 + 1)", timeout=5) == "2"
+    run(test, tmp_path)
+
+
+def test_transfer_timeout(tmp_path):
+    (tmp_path / "data.bin").write_bytes(os.urandom(20_000))
+    async def test(pico):
+        saved = io.BytesIO()
+        with pytest.raises(ResponseTimeout):
+            await pico.download_file("data.bin", saved, binary=True, block_size=512, timeout=0.5)
+        assert 0 < len(saved.getvalue()) < 20_000 # The whole download takes about 3 s
+        assert await pico.run_python_command("print(1 + 1)") == "2"
+    run(test, tmp_path, link=LinkEmulation(bytes_per_second=10_000))
+
+
+def test_write_timeout():
+    host, device = socket.socketpair() # Nothing reads the device end
+    async def main():
+        pico = AsyncPico(host.fileno(), "STUCK", write_timeout=0.2)
+        started = time.monotonic()
+        with pytest.raises(serial.SerialTimeoutException):
+            await pico._write(b"x" * 10_000_000)
+        assert time.monotonic() - started < 2
+        pico.close()
+    try:
+        asyncio.run(main())
+    finally:
+        host.close()
+        device.close()
@@ -0,0 +1,77 @@
+import pytest
+
+from picox import batch as batch_module
+from picox.exceptions import RemotePicoException
+from picox.fake import FakeSerial
+from picox.upy import Pico, ReplMode
+
+
+@pytest.fixture(params=[ReplMode.FRIENDLY, ReplMode.RAW], ids=lambda mode: mode.value)
+def pico(request, tmp_path):
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs), repl_mode=request.param)
+    yield pico
+    pico.close()
+
+
+def test_output_without_trailing_newline(pico):
+    with pico.batch() as batch:
+        first = batch.run("print('a', end='')")
+        second = batch.run("print('b')")
+        third = batch.run("print('c\\n')")
+        last = batch.run("print('d', end='')")
+    assert first.result() == "a"
+    assert second.result() == "b"
+    assert third.result() == "c\n"
+    assert last.result() == "d"
+
+
+def test_error_after_partial_line(pico):
+    with pico.batch() as batch:
+        broken = batch.run("print('a', end=''); 1 / 0")
+        empty = batch.run("pass")
+    with pytest.raises(RemotePicoException, match="ZeroDivisionError"):
+        broken.result()
+    assert broken.output == ["a"]
+    assert empty.result() == ""
+
+
+def test_pipelined_output_without_trailing_newline(tmp_path):
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs))
+    with pico.batch(pipeline=True) as batch:
+        results = []
+        for index in range(4):
+            results.append(batch.run(f"print({index}, end='')"))
+            batch.flush()
+    assert [result.result() for result in results] == ["0", "1", "2", "3"]
+    pico.close()
+
+
+def test_batch_leaves_no_globals(pico):
+    pico.run_python_command("x = 1")
+    with pico.batch() as batch:
+        batch.run("y = 2")
+        batch.run("1 / 0")
+    names = pico.run_python_command("print(sorted(n for n in globals() if n.startswith('_') and len(n) == 2))")
+    assert names == "[]"
+    assert pico.run_python_command("print(x, y)") == "1 2"
+
+
+def test_pipeline_bounded_by_device_buffer(tmp_path, monkeypatch):
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs))
+    sends = []
+    send_line_command = pico._send_line_command
+    def record_send(command, pipelined=False):
+        sends.append(pipelined)
+        send_line_command(command, pipelined)
+    monkeypatch.setattr(pico, "_send_line_command", record_send)
+
+    with pico.batch(pipeline=True) as batch:
+        small = batch.run("print(1)")
+        batch.flush()
+        large = batch.run(f"print(len({'x' * batch_module.PIPELINE_BUFFER_SIZE!r}))")
+        batch.flush()
+        after = batch.run("print(3)")
+        batch.flush()
+    assert sends == [False, False, True]
+    assert [small.result(), large.result(), after.result()] == ["1", str(batch_module.PIPELINE_BUFFER_SIZE), "3"]
+    pico.close()
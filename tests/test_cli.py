@@ -0,0 +1,29 @@
+import sys
+
+import pytest
+
+from picox.cli import get_args
+
+
+def parse(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["picox", *argv])
+    return get_args()
+
+
+@pytest.mark.parametrize("argv", [
+    ("detect", "--no-reboot"),
+    ("--no-reboot", "detect"),
+    ("--no-reboot", "detect", "--all"),
+    ("detect", "--all", "--no-reboot"),
+])
+def test_detect_no_reboot(monkeypatch, argv):
+    assert parse(monkeypatch, *argv).no_reboot is True
+
+
+def test_detect_reboots_by_default(monkeypatch):
+    assert parse(monkeypatch, "detect").no_reboot is False
+
+
+def test_global_no_reboot_before_device_command(monkeypatch):
+    args = parse(monkeypatch, "--no-reboot", "ls", "/dev/ttyACM0")
+    assert args.no_reboot is True and args.device == "/dev/ttyACM0"
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from picox import compiler
+from picox.compiler import COMPILER_VERSION, CompileCache, compile_source
+from picox.fake import FakeSerial
+from picox.upy import Pico
+
+
+SOURCE = "def total(values):\n    result = 0\n    for value in values:\n        result += value\n    return result\nprint(total([1, 2]))\n"
+
+
+@pytest.fixture
+def cache_home(tmp_path, monkeypatch):
+    """ An empty user cache directory, with no default CompileCache made yet """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(compiler, "_default_cache", None)
+    return tmp_path / "cache"
+
+
+def test_cache_key_depends_on_everything():
+    key = CompileCache.key(SOURCE, shorten_names=True)
+    assert CompileCache.key(SOURCE, shorten_names=True) == key
+    assert CompileCache.key(SOURCE + "\n", shorten_names=True) != key
+    assert CompileCache.key(SOURCE, shorten_names=False) != key
+    assert CompileCache.key(SOURCE) != key
+
+
+def test_cache_key_depends_on_compiler_version(monkeypatch):
+    key = CompileCache.key(SOURCE, shorten_names=True)
+    monkeypatch.setattr(compiler, "COMPILER_VERSION", COMPILER_VERSION + 1)
+    assert CompileCache.key(SOURCE, shorten_names=True) != key
+
+
+def test_cache_in_memory(tmp_path):
+    cache = CompileCache(tmp_path)
+    compiled = compile_source(SOURCE, shorten_names=True, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert compile_source(SOURCE, shorten_names=True, cache=cache) is compiled
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert compile_source(SOURCE, cache=cache) != compiled # Other options compile again
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_on_disk(tmp_path):
+    compiled = compile_source(SOURCE, shorten_names=True, cache=CompileCache(tmp_path))
+    assert len(list(tmp_path.glob("*.json"))) == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+    cache = CompileCache(tmp_path) # As on the next run
+    assert compile_source(SOURCE, shorten_names=True, cache=cache) == compiled
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_cache_ignores_unreadable_entries(tmp_path):
+    compiled = compile_source(SOURCE, cache=CompileCache(tmp_path))
+    (entry,) = tmp_path.glob("*.json")
+    for broken in ["{not json", json.dumps({"code": "x"})]:
+        entry.write_text(broken)
+        cache = CompileCache(tmp_path)
+        assert compile_source(SOURCE, cache=cache) == compiled
+        assert (cache.hits, cache.misses) == (0, 1)
+    cache = CompileCache(tmp_path)
+    assert compile_source(SOURCE, cache=cache) == compiled # Replaced by the good result
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_cache_unwritable_directory(tmp_path):
+    (tmp_path / "file").write_text("")
+    cache = CompileCache(tmp_path / "file" / "compile")
+    compiled = compile_source(SOURCE, cache=cache)
+    assert compile_source(SOURCE, cache=cache) is compiled # Still kept in memory
+
+
+def test_default_cache_directory(cache_home):
+    cache = compiler.default_cache()
+    assert cache.directory == cache_home / "picox" / "compile"
+    assert compiler.default_cache() is cache
+
+
+def test_run_script_uses_default_cache(tmp_path, cache_home):
+    script = tmp_path / "script.py"
+    script.write_text(SOURCE)
+    device_root = tmp_path / "device"
+    device_root.mkdir()
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(device_root, **kwargs))
+    assert list(pico.run_script(script, follow=True)) == ["3"]
+    assert list(pico.run_script(script, follow=True)) == ["3"]
+    pico.close()
+    cache = compiler.default_cache()
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(list((cache_home / "picox" / "compile").glob("*.json"))) == 1
@@ -0,0 +1,165 @@
+import re
+import socket
+import threading
+import time
+
+from picox.console import ConsoleCapture, ConsoleMultiplexer, RotatingFileSink
+from picox.fake import FakeSerial, SocketDevice
+from picox.upy import Pico
+
+STAMP = r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3} "
+
+
+class Sink:
+    def __init__(self):
+        self.text = ""
+        self.flushes = 0
+
+    def write(self, text):
+        self.text += text
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_utf8_split_across_reads():
+    sink = Sink()
+    capture = ConsoleCapture([sink])
+    data = "température: 21°C ✓\r\nnext".encode("utf-8")
+    written = [capture.feed(data[index:index + 1]) for index in range(len(data))]
+    assert "".join(written) == sink.text == "température: 21°C ✓\r\nnext"
+    assert "\ufffd" not in sink.text
+    assert capture.bytes_received == len(data) and capture.lines_received == 1
+    assert capture.recent() == ["température: 21°C ✓", "next"]
+
+
+def test_close_flushes_an_unfinished_character():
+    sink = Sink()
+    capture = ConsoleCapture([sink])
+    capture.feed("ok°".encode("utf-8")[:-1])
+    assert sink.text == "ok"
+    capture.close()
+    assert sink.text == "ok\ufffd"
+
+
+def test_timestamps_once_per_line():
+    sink = Sink()
+    capture = ConsoleCapture([sink], timestamps=True)
+    capture.feed(b"first ")
+    capture.feed(b"part\r\nsecond\r\n")
+    capture.feed(b"third")
+    lines = sink.text.split("\n")
+    assert re.fullmatch(STAMP + "first part\r", lines[0])
+    assert re.fullmatch(STAMP + "second\r", lines[1])
+    assert re.fullmatch(STAMP + "third", lines[2])
+    assert capture.recent() == ["first part", "second", "third"] # Stamps only go to the sinks
+
+
+def test_ring_buffer_is_bounded():
+    capture = ConsoleCapture(ring_lines=3)
+    capture.feed("".join(f"line {index}\n" for index in range(10)).encode())
+    assert capture.recent() == ["line 7", "line 8", "line 9"]
+    assert capture.lines_received == 10
+
+
+def test_rotating_file_sink(tmp_path):
+    path = tmp_path / "console.log"
+    path.write_text("old\n")
+    sink = RotatingFileSink(path, max_bytes=10, backups=2)
+    for index in range(4):
+        sink.write(f"line {index}\n") # 7 bytes each
+    sink.close()
+    assert path.read_text() == "line 3\n"
+    assert (tmp_path / "console.log.1").read_text() == "line 1\nline 2\n"
+    assert (tmp_path / "console.log.2").read_text() == "old\nline 0\n" # Appended to the existing file
+    assert not (tmp_path / "console.log.3").exists()
+
+    sink = RotatingFileSink(path, max_bytes=10, backups=2)
+    sink.write("line 4\n")
+    sink.close()
+    assert (tmp_path / "console.log.2").read_text() == "line 1\nline 2\n" # Oldest dropped
+
+
+def test_rotating_file_sink_without_backups(tmp_path):
+    path = tmp_path / "console.log"
+    sink = RotatingFileSink(path, max_bytes=10, backups=0)
+    for index in range(3):
+        sink.write(f"line {index}\n")
+    sink.close()
+    assert path.read_text() == "line 2\n"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_capture_device_console(tmp_path):
+    (tmp_path / "job.py").write_text("for index in range(3):\n    print('reading', index, '°C')\n")
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs))
+    pico.execute_file("job.py")
+    sink = Sink()
+    capture = ConsoleCapture([sink])
+    for data in pico.read_console():
+        capture.feed(data)
+        if capture.lines_received >= 4:
+            break
+    assert capture.recent()[1:4] == ["reading 0 °C", "reading 1 °C", "reading 2 °C"] # After the echoed command
+    pico.close()
+
+
+def test_multiplexer_interleaves_whole_lines():
+    pairs = {name: socket.socketpair() for name in ("a", "b")}
+    output = Sink()
+    multiplexer = ConsoleMultiplexer(output)
+    captures = {name: ConsoleCapture() for name in pairs}
+    for name, (device_end, host_end) in pairs.items():
+        multiplexer.add(name, host_end.fileno(), captures[name], tag=None if name == "a" else "B| ")
+    reports = []
+    thread = threading.Thread(target=multiplexer.run, kwargs={"report_interval": 0.05, "on_report": reports.append})
+    thread.start()
+
+    pairs["a"][0].sendall(b"start of ")
+    time.sleep(0.1)
+    pairs["b"][0].sendall(b"b line 1\nb line 2\n")
+    time.sleep(0.1)
+    pairs["a"][0].sendall(b"a line\nunfinished")
+    time.sleep(0.1)
+    for device_end, _ in pairs.values():
+        device_end.close()
+    thread.join(5)
+    assert not thread.is_alive() # Returns once every device has disconnected
+
+    assert output.text.splitlines() == ["B| b line 1", "B| b line 2", "[a] start of a line", "[a] unfinished"]
+    assert captures["a"].recent() == ["start of a line", "unfinished"]
+
+    assert {rate.device for rate in reports[0]} == {"a", "b"} # Reported while running
+    for _, host_end in pairs.values():
+        host_end.close()
+
+
+def test_multiplexer_rates():
+    device_end, host_end = socket.socketpair()
+    multiplexer = ConsoleMultiplexer()
+    capture = ConsoleCapture()
+    multiplexer.add("pico", host_end.fileno(), capture)
+    device_end.sendall(b"one\ntwo\n")
+    multiplexer._read(multiplexer._consoles[host_end.fileno()])
+    assert multiplexer.rates(2.0) == [("pico", 4.0, 1.0, 8, 2)]
+    assert multiplexer.rates(1.0) == [("pico", 0.0, 0.0, 8, 2)] # Only traffic since the last report
+    device_end.close()
+    host_end.close()
+
+
+def test_multiplexer_with_fake_devices(tmp_path):
+    output = Sink()
+    multiplexer = ConsoleMultiplexer(output)
+    with SocketDevice(tmp_path) as first, SocketDevice(tmp_path) as second:
+        multiplexer.add("first", first.fileno(), ConsoleCapture())
+        multiplexer.add("second", second.fileno(), ConsoleCapture())
+        first.device.feed(b"print('from first')\r")
+        second.device.feed(b"print('from second')\r")
+        thread = threading.Thread(target=multiplexer.run)
+        thread.start()
+        time.sleep(0.2)
+        first.host_socket.shutdown(socket.SHUT_RDWR)
+        second.host_socket.shutdown(socket.SHUT_RDWR)
+        thread.join(5)
+    lines = output.text.splitlines()
+    assert "[first] from first" in lines and "[second] from second" in lines
@@ -0,0 +1,146 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from picox.daemon import socket_path
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "getuid"), reason="Unix sockets only")
+
+
+@pytest.fixture
+def fallback_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    return tmp_path / f"picox-{os.getuid()}"
+
+
+def test_fallback_directory_is_private(fallback_dir):
+    path = socket_path("/dev/ttyACM0")
+    assert path.parent == fallback_dir
+    assert fallback_dir.stat().st_mode & 0o777 == 0o700
+
+
+def test_fallback_directory_symlink_is_refused(fallback_dir, tmp_path):
+    target = tmp_path / "elsewhere"
+    target.mkdir(mode=0o700)
+    fallback_dir.symlink_to(target)
+    with pytest.raises(PermissionError):
+        socket_path("/dev/ttyACM0")
+
+
+def test_fallback_directory_shared_is_refused(fallback_dir):
+    fallback_dir.mkdir()
+    fallback_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        socket_path("/dev/ttyACM0")
+
+
+@pytest.fixture
+def serve():
+    """ Serve a Pico from a daemon thread, returns a client for it """
+    from picox.daemon import DaemonClient, PicoDaemon
+
+    daemons = []
+    def start(pico):
+        path = Path(tempfile.mkdtemp()) / "picox.sock" # Socket paths must be short
+        daemon = PicoDaemon(pico, path)
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        daemons.append((daemon, thread))
+        while not path.exists():
+            time.sleep(0.01)
+        return DaemonClient(path)
+    yield start
+    for daemon, thread in daemons:
+        daemon.shutdown()
+        thread.join()
+
+
+@pytest.fixture
+def daemon_client(serve, tmp_path):
+    from picox.fake import FakeSerial
+    from picox.upy import Pico
+
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs))
+    yield serve(pico), tmp_path
+    pico.close()
+
+
+class ChunkedFile(io.BytesIO):
+    """ Records the size of each read """
+    def __init__(self, data: bytes = b''):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+def test_upload_streams_the_file(daemon_client):
+    client, device_root = daemon_client
+    data = os.urandom(20_000)
+    local = ChunkedFile(data)
+    assert client.upload_file(local, "data.bin", chunk_size=1024, timeout=30, idle_timeout=5) == len(data)
+    assert (device_root / "data.bin").read_bytes() == data
+    assert -1 not in local.reads and max(local.reads) <= 1024
+
+
+def test_download_streams_the_file(daemon_client):
+    client, device_root = daemon_client
+    data = os.urandom(20_000)
+    (device_root / "data.bin").write_bytes(data)
+    saved = io.BytesIO()
+    assert client.download_file("data.bin", saved, binary=True, timeout=30) == len(data)
+    assert saved.getvalue() == data
+
+    (device_root / "text.txt").write_text("line 1\nline 2\n")
+    saved = io.StringIO()
+    client.download_file("text.txt", saved)
+    assert saved.getvalue() == "line 1\nline 2\n"
+
+
+def test_resumed_transfers(daemon_client):
+    client, device_root = daemon_client
+    data = os.urandom(20_000)
+    (device_root / "data.bin").write_bytes(data[:5000])
+    assert client.upload_file(io.BytesIO(data), "data.bin", resume=True) == len(data) - 5000
+    assert (device_root / "data.bin").read_bytes() == data
+
+    saved = io.BytesIO(data[:7000])
+    assert client.download_file("data.bin", saved, binary=True, resume=True) == len(data) - 7000
+    assert saved.getvalue() == data
+
+
+def test_missing_file_error_is_forwarded(daemon_client):
+    client, _ = daemon_client
+    with pytest.raises(FileNotFoundError):
+        client.download_file("missing.bin", io.BytesIO(), binary=True)
+
+
+def test_streaming_over_a_serial_port(serve, tmp_path):
+    from picox.fake import PtyDevice
+    from picox.upy import Pico
+
+    data = os.urandom(20_000)
+    with PtyDevice(tmp_path) as device:
+        pico = Pico(device.path)
+        try:
+            client = serve(pico)
+            progress = []
+            assert client.upload_file(ChunkedFile(data), "data.bin", chunk_size=1024,
+                                      progress_callback=lambda done, total: progress.append(done)) == len(data)
+            assert (tmp_path / "data.bin").read_bytes() == data
+            assert progress[-1] == len(data) and progress == sorted(progress)
+
+            saved = ChunkedFile()
+            assert client.download_file("data.bin", saved, binary=True, timeout=30) == len(data)
+            assert saved.getvalue() == data
+            assert client.get_file_list() == ["data.bin"]
+        finally:
+            pico.close()
@@ -0,0 +1,107 @@
+import io
+import os
+import time
+
+import pytest
+
+from picox import deadline
+from picox.deadline import ResponseDeadline
+from picox.exceptions import RemotePicoException, ResponseTimeout
+from picox.fake import FakeSerial
+from picox.upy import Pico, ReplMode
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(deadline.time, "monotonic", clock)
+    return clock
+
+
+def test_deadline_without_limits(clock):
+    limits = ResponseDeadline(read_timeout=15)
+    assert limits.read_timeout() == 15
+    clock.now += 1000
+    assert not limits.expired
+    assert ResponseDeadline().read_timeout() is None
+
+
+def test_deadline_cuts_reads_short(clock):
+    limits = ResponseDeadline(timeout=2, read_timeout=15)
+    assert limits.read_timeout() == 2
+    clock.now += 1.5
+    assert limits.read_timeout() == pytest.approx(0.5)
+    assert not limits.expired
+    clock.now += 1
+    assert limits.read_timeout() == 0
+    assert limits.expired
+
+
+def test_idle_timeout(clock):
+    limits = ResponseDeadline(timeout=2, idle_timeout=0.5, read_timeout=15)
+    assert limits.read_timeout() == 0.5
+    clock.now += 1.8
+    assert limits.read_timeout() == pytest.approx(0.2)
+    assert ResponseDeadline(idle_timeout=0.5, read_timeout=15).read_timeout() == 0.5
+    assert ResponseDeadline(timeout=2).read_timeout() == 2
+
+
+@pytest.fixture(params=[ReplMode.FRIENDLY, ReplMode.RAW], ids=lambda mode: mode.value)
+def pico(request, tmp_path):
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs), repl_mode=request.param)
+    yield pico
+    pico.close()
+
+
+def test_command_timeout(pico):
+    started = time.monotonic()
+    with pytest.raises(ResponseTimeout):
+        pico.run_python_command("while True:\n    pass", timeout=0.3)
+    assert time.monotonic() - started < 2
+    # Interrupted, the session can still be used with the usual read timeout
+    assert pico.run_python_command("print(1 + 1)") == "2"
+    assert pico._serial.timeout == 15
+
+
+def test_command_idle_timeout_keeps_partial_output(pico):
+    started = time.monotonic()
+    with pytest.raises(ResponseTimeout) as raised:
+        pico.run_python_command("import time; print('started'); time.sleep(10)", idle_timeout=0.3)
+    assert time.monotonic() - started < 2
+    assert raised.value.partial_output.strip() == "started"
+    assert pico.run_python_command("print(1 + 1)") == "2"
+
+
+def test_slow_output_within_idle_timeout(pico):
+    command = r"exec('import time\nfor i in range(3):\n time.sleep(0.2)\n print(i)')"
+    assert pico.run_python_command(command, idle_timeout=1).split() == ["0", "1", "2"]
+
+
+def test_traceback_ends_the_response(pico):
+    started = time.monotonic()
+    with pytest.raises(RemotePicoException) as raised:
+        pico.run_python_command("print('before')\nraise ValueError('bad reading')", timeout=10)
+    assert "ValueError: bad reading" in raised.value.remote_exception
+    assert time.monotonic() - started < 1 # Did not wait for the timeout or the read timeout
+    assert pico.run_python_command("print(1 + 1)") == "2"
+
+
+@pytest.mark.parametrize("mode", [ReplMode.FRIENDLY, ReplMode.RAW], ids=lambda mode: mode.value)
+def test_transfer_timeout(tmp_path, mode):
+    (tmp_path / "data.bin").write_bytes(os.urandom(20_000))
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, bytes_per_second=10_000, **kwargs),
+                repl_mode=mode)
+    saved = io.BytesIO()
+    with pytest.raises(ResponseTimeout):
+        pico.download_file("data.bin", saved, binary=True, block_size=512, timeout=0.5)
+    assert 0 < len(saved.getvalue()) < 20_000 # The whole download takes about 3 s
+    assert pico.run_python_command("print(1 + 1)") == "2"
+    pico.close()
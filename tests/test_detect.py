@@ -0,0 +1,104 @@
+import time
+
+from picox import detect
+from picox.detect import DetectionCache, UsbPort
+from picox.fake import FakeSerial
+
+
+def test_macos_dial_in_duplicate_is_not_probed(monkeypatch, tmp_path):
+    port = UsbPort("/dev/cu.usbmodem1101", 0x1234, 0x0001, "E660", "Board", "Vendor")
+    monkeypatch.setattr(detect, "list_usb_ports", lambda sysfs_root=None: [port])
+    monkeypatch.setattr(detect, "get_serial_ports", lambda: ["/dev/tty.usbmodem1101", "/dev/tty.usbserial-1"])
+    probed = []
+    monkeypatch.setattr(detect, "is_pico", lambda device, reboot=True, deadline=None: probed.append(device) or device == port.device)
+
+    detected = detect.detect_picos(cache=DetectionCache(tmp_path / "detect.json"))
+
+    assert detected == ["/dev/cu.usbmodem1101"]
+    assert sorted(probed) == ["/dev/cu.usbmodem1101", "/dev/tty.usbserial-1"]
+
+
+class SilentSerial:
+    """ A port with something on it that never answers """
+    def __init__(self, port, timeout=None, **kwargs):
+        self.port = port
+        self.timeout = timeout
+        self.in_waiting = 0
+        self.closed = False
+
+    def read(self, size=1):
+        time.sleep(self.timeout if self.timeout is not None else 60)
+        return b''
+
+    def write(self, data):
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_probe_deadline_starts_with_each_probe(monkeypatch, tmp_path):
+    opened = []
+
+    def open_port(port, **kwargs):
+        opened.append(FakeSerial(tmp_path, port=port, **kwargs) if port == "pico" else SilentSerial(port, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(detect.serial, "Serial", open_port)
+    ports = [f"silent{index}" for index in range(6)] + ["pico"]
+    start = time.monotonic()
+    # The Pico only starts probing once three rounds of silent ports have used up their deadline each
+    assert detect.probe_ports(ports, max_workers=2, deadline=0.5) == ["pico"]
+    assert time.monotonic() - start < 0.5 * 4 + 1
+    assert all(port.closed for port in opened if isinstance(port, SilentSerial))
+
+
+def add_tty(sysfs, tty, vid=None, pid=None, serial_number=None, manufacturer=None):
+    """ A ttyACM entry linked to the USB interface of a device with these descriptors """
+    usb_device = sysfs / "devices" / "usb1" / f"1-{tty[-1]}"
+    interface = usb_device / f"1-{tty[-1]}:1.0"
+    interface.mkdir(parents=True)
+    for name, value in (("idVendor", vid), ("idProduct", pid), ("serial", serial_number), ("manufacturer", manufacturer)):
+        if value is not None:
+            (usb_device / name).write_text(value + "\n")
+    (sysfs / "class" / "tty" / tty).mkdir(parents=True)
+    (sysfs / "class" / "tty" / tty / "device").symlink_to(interface)
+
+
+def test_sysfs_descriptors(tmp_path):
+    add_tty(tmp_path, "ttyACM0", "2e8a", "0005", "E6614C311B", "MicroPython")
+    add_tty(tmp_path, "ttyACM1", "10c4", "ea60", "0001", "Silicon Labs")
+    (tmp_path / "class" / "tty" / "ttyACM2").mkdir() # Not a USB device
+    (tmp_path / "class" / "tty" / "ttyS0").mkdir(parents=True, exist_ok=True)
+
+    ports = detect.list_usb_ports(sysfs_root=tmp_path)
+
+    assert ports == [
+        UsbPort("/dev/ttyACM0", 0x2E8A, 0x0005, "E6614C311B", None, "MicroPython"),
+        UsbPort("/dev/ttyACM1", 0x10C4, 0xEA60, "0001", None, "Silicon Labs"),
+    ]
+    assert [detect.is_micropython_rp2040(port) for port in ports] == [True, False]
+
+
+def test_sysfs_detection_probes_only_unknown_ports(monkeypatch, tmp_path):
+    sysfs = tmp_path / "sys"
+    add_tty(sysfs, "ttyACM0", "2e8a", "0005", "E6614C311B", "MicroPython")
+    add_tty(sysfs, "ttyACM1", "10c4", "ea60", "0001", "Silicon Labs")
+    add_tty(sysfs, "ttyACM2", "2e8a", "000a", "E6614C3122", "Raspberry Pi") # RP2040 running C firmware
+    probed = []
+    monkeypatch.setattr(detect, "is_pico", lambda device, reboot=True, deadline=None: probed.append(device) or False)
+    cache = DetectionCache(tmp_path / "detect.json")
+
+    assert detect.detect_picos(cache=cache, sysfs_root=sysfs) == ["/dev/ttyACM0"]
+    assert sorted(probed) == ["/dev/ttyACM1", "/dev/ttyACM2"]
+
+    # Probe results are cached by serial number, nothing is probed the second time
+    probed.clear()
+    assert detect.detect_picos(cache=DetectionCache(tmp_path / "detect.json"), sysfs_root=sysfs) == ["/dev/ttyACM0"]
+    assert probed == []
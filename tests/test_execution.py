@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from picox import compiler
+from picox.compiler import compile_command
+from picox.fake import FakeSerial
+from picox.upy import Pico, ReplMode
+
+
+@pytest.fixture(params=[ReplMode.FRIENDLY, ReplMode.RAW], ids=lambda mode: mode.value)
+def pico(request, tmp_path):
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs), repl_mode=request.param)
+    yield pico
+    pico.close()
+
+
+@pytest.mark.parametrize("mode", [ReplMode.FRIENDLY, ReplMode.RAW], ids=lambda mode: mode.value)
+def test_run_script_keeps_asserts(tmp_path, monkeypatch, mode):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(compiler, "_default_cache", None)
+    script = tmp_path / "test_device.py"
+    script.write_text("print('checking')\nassert 1 == 2, 'maths is broken'\nprint('passed')\n")
+    device_root = tmp_path / "device"
+    device_root.mkdir()
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(device_root, **kwargs), repl_mode=mode)
+    execution = pico.run_script(script, follow=True)
+    assert list(execution) == ["checking"]
+    assert execution.result.error == "AssertionError: maths is broken"
+    pico.close()
+
+
+def test_raw_commands_strip_asserts():
+    assert "assert" not in compile_command("assert {path}\nprint({path})\n").command_str
+
+
+def test_follow_streams_output(pico, tmp_path):
+    (tmp_path / "job.py").write_text("import time\nprint('first')\ntime.sleep(0.5)\nprint('second')\n")
+    started = time.monotonic()
+    execution = pico.execute_file("job.py", follow=True, idle_timeout=5)
+    lines = iter(execution)
+    assert next(lines) == "first"
+    assert time.monotonic() - started < 0.4 # Before the file finished
+    assert list(lines) == ["second"]
+    assert execution.result.ok and execution.result.traceback is None
+    assert execution.result.duration >= 0.5
+
+
+def test_follow_reports_traceback(pico, tmp_path):
+    (tmp_path / "job.py").write_text("def check():\n    raise ValueError('bad reading')\nprint('before')\ncheck()\n")
+    execution = pico.execute_file("job.py", follow=True)
+    assert list(execution) == ["before"]
+    assert execution.result.error == "ValueError: bad reading"
+    assert execution.result.traceback.startswith("Traceback")
+    assert list(execution) == [] # Already finished
+    assert pico.run_python_command("print(1 + 1)") == "2"
+
+
+def test_follow_system_exit_is_ok(pico, tmp_path):
+    (tmp_path / "job.py").write_text("import sys\nprint('leaving')\nsys.exit(1)\nprint('not reached')\n")
+    execution = pico.execute_file("job.py", follow=True)
+    assert execution.wait().ok
+    assert list(execution) == []
+
+
+def test_follow_idle_timeout_interrupts(pico, tmp_path):
+    (tmp_path / "job.py").write_text("import time\nprint('waiting')\nwhile True:\n    time.sleep(0.01)\n")
+    execution = pico.execute_file("job.py", follow=True, idle_timeout=0.3)
+    lines = iter(execution)
+    assert next(lines) == "waiting"
+    with pytest.raises(IOError):
+        next(lines)
+    assert pico.run_python_command("print(1 + 1)") == "2"
+
+
+def test_command_size_counts_the_wrapper_apart():
+    compiled = compile_command("print({path})\n")
+    assert compiled.compiled_size - compiled.wrapper_size == len("print({path})")
+    assert compile_command("x = 1\nprint(x)\n").wrapper_size == compiled.wrapper_size
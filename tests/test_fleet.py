@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from picox.fake import FakeSerial
+from picox.fleet import PicoFleet, format_results
+from picox.upy import Pico
+
+
+@pytest.fixture
+def roots(tmp_path):
+    roots = {}
+    for name in ("pico-a", "pico-b", "pico-c"):
+        roots[name] = tmp_path / name
+        roots[name].mkdir()
+    return roots
+
+
+def fleet_of(roots, devices=None, **kwargs) -> PicoFleet:
+    def pico_factory(device):
+        if device not in roots:
+            raise IOError(f"could not open port {device}")
+        return Pico(device, serial_factory=lambda **serial_kwargs: FakeSerial(roots[device], **serial_kwargs))
+    return PicoFleet(devices or list(roots), pico_factory=pico_factory, **kwargs)
+
+
+def test_results_in_device_order(roots):
+    results = fleet_of(roots, ["pico-c", "missing", "pico-a"]).run_python_command("import os; print(os.getcwd())")
+    assert [result.device for result in results] == ["pico-c", "missing", "pico-a"]
+    assert [result.ok for result in results] == [True, False, True]
+    assert results[0].value == "/"
+    assert results[1].error == "OSError: could not open port missing"
+
+    table = format_results(results).splitlines()
+    assert table[0].split() == ["DEVICE", "STATUS", "SECONDS", "BYTES", "ERROR"]
+    assert table[2].split()[:2] == ["missing", "failed"]
+    assert table[2].endswith("OSError: could not open port missing")
+
+
+def test_devices_run_concurrently(roots):
+    started = time.monotonic()
+    results = fleet_of(roots).run_python_command("import time; time.sleep(0.5)")
+    assert all(result.ok for result in results)
+    assert time.monotonic() - started < 1.2
+
+
+def test_upload_and_sync(roots, tmp_path):
+    local = tmp_path / "local"
+    (local / "lib").mkdir(parents=True)
+    (local / "main.py").write_bytes(b"print('main')\n" * 200)
+    (local / "lib" / "util.py").write_bytes(b"VALUE = 1\n")
+    (roots["pico-b"] / "main.py").write_bytes(b"old")
+
+    results = fleet_of(roots).upload_file(local / "main.py", "main.py")
+    assert [result.ok for result in results] == [True, False, True]
+    assert "FileExistsError" in results[1].error
+    assert results[0].bytes == len((local / "main.py").read_bytes())
+
+    results = fleet_of(roots).sync(local)
+    assert all(result.ok for result in results)
+    assert [result.bytes for result in results] == [10, 2810, 10]
+    for root in roots.values():
+        assert (root / "main.py").read_bytes() == (local / "main.py").read_bytes()
+        assert (root / "lib" / "util.py").read_bytes() == b"VALUE = 1\n"
+
+
+def test_execute_file_follow(roots):
+    for name, root in roots.items():
+        (root / "job.py").write_text("print('working')\nraise ValueError('bad board')\n" if name == "pico-b" else
+                                     "print('working')\nprint('done')\n")
+    results = fleet_of(roots).execute_file("job.py", follow=True, idle_timeout=5)
+    assert results[0].value == ["working", "done"]
+    assert not results[1].ok and "ValueError: bad board" in results[1].error
@@ -0,0 +1,115 @@
+import io
+
+import pytest
+
+from picox.fake import FakeSerial
+from picox.fs import FileEntry, MetadataCache, parse_stat_line, parse_walk_line
+from picox.upy import Pico, ReplMode
+
+MODES = [(ReplMode.FRIENDLY, False), (ReplMode.RAW, False), (ReplMode.FRIENDLY, True), (ReplMode.RAW, True)]
+
+
+@pytest.fixture(params=MODES, ids=["friendly", "raw", "friendly-agent", "raw-agent"])
+def pico(request, tmp_path):
+    mode, agent = request.param
+    (tmp_path / "lib" / "drivers").mkdir(parents=True)
+    (tmp_path / "main.py").write_bytes(b"x" * 120)
+    (tmp_path / "lib" / "helpers.py").write_bytes(b"y" * 30)
+    (tmp_path / "lib" / "drivers" / "a b.py").write_bytes(b"")
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs), repl_mode=mode, use_agent=agent)
+    yield pico
+    pico.close()
+
+
+def test_parse_walk_line():
+    assert parse_walk_line("F 120 /main.py") == FileEntry("/main.py", False, 120)
+    assert parse_walk_line("D 0 /lib/with space") == FileEntry("/lib/with space", True, 0)
+    with pytest.raises(ValueError):
+        parse_walk_line("X 1 /main.py")
+    with pytest.raises(ValueError):
+        parse_walk_line("Traceback (most recent call last):")
+
+
+def test_parse_stat_line():
+    assert parse_stat_line("-", "/missing") is None
+    assert parse_stat_line("F 7", "/a.txt") == FileEntry("/a.txt", False, 7)
+
+
+def test_walk_recursive(pico):
+    entries = sorted(pico.walk("/lib"))
+    assert entries == [
+        FileEntry("/lib/drivers", True, 0),
+        FileEntry("/lib/drivers/a b.py", False, 0),
+        FileEntry("/lib/helpers.py", False, 30),
+    ]
+
+
+def test_walk_top_level(pico):
+    entries = {entry.path: entry for entry in pico.walk("/", recursive=False)}
+    assert entries["/main.py"] == FileEntry("/main.py", False, 120)
+    assert entries["/lib"].is_dir
+    assert not any(path.startswith("/lib/") for path in entries)
+
+
+def test_stat(pico):
+    assert pico.stat("main.py") == FileEntry("main.py", False, 120)
+    assert pico.stat("/lib").is_dir
+    assert pico.stat("/missing.py") is None
+
+
+def test_metadata_cache_records_changes():
+    cache = MetadataCache()
+    assert cache.get_listing() is None
+    cache.set_listing(["main.py", "lib"])
+    cache.set_stat("/lib/helpers.py", FileEntry("/lib/helpers.py", False, 30))
+
+    cache.record_write("new.py", 5)
+    assert cache.get_listing() == ["main.py", "lib", "new.py"]
+    assert cache.lookup_stat("/new.py") == (True, FileEntry("new.py", False, 5))
+
+    cache.record_delete("/lib")
+    assert cache.get_listing() == ["main.py", "new.py"]
+    assert cache.lookup_stat("lib") == (True, None)
+    assert cache.lookup_stat("/lib/helpers.py") == (False, None)
+
+    cache.forget("/new.py")
+    assert cache.get_listing() is None
+    assert (cache.hits, cache.misses) == (4, 3)
+
+
+@pytest.fixture
+def cached_pico(tmp_path):
+    (tmp_path / "main.py").write_bytes(b"x" * 120)
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs), cache_metadata=True)
+    yield pico, tmp_path
+    pico.close()
+
+
+def test_session_cache_hits(cached_pico):
+    pico, _ = cached_pico
+    assert pico.get_file_list() == pico.get_file_list()
+    assert pico.stat("/main.py") == pico.stat("main.py")
+    assert (pico.metadata_cache.hits, pico.metadata_cache.misses) == (2, 2)
+
+
+def test_session_cache_follows_picox_writes(cached_pico):
+    pico, root = cached_pico
+    pico.get_file_list()
+    pico.upload_file(io.BytesIO(b"abc"), "new.py")
+    pico.create_directory("lib")
+    misses = pico.metadata_cache.misses
+    assert sorted(pico.get_file_list()) == ["lib", "main.py", "new.py"]
+    assert pico.stat("/new.py") == FileEntry("new.py", False, 3)
+    pico.remove_file("main.py")
+    assert pico.stat("/main.py") is None
+    assert sorted(pico.get_file_list()) == sorted(path.name for path in root.iterdir())
+    assert pico.metadata_cache.misses == misses
+
+
+def test_session_cache_cleared_by_user_code(cached_pico):
+    pico, _ = cached_pico
+    assert pico.get_file_list() == ["main.py"]
+    assert pico.stat("/other.py") is None
+    pico.run_python_command("open('other.py', 'w').write('1')")
+    assert sorted(pico.get_file_list()) == ["main.py", "other.py"]
+    assert pico.stat("/other.py") == FileEntry("/other.py", False, 1)
@@ -0,0 +1,157 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+
+from picox.exceptions import RemotePicoException
+from picox.fake import FakeSerial
+from picox.profiling import DETAIL_LENGTH, Profiler, ProtocolCounters, ProtocolStats
+from picox.upy import Pico, ReplMode
+
+
+def test_protocol_counters():
+    counters = ProtocolCounters()
+    counters.wrote(10, 1.0, 1.1, echoed=True)
+    counters.received(4, 1, 1.5)  # First byte of the reply
+    counters.received(6, 1, 1.7)
+    counters.received(0, 1, 2.7)  # Timed out
+    counters.wrote(5, 3.0, 3.2)
+    counters.received(0, 0, 3.3)  # Nothing waiting, not a timeout
+    stats = counters.snapshot()
+    assert stats.write_seconds == pytest.approx(0.3)
+    assert stats.device_seconds == pytest.approx(0.4)
+    assert stats.read_seconds == pytest.approx(0.2)
+    assert (stats.bytes_sent, stats.bytes_received, stats.echo_bytes, stats.round_trips, stats.timeouts) == \
+        (15, 10, 10, 1, 1)
+
+    counters.received(2, 1, 3.6)
+    counters.received(2, 1, 3.8)
+    later = counters.snapshot()
+    assert later.since(stats) == pytest.approx(ProtocolStats(0.0, 0.4, 0.2, 0, 4, 0, 1, 0))
+
+
+class Span:
+    def __init__(self, name, spans):
+        self.name = name
+        self.attributes = {}
+        spans.append(self)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class Tracer:
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def start_as_current_span(self, name):
+        yield Span(name, self.spans)
+
+
+def test_profiler_operations():
+    finished = []
+    tracer = Tracer()
+    profiler = Profiler(on_operation=finished.append, tracer=tracer)
+    counters = ProtocolCounters()
+    with profiler.operation("upload_file", "COM1", counters, "x" * 100):
+        with profiler.operation("communicate", "COM1", counters, "print(1)"):
+            counters.wrote(8, 0.0, 0.1)
+    with pytest.raises(ValueError):
+        with profiler.operation("stat", "COM1", counters):
+            raise ValueError("bad path\nsecond line")
+
+    assert [record.name for record in finished] == ["communicate", "upload_file", "stat"]
+    assert profiler.records == finished
+    communicate, upload, stat = finished
+    assert (upload.depth, communicate.depth, stat.depth) == (0, 1, 0)
+    assert upload.detail == "x" * DETAIL_LENGTH + "..."
+    assert upload.stats.bytes_sent == communicate.stats.bytes_sent == 8
+    assert stat.stats.bytes_sent == 0
+    assert (upload.error, stat.error) == (None, "ValueError: bad path")
+    assert [span.name for span in tracer.spans] == ["picox.upload_file", "picox.communicate", "picox.stat"]
+    assert tracer.spans[0].attributes["picox.bytes_sent"] == 8
+    assert "picox.error" not in tracer.spans[0].attributes
+    assert tracer.spans[2].attributes["picox.error"] == "ValueError: bad path"
+
+
+def test_profiler_without_records(tmp_path):
+    finished = []
+    profiler = Profiler(on_operation=finished.append, keep_records=False)
+    with profiler.operation("stat", "COM1", ProtocolCounters()):
+        pass
+    assert len(finished) == 1 and profiler.records == []
+
+
+def test_write_json(tmp_path):
+    profiler = Profiler()
+    counters = ProtocolCounters()
+    with profiler.operation("upload_file", "COM1", counters, "main.py"):
+        with profiler.operation("communicate", "COM1", counters):
+            pass
+    profiler.write_json(tmp_path / "profile.json", command="upload")
+    profile = json.loads((tmp_path / "profile.json").read_text())
+    assert profile["command"] == "upload"
+    # In the order they started
+    assert [operation["name"] for operation in profile["operations"]] == ["upload_file", "communicate"]
+    assert {"bytes_sent", "host_seconds", "depth", "detail"} <= set(profile["operations"][0])
+
+
+@pytest.fixture(params=[ReplMode.FRIENDLY, ReplMode.RAW], ids=lambda mode: mode.value)
+def profiled(request, tmp_path):
+    (tmp_path / "main.py").write_text("print('hello')\n")
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "util.py").write_text("")
+    profiler = Profiler()
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs), repl_mode=request.param,
+                profiler=profiler)
+    profiler.records.clear() # Connecting
+    yield pico, profiler, request.param
+    pico.close()
+
+
+def test_pico_operations(profiled):
+    pico, profiler, mode = profiled
+    before = pico.protocol_stats
+    assert pico.run_python_command("print(1 + 1)") == "2"
+    communicate, command = profiler.records
+    assert (command.name, command.depth, command.detail, command.error) == \
+        ("run_python_command", 0, "print(1 + 1)", None)
+    assert (communicate.name, communicate.depth) == ("communicate", 1)
+    assert command.stats.round_trips >= 1 and command.stats.bytes_received > 0
+    assert command.stats.bytes_sent == communicate.stats.bytes_sent > len("print(1 + 1)")
+    assert (command.stats.echo_bytes > 0) == (mode is ReplMode.FRIENDLY)
+    assert pico.protocol_stats.since(before).bytes_sent == command.stats.bytes_sent
+
+
+def test_pico_operation_errors(profiled):
+    pico, profiler, _ = profiled
+    with pytest.raises(RemotePicoException):
+        pico.run_python_command("raise ValueError('bad')")
+    assert profiler.records[-1].name == "run_python_command"
+    assert profiler.records[-1].error.startswith("RemotePicoException")
+
+
+def test_pico_streaming_operations(profiled):
+    pico, profiler, _ = profiled
+    entries = list(pico.walk("/"))
+    assert {entry.path for entry in entries} >= {"/main.py", "/lib/util.py"}
+    lines, walk = profiler.records
+    assert (walk.name, walk.depth, walk.detail, walk.error) == ("walk", 0, "/", None)
+    assert (lines.name, lines.depth) == ("communicate_lines", 1)
+    assert walk.stats.bytes_received >= lines.stats.bytes_received > 0
+
+    # Recorded when the caller stops reading, without an error, and the depth is back to 0
+    for _ in pico.walk("/"):
+        break
+    assert [record.name for record in profiler.records[2:]] == ["communicate_lines", "walk"]
+    assert profiler.records[-1].error is None
+    pico.run_python_command("print(1)")
+    assert profiler.records[-1].depth == 0
+
+
+def test_pico_without_profiler(tmp_path):
+    pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(tmp_path, **kwargs))
+    assert pico.protocol_stats is None
+    assert pico.run_python_command("print(1 + 1)") == "2"
+    pico.close()
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from picox.fake import RAW_REPL_BANNER, FakeSerial
+from picox.readiness import DeviceEvent, ReadinessScanner
+from picox.upy import Pico
+
+
+def test_scanner_events():
+    scanner = ReadinessScanner()
+    assert scanner.feed(b"Traceback\r\nKeyboardInterrupt: \r\n>>") == set()
+    assert scanner.feed(b"> ") == {DeviceEvent.PROMPT}
+    assert scanner.feed(b"print(1)") == set() # Prompt only counts while it is the last thing received
+    assert scanner.feed(b"\r\nMPY: soft") == set()
+    assert scanner.feed(b" reboot\r\n" + RAW_REPL_BANNER) == {DeviceEvent.SOFT_REBOOT, DeviceEvent.RAW_PROMPT}
+    scanner.clear()
+    assert scanner.events == set()
+
+
+def connect(root, prepare=lambda fake: None, **kwargs) -> Pico:
+    def serial_factory(**serial_kwargs):
+        fake = FakeSerial(root, **serial_kwargs)
+        prepare(fake)
+        return fake
+    return Pico("FAKE", serial_factory=serial_factory, **kwargs)
+
+
+@pytest.mark.parametrize("reboot", [True, False])
+def test_ready_at_prompt(tmp_path, reboot):
+    pico = connect(tmp_path, reboot_on_connect=reboot)
+    assert pico.connect_metrics.interrupts == 1
+    assert pico.connect_metrics.ready_seconds < 0.5 # Readiness is seen, not waited for
+    assert pico.run_python_command("print(1 + 1)") == "2"
+    pico.close()
+
+
+def test_ready_after_main_runs(tmp_path):
+    (tmp_path / "main.py").write_text("while True:\n    pass\n")
+    pico = connect(tmp_path)
+    assert pico.connect_metrics.interrupts == 2 # main.py started after the reboot banner and was interrupted
+    assert pico.run_python_command("print(1 + 1)") == "2"
+    pico.close()
+
+
+def enter_raw_repl(fake: FakeSerial):
+    fake.device.feed(b"\x01")
+
+
+def start_in_raw_repl(fake: FakeSerial):
+    enter_raw_repl(fake)
+    fake.reset_input_buffer() # Banner was printed before the host opened the port
+
+
+@pytest.mark.parametrize("prepare", [enter_raw_repl, start_in_raw_repl], ids=["banner", "silent"])
+@pytest.mark.parametrize("reboot", [True, False])
+def test_ready_from_raw_repl(tmp_path, prepare, reboot):
+    started = time.monotonic()
+    pico = connect(tmp_path, prepare, reboot_on_connect=reboot)
+    assert time.monotonic() - started < 2
+    assert pico.run_python_command("print(1 + 1)") == "2"
+    pico.close()
@@ -0,0 +1,42 @@
+import pytest
+
+from picox.fake import FakeSerial
+from picox.scanner import MarkerScanner
+from picox.upy import EOR_TOKEN, Pico
+
+END = b"---END---"
+FAILED = b"---FAILED---"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 4096])
+def test_marker_split_across_reads(chunk_size):
+    response = b"x" * 5000 + END + b"next"
+    scanner = MarkerScanner([END], capacity=16)
+    for start in range(0, len(response), chunk_size):
+        scanner.feed(response[start:start + chunk_size])
+    assert scanner.done and scanner.matched_marker == END
+    assert scanner.getvalue() == b"x" * 5000 + END
+    assert b"next".startswith(scanner.remainder()) # Whatever arrived with the marker, for the next response
+
+
+def test_failed_marker_needs_echo_and_error():
+    scanner = MarkerScanner([END], failed_marker=FAILED)
+    assert not scanner.feed(b"print('" + FAILED + b"')\r\n")
+    assert scanner.feed(b"oops" + FAILED + b"\r\n")
+    assert scanner.failed
+
+
+def test_earliest_marker_wins():
+    scanner = MarkerScanner([END, b">>> "])
+    scanner.feed(b"out>>> more" + END)
+    assert scanner.matched_marker == b">>> " and scanner.remainder() == b"more" + END
+
+
+@pytest.mark.parametrize("packet_size", [1, 64, None])
+def test_serial_read_in_packets(tmp_path, packet_size):
+    fake = FakeSerial(tmp_path, packet_size=packet_size)
+    pico = Pico("FAKE", skip_stop_exec=True, skip_coms_test=True, serial_factory=lambda **kwargs: fake)
+    response = b"line\r\n" * 1000 + EOR_TOKEN.encode("utf-8") + b" "
+    fake.inject(response + b"left over")
+    assert pico._serial_read() == response[:-1]
+    pico.close()
@@ -0,0 +1,71 @@
+import pytest
+
+from picox.cli import print_sync_plan
+from picox.fake import FakeSerial
+from picox.sync import plan_sync
+from picox.upy import Pico
+
+
+@pytest.fixture
+def device_root(tmp_path):
+    root = tmp_path / "device"
+    root.mkdir()
+    return root
+
+
+@pytest.fixture
+def local_dir(tmp_path):
+    local = tmp_path / "local"
+    (local / "lib").mkdir(parents=True)
+    (local / "main.py").write_text("import lib.helpers\n")
+    (local / "lib" / "helpers.py").write_text("VALUE = 1\n")
+    return local
+
+
+def connect(device_root, **options):
+    return Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(device_root, **kwargs), **options)
+
+
+def test_plan_sync():
+    plan = plan_sync({"main.py": "a", "lib/x.py": "b"}, {"lib"}, {"main.py": "a", "old.py": "c"}, {""}, delete=True)
+    assert plan.upload == ["lib/x.py"]
+    assert plan.unchanged == ["main.py"]
+    assert plan.delete == ["old.py"]
+    assert plan.create_directories == ["lib"]
+
+
+def test_sync_uploads_changes_only(device_root, local_dir):
+    pico = connect(device_root)
+    plan = pico.sync(local_dir, "/")
+    assert sorted(plan.upload) == ["lib/helpers.py", "main.py"]
+    assert (device_root / "lib" / "helpers.py").read_text() == "VALUE = 1\n"
+
+    (local_dir / "main.py").write_text("print('changed')\n")
+    plan = pico.sync(local_dir, "/")
+    assert plan.upload == ["main.py"] and plan.unchanged == ["lib/helpers.py"]
+    pico.close()
+
+
+def test_dry_run_changes_nothing(device_root, local_dir, capsys):
+    (device_root / "stale.py").write_text("")
+    pico = connect(device_root)
+    plan = pico.sync(local_dir, "/", delete=True, dry_run=True)
+    assert plan.delete == ["stale.py"]
+    assert (device_root / "stale.py").exists() and not (device_root / "main.py").exists()
+    pico.close()
+
+    print_sync_plan(plan, "/", dry_run=True)
+    output = capsys.readouterr().out
+    assert "would upload main.py" in output and "would delete stale.py" in output
+    assert output.splitlines()[-1] == "2 to upload, 1 to delete, 0 unchanged (dry run)"
+
+
+def test_delete_keeps_the_agent(device_root, local_dir):
+    pico = connect(device_root, use_agent=True)
+    assert (device_root / "_px.py").exists()
+    (device_root / "stale.py").write_text("")
+    plan = pico.sync(local_dir, "/", delete=True)
+    assert plan.delete == ["stale.py"]
+    assert (device_root / "_px.py").exists() and not (device_root / "stale.py").exists()
+    assert pico.run_python_command("import _px; print(_px.VERSION)")
+    pico.close()
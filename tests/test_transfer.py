@@ -0,0 +1,101 @@
+import io
+import os
+
+import pytest
+
+from picox.fake import FakeSerial
+from picox.upy import Pico, ReplMode
+
+MODES = [(ReplMode.FRIENDLY, False), (ReplMode.RAW, False), (ReplMode.FRIENDLY, True), (ReplMode.RAW, True)]
+
+
+def connect(root, mode, agent, **fake_options):
+    return Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(root, **fake_options, **kwargs),
+                repl_mode=mode, use_agent=agent)
+
+
+@pytest.mark.parametrize("mode, agent", MODES, ids=lambda value: getattr(value, "value", "agent" if value else "plain"))
+def test_download_without_compressor(tmp_path, mode, agent):
+    data = b"temperature,humidity\n" * 2000
+    (tmp_path / "log.csv").write_bytes(data)
+    pico = connect(tmp_path, mode, agent, has_compressor=False)
+    saved = io.BytesIO()
+    assert pico.download_file("log.csv", saved, binary=True, compress=True) == len(data)
+    assert saved.getvalue() == data
+    assert not pico.transfer_stats.compressed
+    # Decompression still works, uploads are compressed
+    assert pico.upload_file(io.BytesIO(data), "copy.csv", compress=True) == len(data)
+    assert (tmp_path / "copy.csv").read_bytes() == data
+    pico.close()
+
+
+@pytest.mark.parametrize("mode, agent", MODES, ids=lambda value: getattr(value, "value", "agent" if value else "plain"))
+def test_download_mixed_blocks(tmp_path, mode, agent):
+    data = b"a" * 8192 + os.urandom(8192) + b"b" * 8192
+    (tmp_path / "mixed.bin").write_bytes(data)
+    pico = connect(tmp_path, mode, agent)
+    saved = io.BytesIO()
+    assert pico.download_file("mixed.bin", saved, binary=True, compress=True) == len(data)
+    assert saved.getvalue() == data
+    assert pico.transfer_stats.compressed
+    pico.close()
+
+
+RESUME_DATA = os.urandom(20_000)
+
+
+@pytest.mark.parametrize("mode, agent", MODES, ids=lambda value: getattr(value, "value", "agent" if value else "plain"))
+@pytest.mark.parametrize("remote, sent", [(RESUME_DATA[:5000], 15_000),      # Interrupted upload
+                                          (b"x" * 5000, 20_000),             # Different file, sent again
+                                          (RESUME_DATA + b"more", 20_000),   # Longer than the local file
+                                          (RESUME_DATA, 0)],                 # Already uploaded
+                         ids=["prefix", "mismatch", "longer", "complete"])
+def test_upload_resume(tmp_path, mode, agent, remote, sent):
+    (tmp_path / "data.bin").write_bytes(remote)
+    pico = connect(tmp_path, mode, agent)
+    assert pico.upload_file(io.BytesIO(RESUME_DATA), "data.bin", resume=True) == sent
+    assert (tmp_path / "data.bin").read_bytes() == RESUME_DATA
+    pico.close()
+
+
+@pytest.mark.parametrize("mode, agent", MODES, ids=lambda value: getattr(value, "value", "agent" if value else "plain"))
+def test_upload_resume_new_file(tmp_path, mode, agent):
+    pico = connect(tmp_path, mode, agent)
+    assert pico.upload_file(io.BytesIO(RESUME_DATA), "data.bin", resume=True) == len(RESUME_DATA)
+    assert (tmp_path / "data.bin").read_bytes() == RESUME_DATA
+    pico.close()
+
+
+@pytest.mark.parametrize("mode, agent", MODES, ids=lambda value: getattr(value, "value", "agent" if value else "plain"))
+@pytest.mark.parametrize("saved, received", [(RESUME_DATA[:7000], 13_000),  # Interrupted download
+                                             (b"x" * 7000, 20_000),         # Different file, truncated
+                                             (RESUME_DATA + b"more", 20_000),  # Longer than the remote file
+                                             (b"", 20_000)],
+                         ids=["prefix", "mismatch", "longer", "empty"])
+def test_download_resume(tmp_path, mode, agent, saved, received):
+    (tmp_path / "data.bin").write_bytes(RESUME_DATA)
+    pico = connect(tmp_path, mode, agent)
+    save_path = tmp_path / "saved.bin"
+    save_path.write_bytes(saved)
+    with open(save_path, "a+b") as save_fp:
+        assert pico.download_file("data.bin", save_fp, binary=True, resume=True) == received
+    assert save_path.read_bytes() == RESUME_DATA
+    pico.close()
+
+
+@pytest.mark.parametrize("mode, agent", MODES, ids=lambda value: getattr(value, "value", "agent" if value else "plain"))
+def test_resume_needs_a_binary_seekable_file(tmp_path, mode, agent):
+    (tmp_path / "data.txt").write_text("hello\n")
+    pico = connect(tmp_path, mode, agent)
+    with pytest.raises(ValueError):
+        pico.download_file("data.txt", io.StringIO(), resume=True)
+    with pytest.raises(FileNotFoundError):
+        pico.download_file("missing.bin", io.BytesIO(), binary=True, resume=True)
+
+    class Unseekable(io.BytesIO):
+        def seekable(self):
+            return False
+    with pytest.raises(ValueError):
+        pico.upload_file(Unseekable(b"data"), "data.txt", resume=True)
+    assert (tmp_path / "data.txt").read_text() == "hello\n" # Untouched
+    pico.close()
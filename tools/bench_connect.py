@@ -0,0 +1,40 @@
+import sys
+import logging
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from picox.upy import Pico
+from picox.logconfig import LOGGER
+
+
+def bench_connect(device: str, connects: int, reboot: bool) -> dict:
+    """Median of each connect step over several connections, in milliseconds"""
+    samples = []
+    for _ in range(connects):
+        pico = Pico(device, reboot_on_connect=reboot)
+        samples.append(pico.connect_metrics)
+        pico.close()
+
+    results = {
+        f"{field.replace('_seconds', '')}_ms": statistics.median(getattr(sample, field) for sample in samples) * 1000
+        for field in samples[0]._fields if field.endswith("_seconds")
+    }
+    results["max_interrupts"] = max(sample.interrupts for sample in samples)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time connecting to a Pico (or `python -m picox.fake`)")
+    parser.add_argument("device", help="Serial device")
+    parser.add_argument("--connects", type=int, default=20, help="Connections to time")
+    args = parser.parse_args()
+    LOGGER.setLevel(logging.INFO)
+
+    results = {label: bench_connect(args.device, args.connects, reboot) for label, reboot in (("reboot", True), ("no-reboot", False))}
+
+    print(f"{'':<20}" + "".join(f"{label:>12}" for label in results))
+    for metric in next(iter(results.values())):
+        print(f"{metric:<20}" + "".join(f"{result[metric]:>12.1f}" for result in results.values()))
@@ -0,0 +1,42 @@
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from picox.upy import Pico, EOR_TOKEN
+from picox.fake import FakeSerial
+from picox.logconfig import LOGGER
+
+
+def bench(size: int, packet_size: int, repeat: int) -> float:
+    """Time a single _serial_read of a response `size` bytes long. Returns best of `repeat`"""
+    response = (b"x" * 63 + b"\n") * (size // 64) + EOR_TOKEN.encode("utf-8") + b" "
+    with tempfile.TemporaryDirectory(prefix="picox-bench-") as root:
+        fake = FakeSerial(Path(root), packet_size=packet_size)
+        pico = Pico("FAKE", skip_stop_exec=True, skip_coms_test=True, serial_factory=lambda **kwargs: fake)
+
+        best = float("inf")
+        for _ in range(repeat):
+            fake.inject(response) # Canned response, the device is not involved
+            start = time.perf_counter()
+            pico._serial_read()
+            best = min(best, time.perf_counter() - start)
+        pico.close()
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Pico._serial_read against a fake serial device")
+    parser.add_argument("--packet-size", type=int, default=64, help="Bytes available per serial read")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per size, best is reported")
+    args = parser.parse_args()
+    LOGGER.setLevel(logging.INFO)
+
+    print(f"{'size':>10} {'seconds':>10} {'ns/byte':>10}")
+    for size in (1_024, 4_096, 16_384, 65_536, 262_144, 1_048_576):
+        elapsed = bench(size, args.packet_size, args.repeat)
+        print(f"{size:>10} {elapsed:>10.5f} {elapsed / size * 1e9:>10.1f}")
@@ -0,0 +1,79 @@
+import io
+import os
+import sys
+import time
+import logging
+import argparse
+import statistics
+from pathlib import Path
+
+import serial
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from picox.upy import Pico, ReplMode
+from picox.logconfig import LOGGER
+
+
+class CountingSerial(serial.Serial):
+    """serial.Serial that counts bytes in each direction"""
+    def __init__(self, *args, **kwargs):
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        super().__init__(*args, **kwargs)
+
+    def write(self, data):
+        self.bytes_sent += len(data)
+        return super().write(data)
+
+    def read(self, size=1):
+        data = super().read(size)
+        self.bytes_received += len(data)
+        return data
+
+
+def bench_mode(device: str, repl_mode: ReplMode, round_trips: int, upload_size: int) -> dict:
+    """Measure round-trip latency and upload throughput for one REPL mode"""
+    opened = []
+    def serial_factory(**kwargs):
+        opened.append(CountingSerial(**kwargs))
+        return opened[-1]
+
+    pico = Pico(device, repl_mode=repl_mode, serial_factory=serial_factory)
+    counter = opened[0]
+
+    pico.coms_test() # Warm up, enters the raw REPL if needed
+    latencies = []
+    for _ in range(round_trips):
+        start = time.perf_counter()
+        pico.coms_test()
+        latencies.append(time.perf_counter() - start)
+
+    payload = os.urandom(upload_size)
+    sent_before, received_before = counter.bytes_sent, counter.bytes_received
+    start = time.perf_counter()
+    pico.upload_file(io.BytesIO(payload), "_bench.bin", overwrite=True)
+    upload_seconds = time.perf_counter() - start
+    pico.run_python_command("import os; os.remove('_bench.bin')")
+
+    return {
+        "median_round_trip_ms": statistics.median(latencies) * 1000,
+        "upload_kb_per_s": upload_size / upload_seconds / 1024,
+        "upload_bytes_sent": counter.bytes_sent - sent_before,
+        "upload_bytes_received": counter.bytes_received - received_before,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare friendly and raw REPL transports on a connected Pico")
+    parser.add_argument("device", help="Serial device")
+    parser.add_argument("--round-trips", type=int, default=50, help="Round trips to time")
+    parser.add_argument("--upload-size", type=int, default=32_768, help="Bytes to upload")
+    args = parser.parse_args()
+    LOGGER.setLevel(logging.INFO)
+
+    results = {mode: bench_mode(args.device, mode, args.round_trips, args.upload_size) for mode in ReplMode}
+
+    print(f"{'':<24}" + "".join(f"{mode.value:>12}" for mode in results))
+    for metric in next(iter(results.values())):
+        print(f"{metric:<24}" + "".join(f"{result[metric]:>12.1f}" for result in results.values()))
@@ -0,0 +1,155 @@
+import io
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+import statistics
+from pathlib import Path
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from picox.upy import Pico
+from picox.fake import LinkEmulation, PtyDevice
+from picox.detect import probe_ports
+from picox.logconfig import LOGGER
+
+# Files on the fake filesystem for get_file_list
+LISTED_FILES = 20
+
+
+def metric(samples: List[float], unit: str, better: str) -> dict:
+    """Summary of repeated measurements. better is "lower" or "higher", used when comparing runs"""
+    return {"median": statistics.median(samples), "min": min(samples), "max": max(samples),
+            "unit": unit, "better": better, "samples": len(samples)}
+
+
+def time_ms(operation: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def bench_session(link: LinkEmulation, sizes: List[int], repeat: int) -> Dict[str, dict]:
+    """Connect, coms test, file listing and transfer throughput against one fake device"""
+    with tempfile.TemporaryDirectory(prefix="picox-bench-") as directory:
+        root = Path(directory)
+        for index in range(LISTED_FILES):
+            (root / f"file_{index:02}.py").write_text(f"value = {index}\n")
+        results = {}
+        with PtyDevice(root, link) as device:
+            for label, reboot in (("connect", True), ("connect_no_reboot", False)):
+                results[f"{label}_ms"] = metric(
+                    time_ms(lambda: Pico(device.path, reboot_on_connect=reboot).close(), repeat), "ms", "lower")
+
+            pico = Pico(device.path)
+            try:
+                results["coms_test_ms"] = metric(time_ms(pico.coms_test, repeat), "ms", "lower")
+                results["get_file_list_ms"] = metric(time_ms(pico.get_file_list, repeat), "ms", "lower")
+
+                rng = random.Random(0)
+                for size in sizes:
+                    data = rng.randbytes(size) # Does not compress, so the link is measured rather than zlib
+                    upload, download = [], []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        pico.upload_file(io.BytesIO(data), "bench.bin", overwrite=True, compress=False)
+                        upload.append(size / 1024 / (time.perf_counter() - start))
+                        start = time.perf_counter()
+                        pico.download_file("bench.bin", io.BytesIO(), binary=True, compress=False)
+                        download.append(size / 1024 / (time.perf_counter() - start))
+                    results[f"upload_{size}_kbps"] = metric(upload, "KB/s", "higher")
+                    results[f"download_{size}_kbps"] = metric(download, "KB/s", "higher")
+            finally:
+                pico.close()
+        return results
+
+
+def bench_detect(link: LinkEmulation, ports: int, repeat: int) -> Dict[str, dict]:
+    """Probe several fake devices at once, as `picox` does to find every Pico"""
+    with tempfile.TemporaryDirectory(prefix="picox-bench-") as directory, contextlib.ExitStack() as stack:
+        devices = []
+        for index in range(ports):
+            root = Path(directory, f"device_{index}")
+            root.mkdir()
+            devices.append(stack.enter_context(PtyDevice(root, link)))
+        paths = [device.path for device in devices]
+        def detect():
+            if len(found := probe_ports(paths)) != ports:
+                raise RuntimeError(f"Detected {len(found)} of {ports} fake devices")
+        return {f"detect_{ports}_ports_ms": metric(time_ms(detect, repeat), "ms", "lower")}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Metrics that are worse than the baseline by more than tolerance (a fraction of the baseline)"""
+    regressions = []
+    for name, current in results["metrics"].items():
+        if (previous := baseline["metrics"].get(name)) is None:
+            continue
+        change = (current["median"] - previous["median"]) / previous["median"]
+        if current["better"] == "higher":
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{name}: {previous['median']:.1f} -> {current['median']:.1f} {current['unit']} "
+                               f"({change:+.0%} worse)")
+    return regressions
+
+
+def picox_version() -> Optional[str]:
+    try:
+        return metadata.version("picox")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark picox against fake devices on pseudo terminals")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements of each metric, the median is reported")
+    parser.add_argument("--sizes", type=lambda text: [int(size) for size in text.split(",")], default=[1024, 16_384, 65_536],
+                        help="Comma separated file sizes for transfer throughput")
+    parser.add_argument("--ports", type=int, default=4, help="Fake devices probed by the detection benchmark")
+    parser.add_argument("--baud", type=int, default=None, help="Emulated UART baud rate (default: no limit)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Emulated seconds added to every transfer")
+    parser.add_argument("--output", type=Path, default=None, help="Write results as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--baseline", type=Path, default=None, help="Earlier --output file. Exits 1 if a metric regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline, as a fraction")
+    args = parser.parse_args()
+    LOGGER.setLevel(logging.WARNING)
+
+    link = LinkEmulation.from_baudrate(args.baud, args.latency)
+    metrics = bench_session(link, args.sizes, args.repeat)
+    metrics.update(bench_detect(link, args.ports, args.repeat))
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "picox": picox_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "link": {"baudrate": args.baud, "latency": args.latency},
+        "metrics": metrics,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'metric':<28}{'median':>12}{'min':>12}{'max':>12}  unit")
+        for name, result in metrics.items():
+            print(f"{name:<28}{result['median']:>12.1f}{result['min']:>12.1f}{result['max']:>12.1f}  {result['unit']}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,78 @@
+import io
+import sys
+import json
+import random
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from picox.upy import Pico
+from picox.fake import FakeSerial
+from picox.logconfig import LOGGER
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent / "src" / "picox"
+
+
+def sample_files(size: int) -> dict:
+    """Source code, a log and random bytes (which do not compress), each about `size` bytes"""
+    source = b"".join(path.read_bytes() for path in sorted(SOURCE_DIR.glob("*.py")))
+    rng = random.Random(0)
+    log_lines = []
+    while sum(map(len, log_lines)) < size:
+        log_lines.append(f"2024-06-02 12:{rng.randrange(60):02}:{rng.randrange(60):02} INFO sensor={rng.randrange(8)} "
+                         f"temp={rng.uniform(18, 30):.2f} humidity={rng.uniform(30, 70):.1f}\n".encode())
+    return {
+        "source.py": (source * (size // len(source) + 1))[:size],
+        "sensors.log": b"".join(log_lines)[:size],
+        "random.bin": rng.randbytes(size),
+    }
+
+
+def bench_file(pico: Pico, name: str, data: bytes, compress: bool) -> dict:
+    """Upload then download a file, returning the effective throughput of each"""
+    pico.upload_file(io.BytesIO(data), name, overwrite=True, compress=compress)
+    upload = pico.transfer_stats
+    pico.download_file(name, io.BytesIO(), binary=True, compress=compress)
+    download = pico.transfer_stats
+    return {
+        "upload_kbps": upload.throughput / 1024, "upload_wire_bytes": upload.wire_bytes,
+        "download_kbps": download.throughput / 1024, "download_wire_bytes": download.wire_bytes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare compressed and plain file transfers")
+    parser.add_argument("device", nargs="?", default=None, help="Serial device. A fake device is used if not set")
+    parser.add_argument("--size", type=int, default=32_768, help="Bytes per sample file")
+    parser.add_argument("--rate", type=float, default=64_000, help="Link speed of the fake device in bytes per second")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+    LOGGER.setLevel(logging.WARNING)
+
+    if args.device:
+        pico = Pico(args.device)
+    else:
+        root = Path(tempfile.mkdtemp(prefix="picox-bench-"))
+        pico = Pico("FAKE", serial_factory=lambda **kwargs: FakeSerial(root, bytes_per_second=args.rate, **kwargs))
+
+    results = {}
+    for name, data in sample_files(args.size).items():
+        plain = bench_file(pico, name, data, compress=False)
+        packed = bench_file(pico, name, data, compress=True)
+        results[name] = {"plain": plain, "compressed": packed}
+    pico.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        sys.exit()
+
+    print(f"{'file':<14}{'direction':<10}{'plain KB/s':>12}{'zlib KB/s':>12}{'gain':>8}{'wire bytes':>22}")
+    for name, result in results.items():
+        for direction in ("upload", "download"):
+            plain, packed = result["plain"], result["compressed"]
+            gain = packed[f"{direction}_kbps"] / plain[f"{direction}_kbps"]
+            wire = f"{plain[f'{direction}_wire_bytes']} -> {packed[f'{direction}_wire_bytes']}"
+            print(f"{name:<14}{direction:<10}{plain[f'{direction}_kbps']:>12.1f}{packed[f'{direction}_kbps']:>12.1f}{gain:>7.2f}x{wire:>22}")
@@ -3,10 +3,10 @@ import sys
 import argparse
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import NamedTuple, List
+from typing import Dict, NamedTuple, List
 
 try:
-    from picox.compiler import compile_file_to_command
+    from picox.compiler import command_key, compile_command
 except ImportError as err:
     COMPILER_IMPORTED = False
     COMPILER_ERROR = err
@@ -18,17 +18,40 @@ class CompiledCommand(NamedTuple):
     command_str: str
     params: List[str]
     file_path: Path
+    original_size: int = 0  # Bytes of the raw command
+    compiled_size: int = 0  # Bytes sent to the device, before parameters are filled in
+    wrapper_size: int = 0   # Bytes of compiled_size taken by exec() and the try statement that reports errors
+    key: str = ""           # Hash of the raw command and compiler, see picox.compiler.command_key
+    reused: bool = False    # Taken from the existing output file, the raw command has not changed
 
 
-def extract_parameters(text):
-    pattern = r'\{([^{}]+)\}(?![^{]*\})'
-    return re.findall(pattern, text)
+# An entry of the output file: the raw command with its key, then its lambda
+ENTRY_PATTERN = re.compile(r'^# (?P<path>.+) \[(?P<key>[0-9a-f]+)\]\n(?P<name>\w+) = lambda (?P<params>.*?) : f"(?P<command_str>.*)"$',
+                           re.MULTILINE)
 
-def compile_file(input_file_path):
-    with input_file_path.open() as input_file_fp:
-        command_str = compile_file_to_command(input_file_fp)
-        params = extract_parameters(command_str)
-    return CompiledCommand(command_str, params, input_file_path)
+
+def read_existing(output_file) -> Dict[str, CompiledCommand]:
+    """Entries already in the output file by command name, empty if there is no file"""
+    try:
+        text = output_file.read_text()
+    except OSError:
+        return {}
+    return {
+        match["name"]: CompiledCommand(match["command_str"], [param for param in match["params"].split(", ") if param],
+                                       Path(match["path"]), key=match["key"], reused=True)
+        for match in ENTRY_PATTERN.finditer(text)
+    }
+
+
+def compile_file(input_file_path, shorten_names=True, existing: Dict[str, CompiledCommand] = {}):
+    """Compile a raw command, or reuse its entry in the output file if neither it nor the compiler changed"""
+    source = input_file_path.read_text()
+    key = command_key(source, shorten_names=shorten_names)
+    if (previous := existing.get(input_file_path.stem)) is not None and previous.key == key:
+        return previous._replace(file_path=input_file_path)
+    compiled = compile_command(source, shorten_names=shorten_names)
+    return CompiledCommand(compiled.command_str, compiled.params, input_file_path, compiled.original_size,
+                           compiled.compiled_size, compiled.wrapper_size, key)
 
 
 if __name__ == "__main__":
@@ -42,6 +65,14 @@ if __name__ == "__main__":
                         help="If you've messed up your compiled commands file, \
                             this will generate stubbed functions to get you over that \
                             to do a full compile again")
+    parser.add_argument('--keep-names',
+                        action="store_true",
+                        default=False,
+                        help="Keep the names of local variables instead of shortening them")
+    parser.add_argument('--force',
+                        action="store_true",
+                        default=False,
+                        help="Compile every command, even those unchanged since the output file was written")
 
     args = parser.parse_args()
     compiled_commands = []
@@ -61,19 +92,21 @@ if __name__ == "__main__":
         sys.exit(1)
 
     if args.file_path.is_dir():
-        files_to_process = args.file_path.iterdir()
+        files_to_process = sorted(args.file_path.iterdir())
     elif args.file_path.is_file():
         files_to_process = [args.file_path]
     else:
         print("Invalid file or directory path")
         sys.exit(1)
 
+    # Only commands whose source changed are compiled again
+    existing = {} if args.force or args.generate_stub else read_existing(args.output_file)
     for file_path in files_to_process:
         if file_path.is_file():  # Check each path if it's a file
             if args.generate_stub:
                 compiled_commands.append(CompiledCommand("", [], file_path))
             else:
-                compiled_commands.append(compile_file(file_path))
+                compiled_commands.append(compile_file(file_path, shorten_names=not args.keep_names, existing=existing))
 
 
     # Create output file contents
@@ -81,7 +114,7 @@ if __name__ == "__main__":
     output_lines.append(f"# Auto-generated with compile.py at {datetime.now(timezone.utc)}")
     for compiled_command in compiled_commands:
         output_lines.append("")
-        output_lines.append(f"# {compiled_command.file_path}")
+        output_lines.append(f"# {compiled_command.file_path} [{compiled_command.key}]" if compiled_command.key else f"# {compiled_command.file_path}")
         output_lines.append(f"{compiled_command.file_path.stem} = lambda {', '.join(compiled_command.params)} : f\"{compiled_command.command_str}\"")
 
     # Write output to file specified by output_file
@@ -91,3 +124,15 @@ if __name__ == "__main__":
     except (IsADirectoryError, FileNotFoundError, OSError, IOError) as err:
         print(f"Unable to save compiled commands: {err}")
     print(f"Output written to {args.output_file}")
+
+    # Bytes sent to the device per command, before parameters are filled in
+    if not args.generate_stub:
+        print("Bytes per command: source -> sent to the device, split into the minified code and the exec() and "
+              "try/except wrapper that reports errors. Short commands grow by the wrapper")
+        for compiled_command in compiled_commands:
+            if compiled_command.reused:
+                print(f"{compiled_command.file_path.stem:<28}unchanged")
+            else:
+                code_size = compiled_command.compiled_size - compiled_command.wrapper_size
+                print(f"{compiled_command.file_path.stem:<28}{compiled_command.original_size:>6} -> "
+                      f"{compiled_command.compiled_size:>6} bytes ({code_size} code + {compiled_command.wrapper_size} wrapper)")